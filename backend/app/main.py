@@ -1,28 +1,90 @@
 # app/main.py
 from __future__ import annotations
 
+import time
+_IMPORT_STARTED = time.perf_counter()
+
 import os
+import re
 import json
-from typing import Any, Dict
+import asyncio
+import logging
+import threading
+from contextlib import asynccontextmanager
+from typing import Any, Dict, TYPE_CHECKING
 
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 
 # Your feature routers
 from app.routers.reconcile import router as reconcile_router
+from app.services.orders_db import warm_up_mongo
+from app.services.reconcile_engine import keep_orders_snapshot_fresh, keep_live_na
+from app.services.orders_snapshot import SNAPSHOT_ENABLED
+from app.services.live_na import LIVE_NA_ENABLED
 from app.routers.razorpay_export import router as razorpay_router
+from app.services.razorpay_client import close_razorpay_clients
+from app.services.metrics import registry as metrics_registry
+from app.services.responses import CompressionMiddleware, dumps
+from app.services.reconcile_service import reconcile
+
+# LangGraph / LangChain are imported lazily in _get_agent(): they are slow to import
+# and only the LLM path of /agent/run needs them.
+
+log = logging.getLogger("app.startup")
+
+
+# --------------------------------------------------------------------------------------
+# Startup: nothing external is touched at import time. The lifespan hook kicks off
+# warm-up (Mongo ping, agent build) concurrently in the background, so the worker
+# starts serving right away; the lazy getters cover requests that arrive first.
+# It also starts the opt-in background workers (orders snapshot, live NA).
+# Set STARTUP_WARMUP=0 to skip warm-up entirely.
+# --------------------------------------------------------------------------------------
+startup_stats: Dict[str, Any] = {"warmup": {}}
+
+async def _timed_warmup(name: str, fn) -> None:
+    t0 = time.perf_counter()
+    try:
+        await asyncio.to_thread(fn)
+        startup_stats["warmup"][name] = {"ok": True, "seconds": round(time.perf_counter() - t0, 3)}
+    except Exception as e:
+        startup_stats["warmup"][name] = {"ok": False, "seconds": round(time.perf_counter() - t0, 3),
+                                         "error": str(getattr(e, "detail", e))}
+    log.info("warm-up %s: %s", name, startup_stats["warmup"][name])
 
-# LangGraph / LangChain
-from langgraph.prebuilt import create_react_agent
-from langchain_openai import ChatOpenAI
-from langchain.tools import tool
-import httpx
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    startup_stats["ready_seconds"] = round(time.perf_counter() - _IMPORT_STARTED, 3)
+    log.info("app ready %.3fs after import started", startup_stats["ready_seconds"])
+    warmup = None
+    if os.getenv("STARTUP_WARMUP", "1") != "0":
+        # gather() schedules both right away; we don't wait for them here
+        warmup = asyncio.gather(
+            _timed_warmup("mongo", warm_up_mongo),
+            _timed_warmup("agent", _get_agent),
+        )
+    # in-memory order transaction ids for match_strategy=snapshot (ORDERS_SNAPSHOT=1 enables)
+    snapshot_task = asyncio.create_task(keep_orders_snapshot_fresh()) if SNAPSHOT_ENABLED else None
+    # live NA set behind GET /reconcile/live-na (LIVE_NA=1 enables)
+    live_na_task = asyncio.create_task(keep_live_na()) if LIVE_NA_ENABLED else None
+    yield
+    if warmup is not None and not warmup.done():
+        warmup.cancel()
+    if snapshot_task is not None:
+        snapshot_task.cancel()
+        await asyncio.gather(snapshot_task, return_exceptions=True)
+    if live_na_task is not None:
+        live_na_task.cancel()
+        await asyncio.gather(live_na_task, return_exceptions=True)
+    await close_razorpay_clients()
 
 
 # --------------------------------------------------------------------------------------
 # FastAPI app
 # --------------------------------------------------------------------------------------
-app = FastAPI(title="Diffrun Admin Backend", version="1.0.0")
+app = FastAPI(title="Diffrun Admin Backend", version="1.0.0", lifespan=lifespan)
 
 # CORS (tighten origins in prod)
 app.add_middleware(
@@ -33,19 +95,21 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# gzip/zstd for the big reconcile, orders and export bodies (RESPONSE_COMPRESSION=0 to disable)
+if os.getenv("RESPONSE_COMPRESSION", "1") != "0":
+    app.add_middleware(CompressionMiddleware, path_prefixes=("/reconcile", "/razorpay"))
+
 # Include your routers
 app.include_router(reconcile_router)
 app.include_router(razorpay_router)
 
 
 # --------------------------------------------------------------------------------------
-# Tool: call your existing reconcile endpoint and return JSON (as a string)
-#   NOTE: Make it SYNC + return a STRING. LangGraph/LC tools work very reliably this way.
+# Tool: run the reconcile in-process and return JSON (as a string)
+#   Async so it runs on the event loop instead of blocking a worker thread; it goes
+#   through the same job manager as the HTTP route, so identical runs are shared.
 # --------------------------------------------------------------------------------------
-API_BASE = (os.getenv("INTERNAL_API_BASE") or "http://127.0.0.1:8000").rstrip("/")
-
-@tool("tool_reconcile", return_direct=False)
-def tool_reconcile(
+async def tool_reconcile(
     from_date: str | None = None,
     to_date: str | None = None,
     na_status: str = "captured",
@@ -53,29 +117,21 @@ def tool_reconcile(
     max_fetch: int = 200000,
 ) -> str:
     """
-    Reconcile Razorpay payments vs Mongo orders using the backend endpoint.
+    Reconcile Razorpay payments vs Mongo orders.
     Returns a JSON STRING with keys: summary, na_payment_ids, na_by_status.
     """
-    params = {
-        "na_status": na_status,
-        "case_insensitive_ids": str(bool(case_insensitive_ids)).lower(),
-        "max_fetch": str(int(max_fetch)),
-    }
-    if from_date:
-        params["from_date"] = from_date
-    if to_date:
-        params["to_date"] = to_date
-
-    url = f"{API_BASE}/reconcile/vlookup-payment-to-orders/auto"
     try:
-        # sync request (works fine inside LangChain tool)
-        resp = httpx.get(url, params=params, timeout=120.0)
-        resp.raise_for_status()
-        # Ensure we return a JSON STRING
-        return json.dumps(resp.json(), separators=(",", ":"))
-    except httpx.HTTPError as e:
+        result = await reconcile(
+            from_date=from_date,
+            to_date=to_date,
+            na_status=na_status,
+            case_insensitive_ids=bool(case_insensitive_ids),
+            max_fetch=int(max_fetch),
+        )
+    except HTTPException as e:
         # Return JSON string describing the error (agent will still surface it)
-        return json.dumps({"error": f"tool_reconcile failed: {str(e)}"}, separators=(",", ":"))
+        return json.dumps({"error": f"tool_reconcile failed: {e.detail}"}, separators=(",", ":"), default=str)
+    return dumps(result).decode("utf-8")
 
 
 # --------------------------------------------------------------------------------------
@@ -83,6 +139,8 @@ def tool_reconcile(
 #   IMPORTANT: We instruct the agent to output ONLY the tool's JSON verbatim.
 # --------------------------------------------------------------------------------------
 def _get_llm():
+    from langchain_openai import ChatOpenAI
+
     api_key = os.getenv("OPENAI_API_KEY")
     if not api_key:
         raise RuntimeError("OPENAI_API_KEY not set")
@@ -98,11 +156,24 @@ AGENT_SYSTEM_PROMPT = (
     "Your final answer must be valid minified JSON."
 )
 
-agent = create_react_agent(
-    model=_get_llm(),
-    tools=[tool_reconcile],
-    prompt=AGENT_SYSTEM_PROMPT,
-)
+_agent = None
+_agent_lock = threading.Lock()
+
+def _get_agent():
+    """Build the ReAct agent on first use (thread-safe; also called by warm-up)."""
+    global _agent
+    if _agent is None:
+        with _agent_lock:
+            if _agent is None:
+                from langgraph.prebuilt import create_react_agent
+                from langchain.tools import tool
+
+                _agent = create_react_agent(
+                    model=_get_llm(),
+                    tools=[tool("tool_reconcile", return_direct=False)(tool_reconcile)],
+                    prompt=AGENT_SYSTEM_PROMPT,
+                )
+    return _agent
 
 
 # --------------------------------------------------------------------------------------
@@ -111,11 +182,12 @@ agent = create_react_agent(
 from pydantic import BaseModel
 from typing import Any, Dict, List, Union
 
-# LangChain message types
-try:
-    from langchain_core.messages import BaseMessage  # newer
-except Exception:
-    from langchain.schema import BaseMessage  # fallback for older versions
+# LangChain message types (annotations only; see the lazy imports above)
+if TYPE_CHECKING:
+    try:
+        from langchain_core.messages import BaseMessage  # newer
+    except Exception:
+        from langchain.schema import BaseMessage  # fallback for older versions
 
 class AgentRequest(BaseModel):
     message: str
@@ -154,6 +226,71 @@ def _find_last_json_text(messages: List[BaseMessage]) -> Union[str, None]:
             return text
     return None
 
+# --------------------------------------------------------------------------------------
+# Fast path: plain "reconcile <dates> <status>" messages are parsed with rules and run
+# directly, skipping the two LLM round trips. Anything with words we don't recognise
+# goes to the agent.
+# --------------------------------------------------------------------------------------
+_ISO_DATE = re.compile(r"\b\d{4}-\d{2}-\d{2}\b")
+_NA_STATUSES = {"captured", "authorized", "failed", "refunded", "created"}
+_CASE_INSENSITIVE = re.compile(r"\b(case[- ]insensitive(ly)?|ignore[- ]case|ignoring case)\b")
+_ALL_TIME = re.compile(r"\ball[- ]time\b")
+# "on 2025-08-15" / "for 2025-08-15": that one day
+_SINGLE_DAY = re.compile(r"\b(on|for)\s+\d{4}-\d{2}-\d{2}\b")
+# words that change the scope ("all", "any status", ...) are not filler: those
+# messages go to the agent rather than silently becoming captured-only
+_FILLER_WORDS = {
+    "reconcile", "reconciliation", "reconciliations", "run", "do", "please", "pls", "a", "an",
+    "the", "for", "from", "to", "till", "until", "through", "between", "and", "-", "only",
+    "just", "payments", "payment", "razorpay", "orders", "order", "vs", "versus", "against",
+    "with", "na", "time", "ids", "dates", "date", "on", "of", "in", "me",
+}
+# fine next to a named status ("status captured"), not on their own
+_STATUS_WORDS = {"status", "statuses"}
+
+def _parse_reconcile_intent(message: str) -> Union[Dict[str, Any], None]:
+    """Return reconcile kwargs for simple requests, or None if the agent should handle it."""
+    text = message.strip().lower()
+    if "reconcil" not in text:
+        return None
+
+    dates = _ISO_DATE.findall(text)
+    if len(dates) > 2:
+        return None
+    rest = _ISO_DATE.sub(" ", text)
+
+    case_insensitive = bool(_CASE_INSENSITIVE.search(rest))
+    rest = _CASE_INSENSITIVE.sub(" ", rest)
+    rest = _ALL_TIME.sub(" ", rest)
+
+    statuses = [w for w in re.findall(r"[a-z]+", rest) if w in _NA_STATUSES]
+    if len(set(statuses)) > 1:
+        return None
+
+    leftover = [
+        w for w in re.findall(r"[a-z0-9-]+", rest)
+        if w not in _FILLER_WORDS and w not in _NA_STATUSES
+        and not (w in _STATUS_WORDS and statuses)
+    ]
+    if leftover:
+        return None
+
+    dates = sorted(dates)
+    from_date = dates[0] if dates else None
+    to_date = dates[-1] if len(dates) == 2 else None
+    if len(dates) == 1 and re.search(r"\b(to|till|until|through)\s+\d{4}-", text):
+        from_date, to_date = None, dates[0]
+    elif len(dates) == 1 and _SINGLE_DAY.search(text):
+        # a bare date as to_date means its midnight; cover the whole day
+        from_date, to_date = dates[0], f"{dates[0]}T23:59:59"
+    return {
+        "from_date": from_date,
+        "to_date": to_date,
+        "na_status": statuses[0] if statuses else "captured",
+        "case_insensitive_ids": case_insensitive,
+    }
+
+
 @app.post("/agent/run", response_model=AgentResponse)
 async def run_agent(req: AgentRequest):
     """
@@ -161,7 +298,17 @@ async def run_agent(req: AgentRequest):
     Body: { "message": "reconcile 2025-08-15 to 2025-08-25 captured only" }
     Returns parsed JSON from tool_reconcile (summary, na_payment_ids, etc.)
     """
+    intent = _parse_reconcile_intent(req.message)
+    if intent is not None:
+        try:
+            result = await reconcile(**intent)
+        except HTTPException as e:
+            # same shape tool_reconcile reports failures in
+            return AgentResponse(result={"error": f"tool_reconcile failed: {e.detail}"})
+        return AgentResponse(result=result)
+
     try:
+        agent = await asyncio.to_thread(_get_agent)
         out = await agent.ainvoke({"messages": [{"role": "user", "content": req.message}]})
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Agent error: {e}")
@@ -190,3 +337,15 @@ async def run_agent(req: AgentRequest):
         return AgentResponse(result={"error": "Assistant did not return valid JSON", "raw_text": text[:2000]})
 
     return AgentResponse(result=parsed)
+
+
+@app.get("/health/startup")
+async def health_startup():
+    """Startup timings: import -> ready, and per-resource warm-up results."""
+    return startup_stats
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Per-stage reconcile/export timings and counters, Prometheus text format."""
+    return PlainTextResponse(metrics_registry.render(), media_type="text/plain; version=0.0.4")
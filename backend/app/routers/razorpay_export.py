@@ -1,24 +1,85 @@
 # app/routers/razorpay_payments_csv.py
-import os, io, csv
-from datetime import datetime
-from typing import Any, Dict, List, Optional
+import os, io, re, csv, time, asyncio, operator, functools
+from datetime import date, datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional
 import httpx
 from fastapi import APIRouter, Query, HTTPException
 from fastapi.responses import StreamingResponse
 from dateutil import parser as dtparser
 from dotenv import load_dotenv
 
+from app.services.payments_mirror import get_mirror, MIRROR_MODES
+from app.services.razorpay_client import get_razorpay_client, RazorpayClient
+from app.services.metrics import RunTimings
+from app.services.payments_export import EXPORT_FORMATS, MEDIA_TYPES, make_encoder
+
 router = APIRouter(prefix="/razorpay", tags=["razorpay"])
 
 load_dotenv()
 
-RZP_BASE = "https://api.razorpay.com/v1"
+RZP_BASE = os.getenv("RAZORPAY_API_BASE", "https://api.razorpay.com/v1")
+FETCH_CONCURRENCY = int(os.getenv("RZP_FETCH_CONCURRENCY", "8"))
 KEY_ID = os.getenv("RAZORPAY_KEY_ID")
 KEY_SECRET = os.getenv("RAZORPAY_KEY_SECRET")
 
-def _assert_keys():
-    if not KEY_ID or not KEY_SECRET:
-        raise HTTPException(500, detail="RAZORPAY_KEY_ID/RAZORPAY_KEY_SECRET not set on backend")
+# ---- Accounts ----------------------------------------------------------------
+# RAZORPAY_ACCOUNTS="main,uk" configures several merchant accounts; each reads
+# RAZORPAY_KEY_ID_<NAME> / RAZORPAY_KEY_SECRET_<NAME>. The name "default" (and an
+# unset RAZORPAY_ACCOUNTS) uses RAZORPAY_KEY_ID / RAZORPAY_KEY_SECRET. The first
+# account listed is the one single-account endpoints use unless told otherwise.
+DEFAULT_ACCOUNT = "default"
+
+def _account_slug(name: str) -> str:
+    return re.sub(r"[^A-Za-z0-9]+", "_", name).strip("_")
+
+def _key_vars(name: str) -> tuple:
+    if name == DEFAULT_ACCOUNT:
+        return "RAZORPAY_KEY_ID", "RAZORPAY_KEY_SECRET"
+    suffix = _account_slug(name).upper()
+    return f"RAZORPAY_KEY_ID_{suffix}", f"RAZORPAY_KEY_SECRET_{suffix}"
+
+def _load_accounts() -> Dict[str, tuple]:
+    names = [n.strip() for n in os.getenv("RAZORPAY_ACCOUNTS", "").split(",") if n.strip()]
+    return {name: tuple(os.getenv(v) for v in _key_vars(name)) for name in (names or [DEFAULT_ACCOUNT])}
+
+ACCOUNTS: Dict[str, tuple] = _load_accounts()
+PRIMARY_ACCOUNT = next(iter(ACCOUNTS))
+_ACCOUNTS_BY_LOWER = {name.lower(): name for name in ACCOUNTS}
+
+def _account_name(account: Optional[str]) -> str:
+    """Configured spelling of an account name (names match case-insensitively)."""
+    if not account:
+        return PRIMARY_ACCOUNT
+    return _ACCOUNTS_BY_LOWER.get(account.lower(), account)
+
+def _assert_keys(account: Optional[str] = None):
+    name = _account_name(account)
+    if name not in ACCOUNTS:
+        raise HTTPException(400, detail=f"Unknown Razorpay account {name!r}; configured: {', '.join(ACCOUNTS)}")
+    key_id, key_secret = ACCOUNTS[name]
+    if not key_id or not key_secret:
+        raise HTTPException(500, detail="{}/{} not set on backend".format(*_key_vars(name)))
+
+def resolve_accounts(spec: Optional[str]) -> List[str]:
+    """Account names for a comma-separated `accounts` parameter (None / "all" = every account)."""
+    spec = (spec or "").strip()
+    if not spec or spec.lower() == "all":
+        names = list(ACCOUNTS)
+    else:
+        names = list(dict.fromkeys(_account_name(n.strip()) for n in spec.split(",") if n.strip()))
+    for name in names:
+        _assert_keys(name)
+    return names
+
+def razorpay_client(account: Optional[str] = None) -> RazorpayClient:
+    """The process-wide pooled, rate-limited client for an account's key pair."""
+    _assert_keys(account)
+    return get_razorpay_client(*ACCOUNTS[_account_name(account)])
+
+def _mirror(account: Optional[str]):
+    name = _account_name(account)
+    # the default account keeps the original mirror file
+    return get_mirror(None if name == DEFAULT_ACCOUNT else _account_slug(name))
 
 def amount_to_display(v: Any) -> str:
     # Razorpay amounts are subunits (paise). 148500 -> 1485.00
@@ -38,53 +99,613 @@ def ts_to_ddmmyyyy_hhmmss(ts: Any) -> str:
     except Exception:
         return ""
 
-async def fetch_payments(
+COUNT = 100  # Razorpay max per call
+# what a reconcile keeps of each payment (light=True); the mirror's light query
+# returns the same keys
+LIGHT_FIELDS = ("id", "status", "created_at", "amount", "amount_refunded", "currency")
+
+async def iter_payment_pages(
     client: httpx.AsyncClient,
     *,
     status_filter: Optional[str],
     from_unix: Optional[int],
     to_unix: Optional[int],
-    max_fetch: int = 10000,
-) -> List[Dict[str, Any]]:
-    items: List[Dict[str, Any]] = []
+    max_fetch: int,
+    light: bool = False,
+    on_page: Optional[Callable[[int], None]] = None,
+):
+    """
+    Serially page one [from, to] window, yielding each (filtered) page as it arrives.
+    light=True trims every row to LIGHT_FIELDS on arrival (and skips the card expansion).
+    on_page(n) is called after every Razorpay round trip with the rows kept from it.
+    """
+    fetched = 0
     skip = 0
-    COUNT = 100  # Razorpay max per call
 
-    while True:
+    while fetched < max_fetch:
         params: Dict[str, Any] = {"count": COUNT, "skip": skip}
         if from_unix is not None: params["from"] = from_unix
         if to_unix is not None:   params["to"]   = to_unix
 
         # include UPI/card context where available
-        params["expand[]"] = "card"
+        if not light:
+            params["expand[]"] = "card"
 
         r = await client.get(f"{RZP_BASE}/payments", params=params)
         r.raise_for_status()
         data = r.json()
-        batch = data.get("items", []) or []
+        page = data.get("items", []) or []
+        batch = page
         if status_filter:
             sf = status_filter.lower()
-            batch = [p for p in batch if (p.get("status") or "").lower() == sf]
-        items.extend(batch)
+            batch = [p for p in page if (p.get("status") or "").lower() == sf]
+        batch = batch[:max_fetch - fetched]
+        if light:
+            batch = [{k: p.get(k) for k in LIGHT_FIELDS} for p in batch]
+        fetched += len(batch)
+        if on_page is not None:
+            on_page(len(batch))
+        if batch:
+            yield batch
 
-        if len(batch) < COUNT or len(items) >= max_fetch:
+        # stop on a short *raw* page; a filtered page can be short while more remain
+        if len(page) < COUNT:
             break
         skip += COUNT
 
+async def _fetch_window(
+    client: httpx.AsyncClient,
+    *,
+    status_filter: Optional[str],
+    from_unix: Optional[int],
+    to_unix: Optional[int],
+    max_fetch: int,
+    light: bool = False,
+    on_page: Optional[Callable[[int], None]] = None,
+) -> List[Dict[str, Any]]:
+    """Collect one window (newest first, like Razorpay returns it)."""
+    items: List[Dict[str, Any]] = []
+    async for batch in iter_payment_pages(
+        client, status_filter=status_filter, from_unix=from_unix,
+        to_unix=to_unix, max_fetch=max_fetch, light=light, on_page=on_page,
+    ):
+        items.extend(batch)
+    return items
+
+async def fetch_refunded_payment_ids(
+    client: httpx.AsyncClient,
+    *,
+    from_unix: int,
+) -> List[str]:
+    """Ids of payments with a refund created since from_unix (refunds are listed like payments)."""
+    ids: Dict[str, None] = {}
+    skip = 0
+    while True:
+        r = await client.get(f"{RZP_BASE}/refunds", params={"count": COUNT, "skip": skip, "from": from_unix})
+        r.raise_for_status()
+        page = r.json().get("items", []) or []
+        for refund in page:
+            if refund.get("payment_id"):
+                ids[refund["payment_id"]] = None
+        if len(page) < COUNT:
+            return list(ids)
+        skip += COUNT
+
+async def fetch_payments_by_id(
+    client: httpx.AsyncClient,
+    payment_ids: List[str],
+    *,
+    concurrency: int = FETCH_CONCURRENCY,
+) -> List[Dict[str, Any]]:
+    """Current state of the given payments, one GET /payments/{id} each (bounded concurrency)."""
+    sem = asyncio.Semaphore(max(1, concurrency))
+
+    async def _one(pid: str) -> Dict[str, Any]:
+        async with sem:
+            r = await client.get(f"{RZP_BASE}/payments/{pid}", params={"expand[]": "card"})
+            r.raise_for_status()
+            return r.json()
+
+    return list(await asyncio.gather(*(_one(pid) for pid in payment_ids)))
+
+# ---- Sharded fetch -----------------------------------------------------------
+# The [from, to] window is split into time shards that are paged concurrently.
+# When from_date is omitted, shards cover [RZP_HISTORY_START, to] and the oldest
+# shard is left open-ended so nothing before the start date is missed.
+FETCH_SHARDS = int(os.getenv("RZP_FETCH_SHARDS", "32"))
+HISTORY_START = int(os.getenv("RZP_HISTORY_START", "1577836800"))  # 2020-01-01 UTC
+MIN_SHARD_SECONDS = 3600
+
+def _time_shards(from_unix: Optional[int], to_unix: Optional[int], shards: int) -> List[tuple]:
+    hi = to_unix if to_unix is not None else int(time.time())
+    lo = from_unix if from_unix is not None else HISTORY_START
+    if shards <= 1 or hi - lo < 2 * MIN_SHARD_SECONDS:
+        return [(from_unix, to_unix)]
+
+    n = min(shards, (hi - lo) // MIN_SHARD_SECONDS)
+    step = (hi - lo) / n
+    edges = [lo + int(step * i) for i in range(n)] + [hi]
+    # adjacent shards share their boundary second; duplicates are dropped on merge
+    out = [(edges[i], edges[i + 1]) for i in range(n)]
+    out[0] = (from_unix, out[0][1])    # None => open-ended oldest shard
+    out[-1] = (out[-1][0], to_unix)    # None => up to "now" at request time
+    return out
+
+async def fetch_payments(
+    client: httpx.AsyncClient,
+    *,
+    status_filter: Optional[str],
+    from_unix: Optional[int],
+    to_unix: Optional[int],
+    max_fetch: int = 10000,
+    concurrency: int = FETCH_CONCURRENCY,
+    light: bool = False,
+    on_page: Optional[Callable[[int], None]] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Fetch payments in [from_unix, to_unix], newest first, at most max_fetch rows.
+    Time shards are paged concurrently (bounded by `concurrency`), newest first,
+    and stop as soon as newer shards hold enough rows, then merged and deduped by
+    payment id. The result is the same as a serial walk of the window.
+    light=True keeps only LIGHT_FIELDS of each row, trimmed page by page, so a
+    large pull never holds the full payment objects.
+    """
+    shards = _time_shards(from_unix, to_unix, FETCH_SHARDS if concurrency > 1 else 1)
+    if len(shards) == 1:
+        return await _fetch_window(
+            client, status_filter=status_filter, from_unix=from_unix,
+            to_unix=to_unix, max_fetch=max_fetch, light=light, on_page=on_page,
+        )
+
+    sem = asyncio.Semaphore(max(1, concurrency))
+    # newest shard first: every row of shard i ranks ahead of every row of shard
+    # i + 1, so shard i is done once shards 0..i hold max_fetch rows between them
+    shards = shards[::-1]
+    kept = [0] * len(shards)
+
+    async def _run(i: int, lo: Optional[int], hi: Optional[int]) -> List[Dict[str, Any]]:
+        items: List[Dict[str, Any]] = []
+        # rows in the boundary second shared with the newer shard are counted
+        # there, so duplicates can't make an older shard look unneeded
+        shared = hi if i > 0 else None
+        async with sem:
+            if sum(kept[:i]) >= max_fetch:
+                return items  # newer shards already cover the first max_fetch rows
+            pages = iter_payment_pages(
+                client, status_filter=status_filter, from_unix=lo,
+                to_unix=hi, max_fetch=max_fetch, light=light, on_page=on_page,
+            )
+            try:
+                async for batch in pages:
+                    items.extend(batch)
+                    kept[i] += len(batch) if shared is None else \
+                        sum(1 for p in batch if (p.get("created_at") or 0) < shared)
+                    if sum(kept[:i + 1]) >= max_fetch:
+                        break
+            finally:
+                await pages.aclose()
+        return items
+
+    # created (and so admitted by the semaphore) newest first
+    tasks = [asyncio.create_task(_run(i, lo, hi)) for i, (lo, hi) in enumerate(shards)]
+    try:
+        results = await asyncio.gather(*tasks)
+    except BaseException:
+        for t in tasks:
+            t.cancel()
+        raise
+
+    merged: Dict[str, Dict[str, Any]] = {}
+    for batch in results:
+        for p in batch:
+            pid = p.get("id")
+            if pid is None:
+                continue
+            merged.setdefault(pid, p)
+
+    items = sorted(merged.values(), key=lambda p: p.get("created_at") or 0, reverse=True)
     return items[:max_fetch]
 
+async def for_each_payment_page(
+    client: httpx.AsyncClient,
+    handle: Callable[[List[Dict[str, Any]]], Awaitable[None]],
+    *,
+    status_filter: Optional[str],
+    from_unix: Optional[int],
+    to_unix: Optional[int],
+    max_fetch: int,
+    concurrency: int = FETCH_CONCURRENCY,
+    on_page: Optional[Callable[[int], None]] = None,
+) -> int:
+    """
+    Page [from_unix, to_unix] in concurrent time shards and await handle(page)
+    for every page as it arrives, so the window is never held in memory. Pages
+    come in no particular order, and rows created in a shard-boundary second
+    can be handed over twice (fine for upserts). Stops once about max_fetch
+    rows were handed over; returns how many were.
+    """
+    shards = _time_shards(from_unix, to_unix, FETCH_SHARDS if concurrency > 1 else 1)
+    sem = asyncio.Semaphore(max(1, concurrency))
+    handed = 0
+
+    async def _run(lo: Optional[int], hi: Optional[int]) -> None:
+        nonlocal handed
+        async with sem:
+            if handed >= max_fetch:
+                return
+            pages = iter_payment_pages(
+                client, status_filter=status_filter, from_unix=lo,
+                to_unix=hi, max_fetch=max_fetch, on_page=on_page,
+            )
+            try:
+                async for batch in pages:
+                    handed += len(batch)
+                    await handle(batch)
+                    if handed >= max_fetch:
+                        break
+            finally:
+                await pages.aclose()
+
+    tasks = [asyncio.create_task(_run(lo, hi)) for lo, hi in shards[::-1]]
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException:
+        for t in tasks:
+            t.cancel()
+        raise
+    return handed
+
+async def load_payments(
+    client: httpx.AsyncClient,
+    *,
+    status_filter: Optional[str],
+    from_unix: Optional[int],
+    to_unix: Optional[int],
+    max_fetch: int,
+    mirror: str = "off",
+    light: bool = False,
+    on_page: Optional[Callable[[int], None]] = None,
+    account: Optional[str] = None,
+) -> tuple:
+    """
+    Payments for a window: fetched live (mirror="off"), or served from the
+    account's local mirror after an incremental / full sync. light=True returns
+    only LIGHT_FIELDS per payment, either way.
+    Returns (payments, mirror_info); mirror_info is None for live pulls.
+    """
+    if mirror not in MIRROR_MODES:
+        raise HTTPException(400, detail=f"mirror must be one of {', '.join(MIRROR_MODES)}")
+
+    if mirror == "off":
+        payments = await fetch_payments(
+            client,
+            status_filter=status_filter,
+            from_unix=from_unix,
+            to_unix=to_unix,
+            max_fetch=max_fetch,
+            light=light,
+            on_page=on_page,
+        )
+        return payments, None
+
+    m = _mirror(account)
+    info = await m.sync(client, full=(mirror == "full"), on_page=on_page)
+    payments = await m.query(
+        status_filter=status_filter,
+        from_unix=from_unix,
+        to_unix=to_unix,
+        max_fetch=max_fetch,
+        light=light,
+    )
+    return payments, info
+
+async def load_accounts_payments(
+    accounts: List[str],
+    *,
+    status_filter: Optional[str],
+    from_unix: Optional[int],
+    to_unix: Optional[int],
+    max_fetch: int,
+    mirror: str = "off",
+    light: bool = False,
+    on_page: Optional[Callable[[str, int], None]] = None,
+) -> tuple:
+    """
+    load_payments for several accounts concurrently, each with its own client,
+    rate limit and mirror (max_fetch applies per account). Every payment is
+    tagged with payment["account"]. on_page(account, rows) reports each page.
+    Returns (payments, {account: mirror_info}).
+    """
+    async def _one(name: str) -> tuple:
+        page_cb = functools.partial(on_page, name) if on_page is not None else None
+        try:
+            payments, info = await load_payments(
+                razorpay_client(name),
+                status_filter=status_filter,
+                from_unix=from_unix,
+                to_unix=to_unix,
+                max_fetch=max_fetch,
+                mirror=mirror,
+                light=light,
+                on_page=page_cb,
+                account=name,
+            )
+        except httpx.HTTPStatusError as e:
+            if len(accounts) == 1:
+                raise
+            raise HTTPException(status_code=e.response.status_code, detail=f"[{name}] {e.response.text}")
+        except httpx.RequestError as e:
+            if len(accounts) == 1:
+                raise
+            raise HTTPException(status_code=502, detail=f"[{name}] Network error calling Razorpay: {e}")
+        for p in payments:
+            p["account"] = name
+        return payments, info
+
+    tasks = [asyncio.create_task(_one(name)) for name in accounts]
+    try:
+        results = await asyncio.gather(*tasks)
+    except BaseException:
+        for t in tasks:
+            t.cancel()
+        raise
+    if len(results) == 1:
+        payments, info = results[0]
+        return payments, {accounts[0]: info}
+    payments = [p for batch, _ in results for p in batch]
+    return payments, {name: info for name, (_, info) in zip(accounts, results)}
+
+@router.post("/mirror/sync")
+async def mirror_sync(
+    full: bool = Query(False, description="Drop the mirror and re-pull all history"),
+    account: Optional[str] = Query(None, description="Razorpay account (see RAZORPAY_ACCOUNTS); default: the first"),
+):
+    """Sync the local payments mirror now (full=true for a full resync)."""
+    try:
+        return await _mirror(account).sync(razorpay_client(account), full=full)
+    except httpx.HTTPStatusError as e:
+        raise HTTPException(status_code=e.response.status_code, detail=e.response.text)
+    except httpx.RequestError as e:
+        raise HTTPException(status_code=502, detail=f"Network error calling Razorpay: {e}")
+
+# Columns tailored to the Razorpay payment JSON
+CSV_HEADER = [
+    "id","amount","currency","status","order_id","invoice_id","international","method",
+    "amount_refunded","refund_status","captured","description","card_id","bank","wallet",
+    "vpa","email","contact","notes","fee","tax","error_code","error_description","created_at",
+    "Payments_RRN","Payments_ARN","Auth_code","flow"
+]
+
+# ---- Batch row formatting ----------------------------------------------------
+# A page is formatted column by column: every payment's top-level fields are
+# pulled with one itemgetter call and transposed into columns, and amounts /
+# timestamps go through bulk formatters. Output is identical to the old per-row
+# amount_to_display / ts_to_ddmmyyyy_hhmmss formatting.
+
+# prices repeat a lot, so formatted amounts are cached by value
+_AMOUNT_CACHE_MAX = 100_000
+_amount_strings: Dict[int, str] = {}
+
+def _amounts_display(values) -> List[str]:
+    cache = _amount_strings
+    if len(cache) > _AMOUNT_CACHE_MAX:
+        cache.clear()
+    try:
+        out = list(map(cache.get, values))
+    except TypeError:  # unhashable value somewhere
+        out = [None] * len(values)
+    if None in out:
+        for i, v in enumerate(values):
+            if out[i] is None:
+                out[i] = amount_to_display(v)
+                if type(v) is int:
+                    cache[v] = out[i]
+    return out
+
+# Local time without a datetime per row: the UTC offset is looked up once per
+# UTC day (and only trusted when it is the same at both ends of that day, i.e.
+# no DST switch), then "dd/mm/YYYY " comes from a per-local-day cache and
+# "HH:MM:SS" from a table of all 86400 seconds. Days with a switch, and
+# non-integer timestamps, go through ts_to_ddmmyyyy_hhmmss.
+_DAY = 86400
+_DAY_CACHE_MAX = 100_000
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+_utc_day_offsets: Dict[int, Optional[int]] = {}
+_local_day_strings: Dict[int, str] = {}
+_hhmmss: List[str] = []
+
+def _utc_offset(ts: int) -> int:
+    local = datetime.fromtimestamp(ts)
+    utc = datetime.fromtimestamp(ts, timezone.utc).replace(tzinfo=None)
+    return int((local - utc).total_seconds())
+
+def _day_offset(day: int) -> Optional[int]:
+    try:
+        first = _utc_offset(day * _DAY)
+        last = _utc_offset(day * _DAY + _DAY - 1)
+    except (OverflowError, OSError, ValueError):
+        return None
+    return first if first == last else None
+
+def _timestamps_display(values) -> List[str]:
+    global _hhmmss
+    if not _hhmmss:
+        _hhmmss = [f"{h:02d}:{m:02d}:{s:02d}" for h in range(24) for m in range(60) for s in range(60)]
+    if len(_utc_day_offsets) > _DAY_CACHE_MAX:
+        _utc_day_offsets.clear()
+        _local_day_strings.clear()
+    offsets, days = _utc_day_offsets, _local_day_strings
+
+    if all(type(ts) is int for ts in values):
+        for day in {ts // _DAY for ts in values}:
+            if day not in offsets:
+                offsets[day] = _day_offset(day)
+        try:
+            local = [ts + offsets[ts // _DAY] for ts in values]
+        except TypeError:  # a day with a DST switch (offset None)
+            local = None
+        if local is not None:
+            for day in {t // _DAY for t in local}:
+                if day not in days:
+                    days[day] = date.fromordinal(_EPOCH_ORDINAL + day).strftime("%d/%m/%Y ")
+            hhmmss = _hhmmss
+            return [days[t // _DAY] + hhmmss[t % _DAY] for t in local]
+
+    out = []
+    for ts in values:
+        off = offsets.get(ts // _DAY) if type(ts) is int else None
+        if off is None:
+            out.append(ts_to_ddmmyyyy_hhmmss(ts))
+            continue
+        day, sec = divmod(ts + off, _DAY)
+        if day not in days:
+            days[day] = date.fromordinal(_EPOCH_ORDINAL + day).strftime("%d/%m/%Y ")
+        out.append(days[day] + _hhmmss[sec])
+    return out
+
+# top-level fields, pulled for a whole page with one C call per payment
+_TOP_FIELDS = (
+    "id", "amount", "currency", "status", "order_id", "invoice_id", "international", "method",
+    "amount_refunded", "refund_status", "captured", "description", "card_id", "bank", "wallet",
+    "vpa", "email", "contact", "notes", "fee", "tax", "error_code", "error_description",
+    "created_at", "upi", "acquirer_data",
+)
+_get_top = operator.itemgetter(*_TOP_FIELDS)
+
+def _blank_none(values) -> List[Any]:
+    return ["" if v is None else v for v in values]
+
+def _str_or_blank(values) -> List[str]:
+    return ["" if v is None else str(v) for v in values]
+
+def payment_rows(page: List[Dict[str, Any]]) -> List[tuple]:
+    """CSV rows (tuples, CSV_HEADER order) for a page of Razorpay payments."""
+    if not page:
+        return []
+    try:
+        records = list(map(_get_top, page))
+    except KeyError:
+        # a missing key reads as "" (what p.get(key, "") gave the per-row version)
+        records = [tuple(p.get(k, "") for k in _TOP_FIELDS) for p in page]
+    (ids, amount, currency, status, order_id, invoice_id, international, method,
+     amount_refunded, refund_status, captured, description, card_id, bank, wallet,
+     vpa, email, contact, notes, fee, tax, error_code, error_description,
+     created_at, upi, acquirer_data) = zip(*records)
+
+    upis = [u or {} for u in upi]
+    acqs = [a or {} for a in acquirer_data]
+    columns = [
+        ids,
+        _amounts_display(amount),
+        currency,
+        status,
+        order_id,
+        invoice_id,
+        _str_or_blank(international),
+        method,
+        _amounts_display(amount_refunded),
+        _blank_none(refund_status),
+        _str_or_blank(captured),
+        description,
+        _blank_none(card_id),
+        _blank_none(bank),
+        _blank_none(wallet),
+        # VPA may appear in root.vpa or upi.vpa
+        [v or u.get("vpa") or "" for v, u in zip(vpa, upis)],
+        email,
+        contact,
+        # Notes can be an object; keep compact JSON-ish string
+        ["" if not n else str(n) for n in notes],
+        _amounts_display(fee),
+        _amounts_display(tax),
+        _blank_none(error_code),
+        _blank_none(error_description),
+        _timestamps_display(created_at),
+        [a.get("rrn", "") for a in acqs],
+        [a.get("authentication_reference_number", "") for a in acqs],
+        [a.get("auth_code", "") for a in acqs],
+        [u.get("flow", "") for u in upis],
+    ]
+    return list(zip(*columns))
+
+class _CsvEncoder:
+    """CSV counterpart of the encoders in app/services/payments_export.py."""
+
+    def __init__(self):
+        self._buf = io.StringIO()
+        self._w = csv.writer(self._buf, quoting=csv.QUOTE_MINIMAL)
+        self._w.writerow(CSV_HEADER)
+
+    def write(self, page: List[Dict[str, Any]]) -> bytes:
+        self._w.writerows(payment_rows(page))
+        chunk = self._buf.getvalue().encode("utf-8")
+        self._buf.seek(0)
+        self._buf.truncate()
+        return chunk
+
+    def close(self) -> bytes:
+        return self.write([])
+
+async def stream_payment_pages(
+    client: httpx.AsyncClient,
+    *,
+    status_filter: Optional[str],
+    from_unix: Optional[int],
+    to_unix: Optional[int],
+    max_fetch: int,
+    mirror: str = "off",
+    account: Optional[str] = None,
+):
+    """
+    Like load_payments, but yields pages as soon as they are available.
+    Live pulls walk the window serially so the first page arrives quickly and in order.
+    """
+    if mirror not in MIRROR_MODES:
+        raise HTTPException(400, detail=f"mirror must be one of {', '.join(MIRROR_MODES)}")
+
+    if mirror == "off":
+        pages = iter_payment_pages(
+            client,
+            status_filter=status_filter,
+            from_unix=from_unix,
+            to_unix=to_unix,
+            max_fetch=max_fetch,
+        )
+    else:
+        m = _mirror(account)
+        await m.sync(client, full=(mirror == "full"))
+        pages = m.iter_query(
+            status_filter=status_filter,
+            from_unix=from_unix,
+            to_unix=to_unix,
+            max_fetch=max_fetch,
+        )
+    async for page in pages:
+        yield page
+
 @router.get("/payments-csv")
 async def payments_csv(
     status: Optional[str] = Query("captured", description="Filter by status (e.g. captured)"),
     from_date: Optional[str] = Query(None, description="Start date (YYYY-MM-DD or ISO datetime)"),
     to_date: Optional[str]   = Query(None, description="End date (YYYY-MM-DD or ISO datetime)"),
-    max_fetch: int = Query(2000, ge=1, le=50000, description="Upper bound to avoid runaway downloads"),
+    max_fetch: int = Query(2000, ge=1, le=1_000_000, description="Upper bound to avoid runaway downloads"),
+    mirror: str = Query("off", description="off (fetch live) | incremental (sync local mirror, serve from it) | full (resync mirror first)"),
+    format: str = Query("csv", description="csv | ndjson | parquet | arrow (typed columns; parquet/arrow need pyarrow)"),
+    account: Optional[str] = Query(None, description="Razorpay account (see RAZORPAY_ACCOUNTS); default: the first"),
 ) -> StreamingResponse:
     """
-    Fetch Razorpay payments and stream as CSV.
-    Keys must be set in backend env: RAZORPAY_KEY_ID / RAZORPAY_KEY_SECRET
+    Fetch Razorpay payments and stream them as CSV (or ndjson / Parquet / Arrow),
+    one chunk per page of payments (per row group for Parquet/Arrow).
+    Keys must be set in backend env: RAZORPAY_KEY_ID / RAZORPAY_KEY_SECRET (per account with RAZORPAY_ACCOUNTS)
     """
-    _assert_keys()
+    _assert_keys(account)
+    format = format.strip().lower()
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(400, detail=f"format must be one of {', '.join(EXPORT_FORMATS)}")
+    try:
+        encoder = _CsvEncoder() if format == "csv" else make_encoder(format)
+    except RuntimeError as e:
+        raise HTTPException(501, detail=str(e))
 
     def to_unix(s: Optional[str]) -> Optional[int]:
         return int(dtparser.parse(s).timestamp()) if s else None
@@ -92,80 +713,56 @@ async def payments_csv(
     from_unix = to_unix(from_date)
     to_unix   = to_unix(to_date)
 
+    pages = stream_payment_pages(
+        razorpay_client(account),
+        status_filter=status,
+        from_unix=from_unix,
+        to_unix=to_unix,
+        max_fetch=max_fetch,
+        mirror=mirror,
+        account=account,
+    )
+
+    # Pull the first page before answering so Razorpay errors still map to a status code
+    run_timings = RunTimings("payments_csv")
     try:
-        async with httpx.AsyncClient(auth=(KEY_ID, KEY_SECRET), timeout=30.0) as client:
-            payments = await fetch_payments(
-                client,
-                status_filter=status,
-                from_unix=from_unix,
-                to_unix=to_unix,
-                max_fetch=max_fetch,
-            )
+        with run_timings.stage("fetch_payments", unit="payments") as st:
+            first: List[Dict[str, Any]] = await pages.__anext__()
+            st.add(len(first))
+    except StopAsyncIteration:
+        first = []
     except httpx.HTTPStatusError as e:
         # bubble up Razorpay error content
         raise HTTPException(status_code=e.response.status_code, detail=e.response.text)
     except httpx.RequestError as e:
         raise HTTPException(status_code=502, detail=f"Network error calling Razorpay: {e}")
 
-    # Prepare CSV
-    buf = io.StringIO()
-    w = csv.writer(buf, quoting=csv.QUOTE_MINIMAL)
+    async def body():
+        def render(page: Optional[List[Dict[str, Any]]]) -> bytes:
+            # stages are closed before each yield: a ContextVar can't span one
+            with run_timings.stage(f"{format}_render", unit="rows") as st:
+                chunk = encoder.write(page) if page is not None else encoder.close()
+                st.add(len(page or ()), bytes=len(chunk))
+            return chunk
 
-    # Columns tailored to the JSON you pasted
-    header = [
-        "id","amount","currency","status","order_id","invoice_id","international","method",
-        "amount_refunded","refund_status","captured","description","card_id","bank","wallet",
-        "vpa","email","contact","notes","fee","tax","error_code","error_description","created_at",
-        "Payments_RRN","Payments_ARN","Auth_code","flow"
-    ]
-    w.writerow(header)
-
-    for p in payments:
-        upi = p.get("upi") or {}
-        acq = p.get("acquirer_data") or {}
-        # VPA may appear in root.vpa or upi.vpa
-        vpa = p.get("vpa") or upi.get("vpa") or ""
-        flow = upi.get("flow", "")
+        try:
+            yield render(first)
+            while first:
+                with run_timings.stage("fetch_payments", unit="payments") as st:
+                    try:
+                        page = await pages.__anext__()
+                    except StopAsyncIteration:
+                        break
+                    st.add(len(page))
+                chunk = render(page)
+                if chunk:
+                    yield chunk
+            yield render(None)
+        finally:
+            await pages.aclose()
 
-        # Notes can be an object; keep compact JSON-ish string
-        notes = p.get("notes") or ""
-        notes_str = "" if notes == "" else str(notes)
-
-        row = [
-            p.get("id",""),
-            amount_to_display(p.get("amount")),
-            p.get("currency",""),
-            p.get("status",""),
-            p.get("order_id",""),
-            p.get("invoice_id",""),
-            str(p.get("international","") if p.get("international") is not None else ""),
-            p.get("method",""),
-            amount_to_display(p.get("amount_refunded")),
-            p.get("refund_status","") if p.get("refund_status") is not None else "",
-            str(p.get("captured","") if p.get("captured") is not None else ""),
-            p.get("description",""),
-            p.get("card_id","") if p.get("card_id") is not None else "",
-            p.get("bank","") if p.get("bank") is not None else "",
-            p.get("wallet","") if p.get("wallet") is not None else "",
-            vpa,
-            p.get("email",""),
-            p.get("contact",""),
-            notes_str,
-            amount_to_display(p.get("fee")),
-            amount_to_display(p.get("tax")),
-            p.get("error_code","") if p.get("error_code") is not None else "",
-            p.get("error_description","") if p.get("error_description") is not None else "",
-            ts_to_ddmmyyyy_hhmmss(p.get("created_at")),
-            acq.get("rrn",""),
-            acq.get("authentication_reference_number",""),
-            acq.get("auth_code",""),
-            flow,
-        ]
-        w.writerow(row)
-
-    buf.seek(0)
     return StreamingResponse(
-        iter([buf.getvalue()]),
-        media_type="text/csv",
-        headers={"Content-Disposition": 'attachment; filename="razorpay_payments.csv"'}
+        body(),
+        media_type=MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="razorpay_payments.{format}"'}
     )
@@ -1,37 +1,111 @@
 # app/routers/reconcile.py
-from fastapi import APIRouter, Query, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, Depends, Query, HTTPException
+from fastapi.responses import StreamingResponse
 from typing import Optional, Dict, Any, List
-import os
-import httpx
+import asyncio
+import threading
+import base64
 
-from pymongo import MongoClient
-from pymongo.errors import PyMongoError
+from bson import json_util
 
 router = APIRouter(prefix="/reconcile", tags=["reconcile"])
 
-def norm(s: str | None, *, case_insensitive: bool) -> str:
-    t = (s or "").replace("\u00A0", " ").strip()
-    return t.lower() if case_insensitive else t
-
-# ---- Razorpay fetcher (reuse your existing code) ----------------------------
-from app.routers.razorpay_export import fetch_payments, _assert_keys
+# ---- Services ------------------------------------------------------------------
+# The matching engine lives in app/services/reconcile_engine.py; these routes
+# only parse requests and shape responses.
+from app.routers.razorpay_export import resolve_accounts
+from app.services import reconcile_service
+from app.services.reconcile_service import ReconcileParams
+from app.services.reconcile_engine import reconcile_payments_orders, ReconcileCancelled, live_na
+from app.services.orders_db import get_orders_collection, run_mongo
+from app.services.live_na import LIVE_NA_ENABLED
+from app.services.responses import FastJSONResponse, dumps
 # ----------------------------------------------------------------------------
 
-# ---- Mongo connection via ENV ----------------------------------------------
-MONGO_URI = os.getenv("MONGO_URI")
-if not MONGO_URI:
-    # Fail fast with a clear message instead of silently defaulting to localhost.
-    raise RuntimeError("MONGO_URI not set")
 
-client = MongoClient(MONGO_URI, tz_aware=True)
-db = client["candyman"]
-orders_collection = db["user_details"]
+# ------------------------------ KEEP: /orders --------------------------------
+def _order_row(doc: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "order_id": doc.get("order_id", ""),
+        "job_id": doc.get("job_id", ""),
+        "coverPdf": doc.get("cover_url", ""),
+        "interiorPdf": doc.get("book_url", ""),
+        "previewUrl": doc.get("preview_url", ""),
+        "name": doc.get("name", ""),
+        "city": doc.get("shipping_address", {}).get("city", ""),
+        "price": doc.get("price", doc.get("total_price", doc.get("amount", doc.get("total_amount", 0)))),
+        "paymentDate": doc.get("processed_at", ""),
+        "approvalDate": doc.get("approved_at", ""),
+        "status": "Approved" if doc.get("approved") else "Uploaded",
+        "bookId": doc.get("book_id", ""),
+        "bookStyle": doc.get("book_style", ""),
+        "printStatus": doc.get("print_status", ""),
+        "feedback_email": doc.get("feedback_email", False),
+        "print_approval": doc.get("print_approval", None),
+        "discount_code": doc.get("discount_code", ""),
+        "currency": doc.get("currency", ""),
+        "locale": doc.get("locale", ""),
+    }
 
 
-# ------------------------------ KEEP: /orders --------------------------------
+# output key -> Mongo fields it is built from (used for ?fields= projections)
+ORDER_FIELDS: Dict[str, tuple] = {
+    "order_id": ("order_id",),
+    "job_id": ("job_id",),
+    "coverPdf": ("cover_url",),
+    "interiorPdf": ("book_url",),
+    "previewUrl": ("preview_url",),
+    "name": ("name",),
+    "city": ("shipping_address.city",),
+    "price": ("price", "total_price", "amount", "total_amount"),
+    "paymentDate": ("processed_at",),
+    "approvalDate": ("approved_at",),
+    "status": ("approved",),
+    "bookId": ("book_id",),
+    "bookStyle": ("book_style",),
+    "printStatus": ("print_status",),
+    "feedback_email": ("feedback_email",),
+    "print_approval": ("print_approval",),
+    "discount_code": ("discount_code",),
+    "currency": ("currency",),
+    "locale": ("locale",),
+}
+
+def _get_path(doc: Dict[str, Any], path: str) -> Any:
+    for part in path.split("."):
+        if not isinstance(doc, dict):
+            return None
+        doc = doc.get(part)
+    return doc
+
+def _encode_cursor(value: Any, _id: Any) -> str:
+    raw = json_util.dumps({"v": value, "id": _id}).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def _decode_cursor(cursor: str) -> tuple:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        d = json_util.loads(raw)
+        return d["v"], d["id"]
+    except Exception:
+        raise HTTPException(400, detail="Invalid cursor")
+
+def _after_cursor(sort_field: str, sort_order: int, value: Any, _id: Any) -> Dict[str, Any]:
+    """Keyset condition for rows strictly after (value, _id) in (sort_field, _id) order."""
+    op = "$gt" if sort_order == 1 else "$lt"
+    same_value_next_id = {sort_field: value, "_id": {op: _id}}
+    if value is None:
+        # null/missing sort before every value ascending, after every value descending
+        if sort_order == 1:
+            return {"$or": [same_value_next_id, {sort_field: {"$ne": None}}]}
+        return same_value_next_id
+    later = [{sort_field: {op: value}}, same_value_next_id]
+    if sort_order == -1:
+        later.append({sort_field: None})
+    return {"$or": later}
+
 @router.get("/orders")
-def get_orders(
+async def get_orders(
     sort_by: Optional[str] = Query(None, description="Field to sort by"),
     sort_dir: Optional[str] = Query("asc", description="asc or desc"),
     filter_status: Optional[str] = Query(None),
@@ -39,7 +113,14 @@ def get_orders(
     filter_print_approval: Optional[str] = Query(None),
     filter_discount_code: Optional[str] = Query(None),
     exclude_discount_code: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=1000, description="Page size; enables keyset pagination"),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
+    fields: Optional[str] = Query(None, description="Comma-separated output fields, e.g. order_id,name,price"),
 ):
+    """
+    Paid orders. Without `limit`/`cursor` this returns the full list (legacy shape).
+    With them it returns {"items", "next_cursor"} pages ordered by (sort field, _id).
+    """
     # Base query: only show paid orders
     query = {"paid": True}
 
@@ -80,175 +161,214 @@ def get_orders(
     sort_field = sort_by if sort_by else "created_at"
     sort_order = 1 if sort_dir == "asc" else -1
 
-    projection = {
-        "order_id": 1, "job_id": 1, "cover_url": 1, "book_url": 1, "preview_url": 1,
-        "name": 1, "shipping_address": 1, "created_at": 1, "processed_at": 1,
-        "approved_at": 1, "approved": 1, "book_id": 1, "book_style": 1,
-        "print_status": 1, "price": 1, "total_price": 1, "amount": 1, "total_amount": 1,
-        "feedback_email": 1, "print_approval": 1, "discount_code": 1,
-        "currency": 1, "locale": 1, "_id": 0,
-    }
-
-    records = list(orders_collection.find(query, projection).sort(sort_field, sort_order))
-    result = []
-    for doc in records:
-        result.append({
-            "order_id": doc.get("order_id", ""),
-            "job_id": doc.get("job_id", ""),
-            "coverPdf": doc.get("cover_url", ""),
-            "interiorPdf": doc.get("book_url", ""),
-            "previewUrl": doc.get("preview_url", ""),
-            "name": doc.get("name", ""),
-            "city": doc.get("shipping_address", {}).get("city", ""),
-            "price": doc.get("price", doc.get("total_price", doc.get("amount", doc.get("total_amount", 0)))),
-            "paymentDate": doc.get("processed_at", ""),
-            "approvalDate": doc.get("approved_at", ""),
-            "status": "Approved" if doc.get("approved") else "Uploaded",
-            "bookId": doc.get("book_id", ""),
-            "bookStyle": doc.get("book_style", ""),
-            "printStatus": doc.get("print_status", ""),
-            "feedback_email": doc.get("feedback_email", False),
-            "print_approval": doc.get("print_approval", None),
-            "discount_code": doc.get("discount_code", ""),
-            "currency": doc.get("currency", ""),
-            "locale": doc.get("locale", ""),
-        })
-    return result
+    if fields:
+        wanted = [f.strip() for f in fields.split(",") if f.strip()]
+        unknown = [f for f in wanted if f not in ORDER_FIELDS]
+        if unknown:
+            raise HTTPException(400, detail=f"Unknown fields: {', '.join(unknown)}")
+        projection: Dict[str, Any] = {src: 1 for f in wanted for src in ORDER_FIELDS[f]}
+    else:
+        wanted = None
+        projection = {
+            "order_id": 1, "job_id": 1, "cover_url": 1, "book_url": 1, "preview_url": 1,
+            "name": 1, "shipping_address": 1, "created_at": 1, "processed_at": 1,
+            "approved_at": 1, "approved": 1, "book_id": 1, "book_style": 1,
+            "print_status": 1, "price": 1, "total_price": 1, "amount": 1, "total_amount": 1,
+            "feedback_email": 1, "print_approval": 1, "discount_code": 1,
+            "currency": 1, "locale": 1,
+        }
+
+    def _row(doc: Dict[str, Any]) -> Dict[str, Any]:
+        row = _order_row(doc)
+        return row if wanted is None else {k: row[k] for k in wanted}
+
+    if limit is None and cursor is None:
+        projection["_id"] = 0
+
+        def _load_all() -> List[Dict[str, Any]]:
+            cur = get_orders_collection().find(query, projection).sort(sort_field, sort_order)
+            return [_row(doc) for doc in cur]
+
+        return FastJSONResponse(await run_mongo(_load_all))
+
+    # Keyset pagination on (sort_field, _id)
+    page_size = limit or 100
+    page_query: Dict[str, Any] = query
+    if cursor:
+        value, last_id = _decode_cursor(cursor)
+        page_query = {"$and": [query, _after_cursor(sort_field, sort_order, value, last_id)]}
+    projection[sort_field] = 1
+
+    def _load_page() -> Dict[str, Any]:
+        cur = (
+            get_orders_collection().find(page_query, projection)
+                             .sort([(sort_field, sort_order), ("_id", sort_order)])
+                             .limit(page_size + 1)
+        )
+        docs = list(cur)
+        next_cursor = None
+        if len(docs) > page_size:
+            docs = docs[:page_size]
+            last = docs[-1]
+            next_cursor = _encode_cursor(_get_path(last, sort_field), last["_id"])
+        return {"items": [_row(doc) for doc in docs], "next_cursor": next_cursor}
+
+    return FastJSONResponse(await run_mongo(_load_page))
 # ----------------------------------------------------------------------------
 
 
-@router.get("/vlookup-payment-to-orders/auto")
-async def vlookup_payment_to_orders_auto(
+# ---- Reconcile ---------------------------------------------------------------
+# Query parameters shared by /auto and /auto/stream (the /jobs body is the same model).
+def reconcile_params(
     # Payments: ALL STATUSES by default (None)
     status: Optional[str] = Query(None, description="Filter payments fetched from Razorpay by status; omit for ALL"),
     max_fetch: int = Query(200_000, ge=1, le=1_000_000, description="Upper bound for Razorpay pulls"),
     from_date: Optional[str] = Query(None, description="YYYY-MM-DD / ISO; omit for ALL time"),
     to_date:   Optional[str] = Query(None, description="YYYY-MM-DD / ISO; omit for ALL time"),
     case_insensitive_ids: bool = Query(False, description="Lowercase both sides before matching"),
+    mirror: str = Query("off", description="off (fetch live) | incremental (sync payments mirror, serve from it) | full (resync payments mirror)"),
 
     # Orders paging (scan *all* orders)
     orders_batch_size: int = Query(50_000, ge=1_000, le=200_000, description="Mongo batch size"),
+    match_strategy: str = Query("auto", description="auto | index ($in on transaction_id) | incremental (local order state) | snapshot (in-memory, background-refreshed) | scan (all orders by _id)"),
 
     # IMPORTANT: default to only NA with status=captured
     na_status: Optional[str] = Query("captured", description="Only include NA payments with this Razorpay status"),
+    discrepancies: bool = Query(False, description="Also diff amounts/currency/status/duplicates against matched orders"),
+    sample_limit: int = Query(20, ge=0, le=1000, description="Max example rows per discrepancy type"),
+    timings: bool = Query(False, description="Add per-stage wall time / counts (and process peak RSS) under `timings` (a `timings` event when streaming)"),
+    group_by_status: bool = Query(True, description="Also return na_by_status (the same ids again, grouped); not streamed"),
+    accounts: Optional[str] = Query(None, description="Comma-separated Razorpay accounts (RAZORPAY_ACCOUNTS); omit for all"),
+) -> ReconcileParams:
+    return ReconcileParams(
+        status=status,
+        max_fetch=max_fetch,
+        from_date=from_date,
+        to_date=to_date,
+        case_insensitive_ids=case_insensitive_ids,
+        mirror=mirror,
+        orders_batch_size=orders_batch_size,
+        match_strategy=match_strategy,
+        na_status=na_status,
+        discrepancies=discrepancies,
+        sample_limit=sample_limit,
+        timings=timings,
+        group_by_status=group_by_status,
+        accounts=accounts,
+    )
+
+
+@router.get("/vlookup-payment-to-orders/auto")
+async def vlookup_payment_to_orders_auto(
+    params: ReconcileParams = Depends(reconcile_params),
+    use_cache: bool = Query(True, description="Reuse a recent identical reconcile (or join one in flight)"),
 ):
-    _assert_keys()
+    result = await reconcile_service.reconcile(params, use_cache=use_cache)
+    return FastJSONResponse(result)
 
-    def _to_unix(s: Optional[str]) -> Optional[int]:
-        if not s:
-            return None
-        from dateutil import parser as dtparser
-        return int(dtparser.parse(s).timestamp())
 
-    # 1) Razorpay: fetch ALL (status=None => all statuses)
-    try:
-        async with httpx.AsyncClient(
-            auth=(os.getenv("RAZORPAY_KEY_ID"), os.getenv("RAZORPAY_KEY_SECRET")),
-            timeout=60.0
-        ) as client:
-            payments: List[Dict[str, Any]] = await fetch_payments(
-                client=client,
-                status_filter=status,   # None => all
-                from_unix=_to_unix(from_date),
-                to_unix=_to_unix(to_date),
-                max_fetch=max_fetch,
-            )
-    except httpx.HTTPStatusError as e:
-        raise HTTPException(status_code=e.response.status_code, detail=e.response.text)
-    except httpx.RequestError as e:
-        raise HTTPException(status_code=502, detail=f"Network error calling Razorpay: {e}")
-
-    # Index: normalized id -> (raw id, status)
-    pay_index: Dict[str, Dict[str, str]] = {}
-    for p in payments:
-        raw_id = str(p.get("id", "") or "")
-        if not raw_id:
-            continue
-        key = norm(raw_id, case_insensitive=case_insensitive_ids)
-        st = (p.get("status") or "").strip().lower()
-        pay_index[key] = {"id": raw_id, "status": st}
-
-    payment_keys = set(pay_index.keys())
-    matched_keys: set[str] = set()
-
-    # 2) Scan ALL orders by _id (Atlas-safe)
-    total_orders_docs = 0
-    orders_with_tx = 0
-    last_id = None
+# ---- Reconcile jobs ----------------------------------------------------------
+@router.post("/jobs", status_code=202)
+async def create_reconcile_job(
+    params: ReconcileParams,
+    use_cache: bool = Query(True, description="Reuse a cached result for identical params"),
+):
+    """Start (or join) a reconcile job. Identical params share one in-flight job."""
+    resolve_accounts(params.accounts)
+    job, joined = reconcile_service.submit(params, use_cache=use_cache)
+    return {**job.to_dict(include_result=False), "joined": joined}
 
-    try:
-        while True:
-            q: Dict[str, Any] = {}
-            if last_id is not None:
-                q["_id"] = {"$gt": last_id}
-
-            batch = list(
-                orders_collection.find(q, projection={"transaction_id": 1, "order_id": 1})
-                                 .sort([("_id", 1)])
-                                 .limit(orders_batch_size)
+@router.get("/jobs/{job_id}")
+async def get_reconcile_job(job_id: str):
+    job = reconcile_service.get_job(job_id)
+    if job is None:
+        raise HTTPException(404, detail="Job not found or expired")
+    return FastJSONResponse(job.to_dict())
+
+
+
+# ---- Live NA -----------------------------------------------------------------
+@router.get("/live-na")
+async def get_live_na(
+    ids: bool = Query(True, description="Include na_payment_ids (false = counts only)"),
+    account: Optional[str] = Query(None, description="Only this Razorpay account's NA ids"),
+):
+    if not LIVE_NA_ENABLED:
+        raise HTTPException(404, detail="Live NA is disabled (set LIVE_NA=1)")
+    if account is not None:
+        account = resolve_accounts(account)[0]  # 400 on an unknown account
+    return FastJSONResponse(live_na.read(include_ids=ids, account=account))
+
+
+# ---- Streaming variant -------------------------------------------------------
+# Same reconcile, but progress is streamed as it happens (SSE or NDJSON):
+#   payments_page / payments_done / orders_start / orders_batch / summary /
+#   discrepancies, timings (if asked) / na_ids (chunks of NA_CHUNK ids) / done,
+#   or a single `error` event.
+# Closing the connection cancels the reconcile.
+NA_CHUNK = 1000
+
+def _encode_event(ev: Dict[str, Any], fmt: str) -> bytes:
+    data = dumps(ev)
+    if fmt == "ndjson":
+        return data + b"\n"
+    return b"event: " + ev["event"].encode() + b"\ndata: " + data + b"\n\n"
+
+@router.get("/vlookup-payment-to-orders/auto/stream")
+async def vlookup_payment_to_orders_auto_stream(
+    params: ReconcileParams = Depends(reconcile_params),
+    format: str = Query("sse", description="sse (text/event-stream) | ndjson"),
+):
+    if format not in ("sse", "ndjson"):
+        raise HTTPException(400, detail="format must be sse or ndjson")
+    resolve_accounts(params.accounts)
+
+    queue: asyncio.Queue = asyncio.Queue()
+    stop = threading.Event()
+
+    async def run() -> None:
+        try:
+            result = await reconcile_payments_orders(
+                **params.normalized(),
+                timings=params.timings,
+                on_event=queue.put_nowait,
+                stop=stop,
             )
-            if not batch:
-                break
-
-            total_orders_docs += len(batch)
-
-            for doc in batch:
-                raw_tx = doc.get("transaction_id")
-                if not raw_tx:
-                    continue
-                tx_key = norm(str(raw_tx), case_insensitive=case_insensitive_ids)
-                if not tx_key:
-                    continue
-                orders_with_tx += 1
-                if tx_key in payment_keys:
-                    matched_keys.add(tx_key)
-
-            last_id = batch[-1]["_id"]
-    except PyMongoError as e:
-        raise HTTPException(status_code=502, detail=f"Mongo query failed: {e}")
-
-    # 3) NA keys (in payments but not matched to any order)
-    na_keys = payment_keys - matched_keys
-
-    # Build NA items and FILTER by status (default captured)
-    target_status = (na_status or "captured").strip().lower()
-    na_items: List[Dict[str, str]] = []
-    for k in na_keys:
-        rec = pay_index.get(k)
-        if not rec:
-            continue
-        if (rec.get("status") or "") == target_status:
-            na_items.append({"id": rec["id"], "status": target_status})
-
-    # Sort by id (status is uniform now)
-    na_items.sort(key=lambda x: x["id"])
-
-    # Group (will only contain the target status)
-    na_by_status: Dict[str, List[str]] = {}
-    for item in na_items:
-        na_by_status.setdefault(item["status"], []).append(item["id"])
-
-    matched_distinct = len(matched_keys)
-
-    return JSONResponse({
-        "summary": {
-            "total_orders_docs_scanned": total_orders_docs,
-            "orders_with_transaction_id": orders_with_tx,
-            "total_payments_rows": len(payments),
-            "payment_status_filter": status or "(ALL)",
-            "case_insensitive_ids": case_insensitive_ids,
-            "matched_distinct_payment_ids": matched_distinct,
-            # IMPORTANT: now counts ONLY the chosen status (default captured)
-            "na_count": len(na_items),
-            "max_fetch": max_fetch,
-            "date_window": {
-                "from_date": from_date or "(all-time)",
-                "to_date": to_date or "(all-time)",
-            },
-            "orders_batch_size": orders_batch_size,
-            "na_status_filter": target_status,
-        },
-        # Only the chosen status (default captured)
-        "na_payment_ids": [x["id"] for x in na_items],
-        "na_by_status": na_by_status,  # contains only the chosen status
-    })
+        except HTTPException as e:
+            queue.put_nowait({"event": "error", "status_code": e.status_code, "detail": e.detail})
+        except ReconcileCancelled:
+            pass
+        except Exception as e:
+            queue.put_nowait({"event": "error", "status_code": 500, "detail": str(e)})
+        else:
+            queue.put_nowait({"event": "summary", "summary": result["summary"]})
+            if "discrepancies" in result:
+                queue.put_nowait({"event": "discrepancies", **result["discrepancies"]})
+            if "timings" in result:
+                queue.put_nowait({"event": "timings", **result["timings"]})
+            ids = result["na_payment_ids"]
+            for i in range(0, len(ids), NA_CHUNK):
+                queue.put_nowait({"event": "na_ids", "offset": i, "ids": ids[i:i + NA_CHUNK]})
+            queue.put_nowait({"event": "done", "na_count": len(ids)})
+        finally:
+            queue.put_nowait(None)
+
+    async def body():
+        task = asyncio.create_task(run())
+        try:
+            while True:
+                ev = await queue.get()
+                if ev is None:
+                    break
+                yield _encode_event(ev, format)
+        finally:
+            # client went away (or we finished): stop the worker between batches
+            stop.set()
+            if not task.done():
+                task.cancel()
+
+    return StreamingResponse(
+        body(),
+        media_type="text/event-stream" if format == "sse" else "application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -0,0 +1,133 @@
+# app/services/discrepancies.py
+"""
+Two-sided Razorpay <-> order diff.
+
+The reconcile matchers hand every order they read to DiscrepancyCollector, so
+the amount/status/currency checks ride along the existing scan instead of
+needing another pass over user_details. Each discrepancy type gets a count and
+up to `sample_limit` example rows.
+"""
+import os
+from typing import Any, Dict, List, Optional
+
+from app.services.payment_index import PaymentIndex
+
+# order prices are stored in major units (1485.0); Razorpay amounts are paise
+ORDER_AMOUNT_SCALE = float(os.getenv("ORDER_AMOUNT_SCALE", "100"))
+AMOUNT_TOLERANCE_PAISE = int(os.getenv("RECONCILE_AMOUNT_TOLERANCE_PAISE", "1"))
+
+DISCREPANCY_TYPES = (
+    "missing_order",                # payment (NA status) that no order references
+    "amount_mismatch",              # order price != payment amount
+    "currency_mismatch",
+    "refunded_payment_order_paid",  # payment (partly) refunded, order still marked paid
+    "payment_not_captured",         # order paid, payment failed / authorized / created
+    "order_not_paid",               # payment captured, order not marked paid
+    "duplicate_orders",             # several orders point at one payment
+    "order_payment_not_found",      # order's transaction_id not among the pulled payments
+)
+
+# extra order fields the checks need on top of transaction_id
+ORDER_DIFF_FIELDS = {
+    "order_id": 1, "paid": 1, "price": 1, "total_price": 1,
+    "amount": 1, "total_amount": 1, "currency": 1,
+}
+
+_NOT_CAPTURED = {"failed", "created", "authorized"}
+
+
+def _order_price_paise(doc: Dict[str, Any]) -> Optional[int]:
+    # same precedence as the /orders "price" column
+    for f in ("price", "total_price", "amount", "total_amount"):
+        v = doc.get(f)
+        if v is None or v == "":
+            continue
+        try:
+            return round(float(v) * ORDER_AMOUNT_SCALE)
+        except (TypeError, ValueError):
+            return None
+    return None
+
+
+class DiscrepancyCollector:
+    def __init__(self, index: PaymentIndex, *, sample_limit: int, track_orphans: bool):
+        if not index.amounts:
+            raise ValueError("DiscrepancyCollector needs a PaymentIndex built with amounts=True")
+        self.index = index
+        self.sample_limit = sample_limit
+        self.track_orphans = track_orphans
+        self.counts: Dict[str, int] = {t: 0 for t in DISCREPANCY_TYPES}
+        self.samples: Dict[str, List[Dict[str, Any]]] = {t: [] for t in DISCREPANCY_TYPES}
+
+    def fork(self) -> "DiscrepancyCollector":
+        """Empty collector with the same settings, for one shard of a parallel scan."""
+        return DiscrepancyCollector(self.index, sample_limit=self.sample_limit,
+                                    track_orphans=self.track_orphans)
+
+    def merge(self, other: "DiscrepancyCollector") -> None:
+        for kind, n in other.counts.items():
+            self.counts[kind] += n
+            room = self.sample_limit - len(self.samples[kind])
+            if room > 0:
+                self.samples[kind].extend(other.samples[kind][:room])
+
+    def _add(self, kind: str, **sample: Any) -> None:
+        self.counts[kind] += 1
+        if len(self.samples[kind]) < self.sample_limit:
+            self.samples[kind].append(sample)
+
+    def check(self, row: int, key: str, doc: Dict[str, Any]) -> None:
+        """Compare one order with the payment it matched (row in the index)."""
+        idx = self.index
+        pay_id = idx.raw_id(row, key)
+        order_id = doc.get("order_id", "")
+        status = idx.status_name(row)
+        paid = bool(doc.get("paid"))
+
+        pay_amount = idx.amount[row]
+        order_amount = _order_price_paise(doc)
+        if order_amount is not None and abs(order_amount - pay_amount) > AMOUNT_TOLERANCE_PAISE:
+            self._add("amount_mismatch", payment_id=pay_id, order_id=order_id,
+                      payment_amount=pay_amount, order_amount=order_amount)
+
+        pay_currency = idx.currency_name(row)
+        order_currency = (doc.get("currency") or "").strip().upper()
+        if order_currency and pay_currency and order_currency != pay_currency:
+            self._add("currency_mismatch", payment_id=pay_id, order_id=order_id,
+                      payment_currency=pay_currency, order_currency=order_currency)
+
+        refunded = idx.amount_refunded[row]
+        if paid and (status == "refunded" or refunded > 0):
+            self._add("refunded_payment_order_paid", payment_id=pay_id, order_id=order_id,
+                      payment_status=status, amount_refunded=refunded)
+
+        if paid and status in _NOT_CAPTURED:
+            self._add("payment_not_captured", payment_id=pay_id, order_id=order_id,
+                      payment_status=status)
+
+        if not paid and status == "captured":
+            self._add("order_not_paid", payment_id=pay_id, order_id=order_id)
+
+    def orphan(self, tx_id: str, doc: Dict[str, Any]) -> None:
+        """An order whose transaction_id isn't among the pulled payments."""
+        if self.track_orphans:
+            self._add("order_payment_not_found", transaction_id=tx_id,
+                      order_id=doc.get("order_id", ""))
+
+    def result(self, na_ids: List[str]) -> Dict[str, Any]:
+        self.counts["missing_order"] = len(na_ids)
+        self.samples["missing_order"] = [{"payment_id": i} for i in na_ids[:self.sample_limit]]
+
+        dups = self.index.duplicate_ids()
+        self.counts["duplicate_orders"] = len(dups)
+        self.samples["duplicate_orders"] = [{"payment_id": i} for i in dups[:self.sample_limit]]
+
+        counts = dict(self.counts)
+        if not self.track_orphans:
+            # only meaningful when every payment was pulled (all-time, no cap hit)
+            counts["order_payment_not_found"] = None
+        return {
+            "counts": counts,
+            "samples": {k: v for k, v in self.samples.items() if v},
+            "sample_limit": self.sample_limit,
+        }
@@ -0,0 +1,354 @@
+# app/services/live_na.py
+"""
+Live NA set: recent captured payments that no order points at, kept current
+between reconciles by an optional background worker (LIVE_NA=1).
+
+Two feeds update one in-memory set:
+  - a change stream on user_details: an insert/replace/update that sets a
+    transaction_id takes that payment out of the set right away (update events
+    carry the changed fields, so no full-document lookup is needed);
+  - a payments poll every LIVE_NA_POLL_SECONDS, straight from Razorpay: it
+    lists only payments created after the newest one seen (less
+    LIVE_NA_OVERLAP_SECONDS), and re-fetches by id the tracked payments that
+    can still change: created/authorized ones (while younger than the mutable
+    window) and captured ones refunded since the last poll. New captures are
+    checked against orders with chunked $in queries; payments whose status
+    moved on (e.g. refunded) are dropped.
+Change events can't say that an order *lost* its transaction_id (a delete only
+carries _id), so the set is rebuilt from scratch every LIVE_NA_RESYNC_SECONDS
+(one live pull of the LIVE_NA_LOOKBACK_DAYS window).
+Without a replica set there are no change streams; the worker then runs on the
+poll and the rebuilds alone, and `stream` in the status says so.
+
+Matching is case-sensitive and ignores whitespace around transaction_ids, like
+match_strategy=index/scan. Reads cost a dict lookup; the sorted id list is
+rebuilt at most once per change.
+"""
+import os, time, asyncio, threading
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+from pymongo.errors import OperationFailure, PyMongoError
+
+from app.services.payments_mirror import NON_TERMINAL_STATUSES
+
+LIVE_NA_ENABLED = os.getenv("LIVE_NA", "0") == "1"
+POLL_SECONDS = float(os.getenv("LIVE_NA_POLL_SECONDS", "30"))
+RESYNC_SECONDS = float(os.getenv("LIVE_NA_RESYNC_SECONDS", "3600"))
+LOOKBACK_SECONDS = int(float(os.getenv("LIVE_NA_LOOKBACK_DAYS", "30")) * 86400)
+NA_STATUS = "captured"
+# payments are listed again from this long before the newest created_at seen (for
+# ones that show up in the list a little late); refunds from before the last poll
+OVERLAP_SECONDS = int(os.getenv("LIVE_NA_OVERLAP_SECONDS", "300"))
+# orders seen on the stream are remembered this long, to cover payments whose
+# $in check ran just before the order arrived
+RECENT_SECONDS = 600
+
+# insert/replace carry fullDocument; update carries only the changed fields
+_PIPELINE = [
+    {"$match": {
+        "operationType": {"$in": ["insert", "replace", "update"]},
+        "$or": [
+            {"fullDocument.transaction_id": {"$exists": True}},
+            {"updateDescription.updatedFields.transaction_id": {"$exists": True}},
+        ],
+    }},
+    {"$project": {
+        "operationType": 1,
+        "fullDocument.transaction_id": 1,
+        "updateDescription.updatedFields.transaction_id": 1,
+    }},
+]
+_NOT_REPLICA_SET = (40573,)       # $changeStream needs a replica set
+_HISTORY_LOST = (136, 280, 286)   # resume token fell off the oplog
+
+
+def _event_tx(change: Dict[str, Any]) -> Any:
+    doc = change.get("fullDocument") or {}
+    if "transaction_id" in doc:
+        return doc["transaction_id"]
+    return ((change.get("updateDescription") or {}).get("updatedFields") or {}).get("transaction_id")
+
+
+class PaymentFeed(NamedTuple):
+    """Where the worker reads payments from (rows are light and account-tagged)."""
+    list_since: Callable[[int], Awaitable[List[Dict[str, Any]]]]         # created at/after a unix time
+    by_id: Callable[[Dict[str, List[str]]], Awaitable[List[Dict[str, Any]]]]  # {account: [ids]}
+    refunded_since: Callable[[int], Awaitable[Dict[str, List[str]]]]     # {account: [payment ids]}
+
+
+class LiveNa:
+    def __init__(self, *, norm, mutable_seconds: int):
+        self.norm = norm
+        # created/authorized payments are re-checked by id while younger than this
+        self.mutable_seconds = mutable_seconds
+        self._lock = threading.Lock()
+        # normalized id -> (raw id, account, created_at) for captured payments in the window
+        self._payments: Dict[str, Tuple[str, str, int]] = {}
+        # same, for created/authorized payments that may still be captured
+        self._pending: Dict[str, Tuple[str, str, int]] = {}
+        self._watermark: Optional[int] = None   # newest created_at listed so far
+        self._polled_at: Optional[int] = None   # unix time the last poll / rebuild started
+        self._na: Set[str] = set()
+        self._recent: Dict[str, float] = {}   # tx seen on the stream -> monotonic time
+        self._version = 0
+        self._view: Tuple[int, Dict[str, Any]] = (-1, {})
+        self._stop = threading.Event()
+        self._resync_now = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.ready = False
+        self.stream = "off"               # off | running | reconnecting | unavailable
+        self.stream_events = 0
+        self.last_poll: Optional[float] = None
+        self.last_resync: Optional[float] = None
+        self.errors = 0
+        self.last_error: Optional[str] = None
+
+    # ---- state updates ----
+    def _changed(self) -> None:
+        self._version += 1
+
+    def order_seen(self, raw_tx: Any) -> None:
+        key = self.norm(str(raw_tx or ""), case_insensitive=False)
+        if not key:
+            return
+        with self._lock:
+            self._recent[key] = time.monotonic()
+            if key in self._na:
+                self._na.discard(key)
+                self._changed()
+
+    def _seen_since(self, started: float) -> Set[str]:
+        return {k for k, t in self._recent.items() if t >= started}
+
+    def _prune_recent(self) -> None:
+        cutoff = time.monotonic() - RECENT_SECONDS
+        self._recent = {k: t for k, t in self._recent.items() if t >= cutoff}
+
+    @staticmethod
+    def _by_status(
+        rows: Iterable[Dict[str, Any]], norm, statuses: Tuple[str, ...], *, since: int = 0,
+    ) -> Dict[str, Tuple[str, str, int]]:
+        out: Dict[str, Tuple[str, str, int]] = {}
+        for p in rows:
+            raw = str(p.get("id") or "")
+            key = norm(raw, case_insensitive=False)
+            created = int(p.get("created_at") or 0)
+            if key and created >= since and (p.get("status") or "").strip().lower() in statuses:
+                out[key] = (raw, p.get("account") or "", created)
+        return out
+
+    def _advance(self, listed: List[Dict[str, Any]], started_unix: int) -> None:
+        newest = max((int(p.get("created_at") or 0) for p in listed), default=None)
+        if newest is not None and (self._watermark is None or newest > self._watermark):
+            self._watermark = newest
+        self._polled_at = started_unix
+
+    async def resync(
+        self,
+        feed: PaymentFeed,
+        matched: Callable[[List[str]], Awaitable[Set[str]]],
+    ) -> None:
+        """Rebuild the whole set: every captured payment in the window vs. orders."""
+        started = time.monotonic()
+        now = int(time.time())
+        self._resync_now.clear()
+        rows = await feed.list_since(now - LOOKBACK_SECONDS)
+        payments = self._by_status(rows, self.norm, (NA_STATUS,))
+        pending = self._by_status(rows, self.norm, NON_TERMINAL_STATUSES, since=now - self.mutable_seconds)
+        hits = await matched(list(payments))
+        with self._lock:
+            na = set(payments) - hits - self._seen_since(started)
+            self._payments, self._na = payments, na
+            self._prune_recent()
+            self._changed()
+        self._pending = pending
+        self._watermark = None
+        self._advance(rows, now)
+        self.ready = True
+        self.last_resync = self.last_poll = time.time()
+
+    def _recheck_ids(self, listed: Set[str], refunded: Dict[str, List[str]]) -> Dict[str, List[str]]:
+        """{account: raw ids} to fetch by id: pending payments, and tracked captures refunded since."""
+        out: Dict[str, Dict[str, None]] = {}
+        for key, (raw, account, _) in self._pending.items():
+            if key not in listed:
+                out.setdefault(account, {})[raw] = None
+        for account, ids in refunded.items():
+            for raw in ids:
+                key = self.norm(str(raw), case_insensitive=False)
+                if key in self._payments and key not in listed:
+                    out.setdefault(account, {})[raw] = None
+        return {account: list(ids) for account, ids in out.items()}
+
+    async def poll(
+        self,
+        feed: PaymentFeed,
+        matched: Callable[[List[str]], Awaitable[Set[str]]],
+    ) -> None:
+        """Fold in what changed since the last poll (new captures, status changes)."""
+        started = time.monotonic()
+        now = int(time.time())
+        last = self._polled_at if self._polled_at is not None else now
+        since = (self._watermark if self._watermark is not None else last) - OVERLAP_SECONDS
+        listed = await feed.list_since(since)
+        refunded = await feed.refunded_since(last - OVERLAP_SECONDS)
+        recheck = self._recheck_ids({self._key(p) for p in listed}, refunded)
+        rows = listed + (await feed.by_id(recheck) if recheck else [])
+
+        captured = self._by_status(rows, self.norm, (NA_STATUS,))
+        moved_on = {self._key(p) for p in rows} - set(captured)
+        new = [k for k in captured if k not in self._payments]
+        hits = await matched(new) if new else set()
+        cutoff = now - LOOKBACK_SECONDS
+        with self._lock:
+            seen = self._seen_since(started)
+            for key in new:
+                self._payments[key] = captured[key]
+                if key not in hits and key not in seen:
+                    self._na.add(key)
+            expired = [k for k, (_, _, created) in self._payments.items() if created < cutoff]
+            for key in [*moved_on, *expired]:
+                if self._payments.pop(key, None) is not None:
+                    self._na.discard(key)
+            if new or moved_on or expired:
+                self._changed()
+            self._prune_recent()
+
+        # pending = still created/authorized and young enough to be worth a GET each poll
+        mutable_since = now - self.mutable_seconds
+        still = self._by_status(rows, self.norm, NON_TERMINAL_STATUSES, since=mutable_since)
+        for key in {self._key(p) for p in rows} - set(still):
+            self._pending.pop(key, None)
+        self._pending.update(still)
+        self._pending = {k: v for k, v in self._pending.items() if v[2] >= mutable_since}
+        self._advance(listed, now)
+        self.last_poll = time.time()
+
+    def _key(self, p: Dict[str, Any]) -> str:
+        return self.norm(str(p.get("id") or ""), case_insensitive=False)
+
+    # ---- change stream (own thread: watch() blocks) ----
+    def start_stream(self, collection) -> None:
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._watch, args=(collection,), name="live-na-stream", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _watch(self, collection) -> None:
+        token = None
+        backoff = 1.0
+        while not self._stop.is_set():
+            try:
+                with collection.watch(_PIPELINE, resume_after=token, max_await_time_ms=1000) as stream:
+                    self.stream = "running"
+                    backoff = 1.0
+                    while not self._stop.is_set() and stream.alive:
+                        change = stream.try_next()
+                        token = stream.resume_token
+                        if change is None:
+                            continue
+                        self.stream_events += 1
+                        tx = _event_tx(change)
+                        if tx:
+                            self.order_seen(tx)
+            except OperationFailure as e:
+                if e.code in _NOT_REPLICA_SET:
+                    self.stream = "unavailable"
+                    return
+                if e.code in _HISTORY_LOST:
+                    # events were missed; start fresh and rebuild the set
+                    token = None
+                    self._resync_now.set()
+                self._stream_error(e)
+            except PyMongoError as e:
+                self._stream_error(e)
+            if self._stop.wait(backoff):
+                break
+            backoff = min(backoff * 2, 60.0)
+        self.stream = "off"
+
+    def _stream_error(self, e: Exception) -> None:
+        self.stream = "reconnecting"
+        self.errors += 1
+        self.last_error = str(e)
+
+    # ---- worker ----
+    def resync_due(self) -> bool:
+        return (not self.ready or self._resync_now.is_set()
+                or self.last_resync is None or time.time() - self.last_resync > RESYNC_SECONDS)
+
+    # ---- reads ----
+    def read(self, *, include_ids: bool = True, account: Optional[str] = None) -> Dict[str, Any]:
+        version, view = self._view
+        if version != self._version:
+            with self._lock:
+                version = self._version
+                by_account: Dict[str, List[str]] = {}
+                for key in self._na:
+                    raw, acct, _ = self._payments[key]
+                    by_account.setdefault(acct, []).append(raw)
+                for ids in by_account.values():
+                    ids.sort()
+                view = {
+                    "by_account": by_account,
+                    "na_count": len(self._na),
+                    "tracked_captured_payments": len(self._payments),
+                }
+            self._view = (version, view)
+        if account is not None:
+            ids = view["by_account"].get(account, [])
+        else:
+            ids = sorted(i for ids in view["by_account"].values() for i in ids) if len(view["by_account"]) > 1 \
+                else next(iter(view["by_account"].values()), [])
+        out: Dict[str, Any] = {
+            "ready": self.ready,
+            "na_status_filter": NA_STATUS,
+            "na_count": len(ids),
+            "na_count_by_account": {a: len(v) for a, v in view["by_account"].items()},
+            "tracked_captured_payments": view["tracked_captured_payments"],
+            "lookback_days": LOOKBACK_SECONDS / 86400,
+            "stream": self.stream,
+            "stream_events": self.stream_events,
+            "last_poll_age_seconds": round(time.time() - self.last_poll, 3) if self.last_poll else None,
+            "last_resync_age_seconds": round(time.time() - self.last_resync, 3) if self.last_resync else None,
+            "errors": self.errors,
+            "last_error": self.last_error,
+        }
+        if include_ids:
+            out["na_payment_ids"] = ids
+        return out
+
+
+async def run_live_na(
+    tracker: LiveNa,
+    *,
+    collection_factory: Callable[[], Any],
+    feed: PaymentFeed,
+    matched: Callable[[List[str]], Awaitable[Set[str]]],
+) -> None:
+    """Worker loop (run as a task from the app lifespan): stream + poll + periodic rebuild."""
+    started_stream = False
+    try:
+        while True:
+            try:
+                if not started_stream:
+                    # start watching before the first build, so no order slips between them
+                    tracker.start_stream(collection_factory())
+                    started_stream = True
+                if tracker.resync_due():
+                    await tracker.resync(feed, matched)
+                else:
+                    await tracker.poll(feed, matched)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                tracker.errors += 1
+                tracker.last_error = str(getattr(e, "detail", e))
+            await asyncio.sleep(POLL_SECONDS)
+    finally:
+        await asyncio.to_thread(tracker.stop)
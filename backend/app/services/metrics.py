@@ -0,0 +1,169 @@
+# app/services/metrics.py
+"""
+Stage-level timings for reconcile and export runs, plus a /metrics registry.
+
+A run opens stages with `with timings.stage("orders_scan", unit="docs") as s:`
+and adds counts as it goes; the same stage can be entered repeatedly (e.g. once
+per CSV page) and accumulates. While a stage is open, Razorpay calls made from
+that task (or tasks it spawns) are counted against it through a ContextVar, so
+request counts and bytes need no extra plumbing through the fetchers.
+
+Every finished stage also lands in a process-wide registry rendered in the
+Prometheus text format (no client library needed).
+"""
+import sys, time, threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def peak_rss_bytes() -> Optional[int]:
+    """Process-wide high-water mark (ru_maxrss), not the memory of any one run or stage."""
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+class Stage:
+    __slots__ = ("name", "unit", "seconds", "items", "requests", "bytes", "retries", "process_peak_rss_bytes")
+
+    def __init__(self, name: str, unit: Optional[str]):
+        self.name = name
+        self.unit = unit
+        self.seconds = 0.0
+        self.items = 0
+        self.requests = 0
+        self.bytes = 0
+        self.retries = 0
+        # the process's peak RSS so far, read when the stage last finished
+        self.process_peak_rss_bytes: Optional[int] = None
+
+    def add(self, items: int = 0, *, bytes: int = 0) -> None:
+        self.items += items
+        self.bytes += bytes
+
+    def to_dict(self) -> Dict[str, Any]:
+        out: Dict[str, Any] = {"seconds": round(self.seconds, 4)}
+        if self.unit:
+            out[self.unit] = self.items
+            out[f"{self.unit}_per_sec"] = round(self.items / self.seconds, 1) if self.seconds > 0 else None
+        if self.requests:
+            out["requests"] = self.requests
+        if self.retries:
+            out["retries"] = self.retries
+        if self.bytes:
+            out["bytes"] = self.bytes
+        if self.process_peak_rss_bytes is not None:
+            out["process_peak_rss_bytes"] = self.process_peak_rss_bytes
+        return out
+
+
+_current_stage: ContextVar[Optional[Stage]] = ContextVar("current_stage", default=None)
+
+def current_stage() -> Optional[Stage]:
+    return _current_stage.get()
+
+
+class RunTimings:
+    def __init__(self, endpoint: str):
+        self.endpoint = endpoint
+        self.started = time.perf_counter()
+        self.stages: Dict[str, Stage] = {}
+
+    @contextmanager
+    def stage(self, name: str, *, unit: Optional[str] = None) -> Iterator[Stage]:
+        s = self.stages.get(name)
+        if s is None:
+            s = self.stages[name] = Stage(name, unit)
+        token = _current_stage.set(s)
+        # registry gets this entry's deltas, so accumulating stages aren't double counted
+        before = (s.items, s.requests, s.bytes, s.retries)
+        t0 = time.perf_counter()
+        try:
+            yield s
+        finally:
+            elapsed = time.perf_counter() - t0
+            _current_stage.reset(token)
+            s.seconds += elapsed
+            s.process_peak_rss_bytes = peak_rss_bytes()
+            registry.observe(self.endpoint, s, elapsed, before)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "total_seconds": round(time.perf_counter() - self.started, 4),
+            "stages": {name: s.to_dict() for name, s in self.stages.items()},
+            "process_peak_rss_bytes": peak_rss_bytes(),
+        }
+
+
+class MetricsRegistry:
+    """Counters per (endpoint, stage), rendered for Prometheus."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._seconds: Dict[Tuple[str, str], List[float]] = {}   # -> [sum, count]
+        self._counters: Dict[Tuple[str, str, str], int] = {}    # (metric, endpoint, stage) -> value
+        self._units: Dict[Tuple[str, str], str] = {}
+
+    def observe(self, endpoint: str, s: Stage, elapsed: float, before: Tuple[int, int, int, int]) -> None:
+        key = (endpoint, s.name)
+        deltas = (s.items - before[0], s.requests - before[1], s.bytes - before[2], s.retries - before[3])
+        with self._lock:
+            acc = self._seconds.setdefault(key, [0.0, 0])
+            acc[0] += elapsed
+            acc[1] += 1
+            if s.unit:
+                self._units[key] = s.unit
+            for metric, v in zip(("items", "requests", "bytes", "retries"), deltas):
+                if v:
+                    k = (metric, endpoint, s.name)
+                    self._counters[k] = self._counters.get(k, 0) + v
+
+    def render(self) -> str:
+        lines: List[str] = []
+        with self._lock:
+            lines += [
+                "# HELP reconcile_stage_seconds Wall time spent in each reconcile/export stage.",
+                "# TYPE reconcile_stage_seconds summary",
+            ]
+            for (endpoint, stage), (total, count) in sorted(self._seconds.items()):
+                labels = _labels(endpoint=endpoint, stage=stage)
+                lines.append(f"reconcile_stage_seconds_sum{labels} {total:.6f}")
+                lines.append(f"reconcile_stage_seconds_count{labels} {count}")
+            for metric, help_text in (
+                ("items", "Rows/documents processed per stage (see the unit label)."),
+                ("requests", "Razorpay HTTP requests made per stage."),
+                ("bytes", "Bytes received from Razorpay or written to clients per stage."),
+                ("retries", "Razorpay retries (429/5xx/transport errors) per stage."),
+            ):
+                name = f"reconcile_stage_{metric}_total"
+                lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+                for (m, endpoint, stage), v in sorted(self._counters.items()):
+                    if m != metric:
+                        continue
+                    extra = {"unit": self._units.get((endpoint, stage), "")} if metric == "items" else {}
+                    lines.append(f"{name}{_labels(endpoint=endpoint, stage=stage, **extra)} {v}")
+        rss = peak_rss_bytes()
+        if rss is not None:
+            lines += [
+                "# HELP process_peak_rss_bytes Peak resident set size of this process.",
+                "# TYPE process_peak_rss_bytes gauge",
+                f"process_peak_rss_bytes {rss}",
+            ]
+        return "\n".join(lines) + "\n"
+
+
+def _labels(**labels: str) -> str:
+    def esc(v: str) -> str:
+        return v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{k}="{esc(v)}"' for k, v in labels.items()) + "}"
+
+
+registry = MetricsRegistry()
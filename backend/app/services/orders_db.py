@@ -0,0 +1,52 @@
+# app/services/orders_db.py
+"""
+Access to the orders collection (user_details) for the routes and the reconcile
+engine: one lazily created MongoClient, and a bounded thread pool that every
+blocking pymongo call goes through.
+"""
+import os
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from fastapi import HTTPException
+from pymongo import MongoClient
+
+# ---- Mongo connection via ENV ----------------------------------------------
+# Created on first use (or by the app's startup warm-up) so importing the app
+# doesn't need Mongo, and endpoints that don't touch it work without MONGO_URI.
+MONGO_DB = os.getenv("MONGO_DB", "candyman")
+_mongo_client: Optional[MongoClient] = None
+_mongo_lock = threading.Lock()
+
+def get_orders_collection():
+    global _mongo_client
+    if _mongo_client is None:
+        with _mongo_lock:
+            if _mongo_client is None:
+                mongo_uri = os.getenv("MONGO_URI")
+                if not mongo_uri:
+                    # Fail with a clear message instead of silently defaulting to localhost.
+                    raise HTTPException(500, detail="MONGO_URI not set on backend")
+                _mongo_client = MongoClient(mongo_uri, tz_aware=True)
+    return _mongo_client[MONGO_DB]["user_details"]
+
+def warm_up_mongo() -> None:
+    """Connect and round-trip once (called from the app lifespan, off the loop)."""
+    get_orders_collection().database.client.admin.command("ping")
+
+# ---- Mongo I/O off the event loop -------------------------------------------
+# pymongo is blocking, so every query runs on this bounded pool instead of the
+# uvicorn loop. Extra work queues here rather than stalling other requests.
+MONGO_THREADS = int(os.getenv("MONGO_THREADS", "8"))
+_mongo_pool = ThreadPoolExecutor(max_workers=MONGO_THREADS, thread_name_prefix="mongo")
+
+async def run_mongo(fn, *args, **kwargs):
+    return await run_mongo_on(_mongo_pool, fn, *args, **kwargs)
+
+async def run_mongo_on(pool: ThreadPoolExecutor, fn, *args, **kwargs):
+    """run_mongo on a dedicated pool (long scans that must not crowd out the shared one)."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(pool, functools.partial(fn, *args, **kwargs))
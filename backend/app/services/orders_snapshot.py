@@ -0,0 +1,179 @@
+# app/services/orders_snapshot.py
+"""
+Warm in-memory copy of order transaction ids, refreshed in the background.
+
+The snapshot is a hash map of normalized transaction_id -> number of orders
+(plus a lowercased twin, built on first case-insensitive use), so a reconcile
+can match every payment with dict lookups and no Mongo round trip on the
+request path. It rides on the local order state (app/services/orders_state.py):
+a refresh is an incremental state sync, and the snapshot applies the changes the
+sync reports. Syncs made by "incremental" reconciles feed it the same way. A
+full state rebuild is collected on the side and swapped in when it commits, so
+readers never see a half-built set.
+
+Results matched against it are as old as the last refresh; callers report that
+with `info()`. It is opt-in: the background refresher runs with
+ORDERS_SNAPSHOT=1, and a reconcile only uses it when asked for
+(match_strategy=snapshot, or auto with ORDERS_SNAPSHOT_AUTO=1).
+"""
+import os, time, threading
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from app.services.orders_state import OrdersState, get_orders_state
+
+SNAPSHOT_ENABLED = os.getenv("ORDERS_SNAPSHOT", "0") == "1"
+# let match_strategy=auto pick the snapshot (results up to MAX_AGE_SECONDS old)
+SNAPSHOT_AUTO = SNAPSHOT_ENABLED and os.getenv("ORDERS_SNAPSHOT_AUTO", "0") == "1"
+REFRESH_SECONDS = float(os.getenv("ORDERS_SNAPSHOT_REFRESH_SECONDS", "60"))
+# auto only picks the snapshot when it is at most this old
+MAX_AGE_SECONDS = float(os.getenv("ORDERS_SNAPSHOT_MAX_AGE_SECONDS", str(REFRESH_SECONDS * 5)))
+
+
+def _add(counts: Dict[str, int], tx: str, n: int) -> None:
+    v = counts.get(tx, 0) + n
+    if v > 0:
+        counts[tx] = v
+    else:
+        counts.pop(tx, None)
+
+
+class OrdersSnapshot:
+    def __init__(self, state: OrdersState):
+        self.state = state
+        self._counts: Optional[Dict[str, int]] = None   # None until first load
+        self._lower: Optional[Dict[str, int]] = None
+        self._shadow: Optional[Dict[str, int]] = None   # full rebuild in progress
+        self._orders = 0                                # sum of _counts values
+        self._lock = threading.Lock()                   # guards swaps vs. updates
+        self._refresh_lock = threading.Lock()
+        self.refreshed_at: Optional[float] = None
+        self.last_refresh: Dict[str, Any] = {}
+        self.errors = 0
+        state.subscribe(self._on_state_change)
+
+    # ---- change feed (syncing thread, state lock held) ----
+    def _on_state_change(self, kind: str, removed: List[str], added: List[str]) -> None:
+        with self._lock:
+            if self._counts is None:
+                return  # not loaded yet; the first load reads the committed table
+            if kind == "reset":
+                self._shadow = {}
+            elif kind == "change":
+                targets = [self._shadow] if self._shadow is not None else [self._counts, self._lower]
+                for counts in targets:
+                    if counts is None:
+                        continue
+                    lowered = counts is self._lower
+                    for tx in removed:
+                        _add(counts, tx.lower() if lowered else tx, -1)
+                    for tx in added:
+                        _add(counts, tx.lower() if lowered else tx, 1)
+                if self._shadow is None:
+                    self._orders += len(added) - len(removed)
+            elif kind == "done":
+                if self._shadow is not None:
+                    self._counts, self._shadow = self._shadow, None
+                    self._lower = None
+                    self._orders = sum(self._counts.values())
+                self.refreshed_at = time.time()
+            elif kind == "abort":
+                # some reported changes were rolled back: reload from the table
+                self._counts = self._lower = self._shadow = None
+
+    # ---- refresh (blocking; run on the Mongo pool) ----
+    def _install(self, counts: Dict[str, int]) -> None:
+        with self._lock:
+            self._counts, self._lower, self._shadow = counts, None, None
+            self._orders = sum(counts.values())
+            self.refreshed_at = time.time()
+
+    def refresh(
+        self,
+        collection,
+        *,
+        norm,
+        batch_size: int = 50_000,
+        on_batch: Optional[Callable[[int], None]] = None,
+    ) -> Dict[str, Any]:
+        with self._refresh_lock:
+            t0 = time.perf_counter()
+            try:
+                info = self.state.sync(collection, norm=norm, batch_size=batch_size, on_batch=on_batch)
+                if self._counts is None:
+                    # installed under the state lock, so a sync started by someone
+                    # else can't report changes before we are listening for them
+                    self.state.with_tx_counts(self._install)
+            except Exception:
+                self.errors += 1
+                raise
+            self.last_refresh = {
+                "seconds": round(time.perf_counter() - t0, 4),
+                "docs_read": info["docs_read"],
+                "full_rescan": info["full_rescan"],
+            }
+            return info
+
+    # ---- reads ----
+    @property
+    def loaded(self) -> bool:
+        return self._counts is not None
+
+    def age_seconds(self) -> Optional[float]:
+        return None if self.refreshed_at is None else time.time() - self.refreshed_at
+
+    def fresh(self, max_age: float = MAX_AGE_SECONDS) -> bool:
+        age = self.age_seconds()
+        return self.loaded and age is not None and age <= max_age
+
+    def _table(self, case_insensitive: bool) -> Dict[str, int]:
+        counts = self._counts
+        if counts is None:
+            return {}
+        if not case_insensitive:
+            return counts
+        with self._lock:
+            if self._lower is None and self._counts is not None:
+                lower: Dict[str, int] = {}
+                for tx, n in self._counts.items():
+                    _add(lower, tx.lower(), n)
+                self._lower = lower
+            return self._lower if self._lower is not None else {}
+
+    def counts(self, keys: Iterable[str], *, case_insensitive: bool) -> Iterator[Tuple[str, int]]:
+        """(key, number of orders) for every key that at least one order references."""
+        get = self._table(case_insensitive).get
+        for key in keys:
+            n = get(key)
+            if n:
+                yield key, n
+
+    def __len__(self) -> int:
+        return len(self._counts or ())
+
+    def orders_with_tx(self) -> int:
+        return self._orders
+
+    def info(self) -> Dict[str, Any]:
+        age = self.age_seconds()
+        return {
+            "refreshed_at": (datetime.fromtimestamp(self.refreshed_at, tz=timezone.utc).isoformat()
+                             if self.refreshed_at is not None else None),
+            "age_seconds": round(age, 3) if age is not None else None,
+            "distinct_transaction_ids": len(self),
+            "refresh_interval_seconds": REFRESH_SECONDS,
+            "last_refresh": self.last_refresh,
+            "refresh_errors": self.errors,
+        }
+
+
+_snapshot: Optional[OrdersSnapshot] = None
+_snapshot_lock = threading.Lock()
+
+def get_orders_snapshot() -> OrdersSnapshot:
+    global _snapshot
+    if _snapshot is None:
+        with _snapshot_lock:
+            if _snapshot is None:
+                _snapshot = OrdersSnapshot(get_orders_state())
+    return _snapshot
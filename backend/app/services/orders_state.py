@@ -0,0 +1,260 @@
+# app/services/orders_state.py
+"""
+Local SQLite copy of order -> transaction_id, kept current with an _id watermark.
+
+user_details is append-mostly, so after the first full read a sync only pulls
+orders with _id above the watermark, plus older orders whose update timestamp
+(ORDERS_STATE_UPDATED_FIELD) moved past the last one seen. Reconciles then look
+payment ids up locally; payments that were NA last time are simply checked again
+against the refreshed table. Deletes and edits that don't bump the field are
+caught by a periodic full rebuild (ORDERS_STATE_FULL_RESCAN_HOURS).
+
+The baseline order schema has no such field (only created_at / processed_at /
+approved_at), and without one an older order that later gets its transaction_id
+would stay missing until the next rebuild. So syncs refuse to run unless the
+field is configured and indexed (the index is what keeps step 1 from reading
+the whole collection).
+
+Listeners (see subscribe()) are told about every change a sync makes, so
+in-memory copies such as the orders snapshot stay in step with the table.
+
+The table lives at ORDERS_STATE_PATH (default APP_DATA_DIR/orders_state.sqlite3).
+"""
+import os, time, sqlite3, threading
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from bson import ObjectId
+from fastapi import HTTPException
+
+from app.services.sqlite_store import connect, create, data_path, get_meta, set_meta
+
+STATE_PATH = data_path("ORDERS_STATE_PATH", "orders_state.sqlite3")
+# set by every order write (e.g. "updated_at"); required, and must be indexed
+UPDATED_FIELD = os.getenv("ORDERS_STATE_UPDATED_FIELD", "").strip()
+FULL_RESCAN_SECONDS = float(os.getenv("ORDERS_STATE_FULL_RESCAN_HOURS", "24")) * 3600
+LOOKUP_CHUNK = 900  # stays under SQLite's bound-parameter limit
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS order_tx (
+    order_oid TEXT PRIMARY KEY,
+    tx TEXT NOT NULL,
+    tx_lower TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS order_tx_tx ON order_tx (tx);
+CREATE INDEX IF NOT EXISTS order_tx_tx_lower ON order_tx (tx_lower);
+"""
+
+
+class OrdersState:
+    def __init__(self, path: str):
+        self.path = path
+        # syncs run on the Mongo worker threads; one at a time
+        self._lock = threading.Lock()
+        self._listeners: List[Callable[[str, List[str], List[str]], None]] = []
+        self._updated_field_ok = False
+        create(path, _SCHEMA)
+
+    def subscribe(self, listener: Callable[[str, List[str], List[str]], None]) -> None:
+        """
+        listener(kind, removed_tx, added_tx), called on the syncing thread with the
+        state lock held. kind is "reset" (a full rebuild starts; the table is
+        empty), "change" (one batch applied: tx values that lost / gained an
+        order), "done" (the sync committed) or "abort" (it raised and was rolled
+        back, so changes already reported didn't happen).
+        """
+        self._listeners.append(listener)
+
+    def _notify(self, kind: str, removed: List[str] = (), added: List[str] = ()) -> None:
+        for listener in self._listeners:
+            listener(kind, list(removed), list(added))
+
+    def _previous_tx(self, conn: sqlite3.Connection, oids: List[str]) -> List[str]:
+        out: List[str] = []
+        for i in range(0, len(oids), LOOKUP_CHUNK):
+            chunk = oids[i:i + LOOKUP_CHUNK]
+            marks = ",".join("?" * len(chunk))
+            out += [tx for (tx,) in conn.execute(
+                f"SELECT tx FROM order_tx WHERE order_oid IN ({marks})", chunk)]
+        return out
+
+    def _apply(self, conn: sqlite3.Connection, docs: List[Dict[str, Any]], norm, *, fresh: bool = False) -> int:
+        """Upsert a batch; fresh=True when the table was just emptied (nothing to replace)."""
+        upserts, deletes = [], []
+        for doc in docs:
+            oid = str(doc["_id"])
+            tx = norm(str(doc.get("transaction_id") or ""), case_insensitive=False)
+            if tx:
+                upserts.append((oid, tx, tx.lower()))
+            else:
+                deletes.append((oid,))
+        if self._listeners:
+            removed = [] if fresh else self._previous_tx(conn, [str(doc["_id"]) for doc in docs])
+            self._notify("change", removed, [u[1] for u in upserts])
+        conn.executemany(
+            "INSERT INTO order_tx (order_oid, tx, tx_lower) VALUES (?, ?, ?) "
+            "ON CONFLICT(order_oid) DO UPDATE SET tx = excluded.tx, tx_lower = excluded.tx_lower",
+            upserts,
+        )
+        if deletes:
+            conn.executemany("DELETE FROM order_tx WHERE order_oid = ?", deletes)
+        return len(upserts)
+
+    def sync(
+        self,
+        collection,
+        *,
+        norm,
+        batch_size: int,
+        full: bool = False,
+        on_batch: Optional[Callable[[int], None]] = None,
+    ) -> Dict[str, Any]:
+        """
+        Pull new/modified orders into the local table. Blocking; call from a worker thread.
+        on_batch(docs_read_so_far) runs after each applied batch; the whole sync is one
+        transaction, committed at the end, so raising from it rolls everything back.
+        """
+        self.check_updated_field(collection)
+        with self._lock:
+            try:
+                return self._sync_locked(collection, norm=norm, batch_size=batch_size,
+                                         full=full, on_batch=on_batch)
+            except BaseException:
+                self._notify("abort")
+                raise
+
+    def check_updated_field(self, collection) -> None:
+        """400 unless ORDERS_STATE_UPDATED_FIELD is set and indexed on `collection`."""
+        if self._updated_field_ok:
+            return
+        if not UPDATED_FIELD:
+            raise HTTPException(400, detail=(
+                "Incremental order sync needs ORDERS_STATE_UPDATED_FIELD: an indexed field "
+                "that every order write updates"))
+        indexed = any(
+            next(iter(spec["key"]))[0] == UPDATED_FIELD
+            for spec in collection.index_information().values()
+        )
+        if not indexed:
+            raise HTTPException(400, detail=(
+                f"Incremental order sync needs an index on {UPDATED_FIELD} "
+                "(ORDERS_STATE_UPDATED_FIELD)"))
+        self._updated_field_ok = True
+
+    def _sync_locked(
+        self,
+        collection,
+        *,
+        norm,
+        batch_size: int,
+        full: bool,
+        on_batch: Optional[Callable[[int], None]],
+    ) -> Dict[str, Any]:
+        with connect(self.path) as conn:
+            meta = get_meta(conn)
+            last_id = ObjectId(meta["last_id"]) if meta.get("last_id") else None
+            last_updated = datetime.fromisoformat(meta["last_updated"]) if meta.get("last_updated") else None
+            last_full = float(meta.get("last_full_sync", "0"))
+            if last_id is None or time.time() - last_full > FULL_RESCAN_SECONDS:
+                full = True
+            if full:
+                conn.execute("DELETE FROM order_tx")
+                last_id, last_updated = None, None
+                self._notify("reset")
+
+            projection = {"transaction_id": 1, UPDATED_FIELD: 1}
+            docs_read = 0
+            max_updated = last_updated
+
+            def _consume(cursor: Iterator[Dict[str, Any]]) -> Optional[Any]:
+                nonlocal docs_read, max_updated
+                batch: List[Dict[str, Any]] = []
+                top_id = None
+                for doc in cursor:
+                    batch.append(doc)
+                    top_id = doc["_id"]
+                    upd = doc.get(UPDATED_FIELD)
+                    if isinstance(upd, datetime) and (max_updated is None or upd > max_updated):
+                        max_updated = upd
+                    if len(batch) >= batch_size:
+                        self._apply(conn, batch, norm, fresh=full)
+                        docs_read += len(batch)
+                        batch = []
+                        if on_batch is not None:
+                            on_batch(docs_read)
+                if batch:
+                    self._apply(conn, batch, norm, fresh=full)
+                    docs_read += len(batch)
+                    if on_batch is not None:
+                        on_batch(docs_read)
+                return top_id
+
+            # 1) orders modified since the last sync (only below the old watermark;
+            #    everything above it is read in step 2 anyway)
+            if last_id is not None:
+                since = {"$gt": last_updated} if last_updated is not None else {"$exists": True}
+                _consume(collection.find(
+                    {"_id": {"$lte": last_id}, UPDATED_FIELD: since},
+                    projection=projection,
+                ))
+
+            # 2) new orders above the _id watermark, in _id order
+            q: Dict[str, Any] = {"_id": {"$gt": last_id}} if last_id is not None else {}
+            top_id = _consume(collection.find(q, projection=projection).sort([("_id", 1)]))
+            if top_id is not None:
+                last_id = top_id
+
+            values: Dict[str, str] = {}
+            if last_id is not None:
+                values["last_id"] = str(last_id)
+            if max_updated is not None:
+                values["last_updated"] = max_updated.isoformat()
+            if full:
+                values["last_full_sync"] = str(time.time())
+            set_meta(conn, **values)
+            conn.commit()
+            self._notify("done")
+
+            orders_with_tx = conn.execute("SELECT COUNT(*) FROM order_tx").fetchone()[0]
+            return {
+                "full_rescan": full,
+                "docs_read": docs_read,
+                "orders_with_transaction_id": orders_with_tx,
+                "watermark_id": str(last_id) if last_id is not None else None,
+            }
+
+    def counts(self, keys: Iterable[str], *, case_insensitive: bool) -> Iterator[Tuple[str, int]]:
+        """(key, number of orders) for every key that at least one order references."""
+        col = "tx_lower" if case_insensitive else "tx"
+        keys = list(keys)
+        with connect(self.path) as conn:
+            for i in range(0, len(keys), LOOKUP_CHUNK):
+                chunk = keys[i:i + LOOKUP_CHUNK]
+                marks = ",".join("?" * len(chunk))
+                yield from conn.execute(
+                    f"SELECT {col}, COUNT(*) FROM order_tx WHERE {col} IN ({marks}) GROUP BY {col}",
+                    chunk,
+                )
+
+    def tx_counts(self) -> Dict[str, int]:
+        """tx -> number of orders for the whole table (waits for a running sync)."""
+        return self.with_tx_counts(lambda counts: counts)
+
+    def with_tx_counts(self, fn: Callable[[Dict[str, int]], Any]) -> Any:
+        """
+        fn(tx -> number of orders), called with the sync lock still held: no sync
+        can change the table (or notify listeners) until fn returns.
+        """
+        with self._lock:
+            with connect(self.path) as conn:
+                counts = dict(conn.execute("SELECT tx, COUNT(*) FROM order_tx GROUP BY tx"))
+            return fn(counts)
+
+
+_state: Optional[OrdersState] = None
+
+def get_orders_state() -> OrdersState:
+    global _state
+    if _state is None:
+        _state = OrdersState(STATE_PATH)
+    return _state
@@ -0,0 +1,205 @@
+# app/services/payment_index.py
+"""
+Compact, column-oriented index of the payments in one reconcile.
+
+One dict maps normalized id -> row number (its insertion order *is* the row
+order, so it doubles as the id column). Statuses are small integer codes in an
+array('B'), and matches are a one-byte-per-row counter (saturating at 255, so
+duplicate orders for one payment stay visible). The NA diff is a single bulk
+pass over those byte columns instead of per-id set arithmetic.
+
+With amounts=True the index also keeps amount / amount_refunded (paise) and a
+currency code per row, for the discrepancy engine. With accounts=True it keeps
+the Razorpay account each payment came from (the `account` tag set by the
+multi-account loader), so counts can be split per account.
+"""
+import itertools
+from array import array
+from typing import Any, Dict, Iterable, List, Optional
+
+
+_NONZERO = bytes([0] + [1] * 255)
+_MORE_THAN_ONE = bytes([0, 0] + [1] * 254)
+
+def _code(table: Dict[str, int], name: str) -> int:
+    code = table.get(name)
+    if code is None:
+        code = table[name] = len(table)
+        if code > 255:
+            raise ValueError("too many distinct values for a one-byte code column")
+    return code
+
+def _name(table: Dict[str, int], code: int) -> str:
+    for name, c in table.items():
+        if c == code:
+            return name
+    return ""
+
+def _paise(v: Any) -> int:
+    try:
+        return int(v or 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+class PaymentIndex:
+    def __init__(self, *, case_insensitive: bool, amounts: bool = False, accounts: bool = False):
+        self.case_insensitive = case_insensitive
+        self._rows: Dict[str, int] = {}
+        # raw ids are only kept when they differ from the keys (case-insensitive runs)
+        self._raw_ids: Optional[List[str]] = [] if case_insensitive else None
+        self._status_codes: Dict[str, int] = {}
+        self.status = array("B")
+        self.matched = bytearray()
+        self.amounts = amounts
+        if amounts:
+            self._currency_codes: Dict[str, int] = {}
+            self.amount = array("q")
+            self.amount_refunded = array("q")
+            self.currency = array("B")
+        self.accounts = accounts
+        if accounts:
+            self._account_codes: Dict[str, int] = {}
+            self.account = array("B")
+
+    @classmethod
+    def build(
+        cls,
+        payments: Iterable[Dict[str, Any]],
+        *,
+        case_insensitive: bool,
+        norm,
+        amounts: bool = False,
+        accounts: bool = False,
+    ) -> "PaymentIndex":
+        idx = cls(case_insensitive=case_insensitive, amounts=amounts, accounts=accounts)
+        for p in payments:
+            raw_id = str(p.get("id", "") or "")
+            if not raw_id:
+                continue
+            row = idx.add(norm(raw_id, case_insensitive=case_insensitive), raw_id,
+                          (p.get("status") or "").strip().lower())
+            if amounts:
+                idx.amount[row] = _paise(p.get("amount"))
+                idx.amount_refunded[row] = _paise(p.get("amount_refunded"))
+                idx.currency[row] = _code(idx._currency_codes, (p.get("currency") or "").strip().upper())
+            if accounts:
+                idx.account[row] = _code(idx._account_codes, p.get("account") or "")
+        return idx
+
+    def add(self, key: str, raw_id: str, status: str) -> int:
+        row = self._rows.get(key)
+        if row is not None:
+            # duplicate id: last one wins, like a dict of records would
+            self.status[row] = _code(self._status_codes, status)
+            if self._raw_ids is not None:
+                self._raw_ids[row] = raw_id
+            return row
+        row = len(self._rows)
+        self._rows[key] = row
+        if self._raw_ids is not None:
+            self._raw_ids.append(raw_id)
+        self.status.append(_code(self._status_codes, status))
+        self.matched.append(0)
+        if self.amounts:
+            self.amount.append(0)
+            self.amount_refunded.append(0)
+            self.currency.append(0)
+        if self.accounts:
+            self.account.append(0)
+        return row
+
+    def status_name(self, row: int) -> str:
+        return _name(self._status_codes, self.status[row])
+
+    def currency_name(self, row: int) -> str:
+        return _name(self._currency_codes, self.currency[row])
+
+    def raw_id(self, row: int, key: str) -> str:
+        """Raw Razorpay id for a row found under `key`."""
+        return self._raw_ids[row] if self._raw_ids is not None else key
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._rows
+
+    def row(self, key: str) -> Optional[int]:
+        return self._rows.get(key)
+
+    def keys(self) -> Iterable[str]:
+        """Normalized ids, in row order."""
+        return self._rows.keys()
+
+    def raw_ids(self) -> Iterable[str]:
+        return self._raw_ids if self._raw_ids is not None else self._rows.keys()
+
+    def mark(self, key: str, orders: int = 1) -> Optional[int]:
+        """Count order(s) against a payment; returns its row, or None if the key isn't a payment."""
+        row = self._rows.get(key)
+        if row is None:
+            return None
+        self.matched[row] = min(255, self.matched[row] + orders)
+        return row
+
+    def mark_rows(self, rows: Iterable[int]) -> None:
+        """Count one order against each row (rows found earlier via row())."""
+        matched = self.matched
+        for row in rows:
+            if matched[row] < 255:
+                matched[row] += 1
+
+    def matched_count(self) -> int:
+        return len(self.matched) - self.matched.count(0)
+
+    def duplicate_ids(self) -> List[str]:
+        """Raw ids of payments referenced by more than one order, sorted."""
+        mask = bytes(self.matched).translate(_MORE_THAN_ONE)
+        ids = list(itertools.compress(self.raw_ids(), mask))
+        ids.sort()
+        return ids
+
+    @staticmethod
+    def _code_mask(column: array, table: Dict[str, int], name: str) -> int:
+        code = table.get(name)
+        if code is None:
+            return 0
+        tr = bytes(1 if i == code else 0 for i in range(256))
+        return int.from_bytes(column.tobytes().translate(tr), "little")
+
+    def _status_mask(self, status: str) -> int:
+        return self._code_mask(self.status, self._status_codes, status)
+
+    def _matched_mask(self) -> int:
+        return int.from_bytes(bytes(self.matched).translate(_NONZERO), "little")
+
+    def na_ids(self, status: str, *, account: Optional[str] = None) -> List[str]:
+        """Raw ids with this status (and account, if given) and no matching order, sorted."""
+        n = len(self._rows)
+        if not n:
+            return []
+        # bytes are 0/1, so big-int AND / AND-NOT is an element-wise pass over all rows
+        mask = self._status_mask(status) & ~self._matched_mask()
+        if account is not None:
+            mask &= self._code_mask(self.account, self._account_codes, account)
+        ids = list(itertools.compress(self.raw_ids(), mask.to_bytes(n, "little")))
+        ids.sort()
+        return ids
+
+    def account_names(self) -> List[str]:
+        return list(self._account_codes) if self.accounts else []
+
+    def account_counts(self, status: str) -> Dict[str, Dict[str, int]]:
+        """Per account: payments, distinct matched payments, and NA payments with this status."""
+        matched = self._matched_mask()
+        na = self._status_mask(status) & ~matched
+        out: Dict[str, Dict[str, int]] = {}
+        for name in self.account_names():
+            mask = self._code_mask(self.account, self._account_codes, name)
+            out[name] = {
+                "total_payments_rows": mask.bit_count(),
+                "matched_distinct_payment_ids": (mask & matched).bit_count(),
+                "na_count": (mask & na).bit_count(),
+            }
+        return out
@@ -0,0 +1,185 @@
+# app/services/payments_export.py
+"""
+Typed encoders for the payments export (ndjson, Arrow, Parquet).
+
+Each encoder turns pages of Razorpay payment dicts into bytes as they stream
+in: write(page) returns whatever is ready to send, close() the rest. Amounts
+stay integer paise, created_at is a real timestamp, and `notes` keeps its
+structure (a JSON object in ndjson, a JSON string column in Arrow/Parquet,
+since its keys differ from payment to payment).
+
+Arrow and Parquet need the optional `pyarrow` package. Rows are buffered into
+row groups / record batches of EXPORT_ROW_GROUP_ROWS before they are written.
+"""
+import io, os, json
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List, Optional
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+EXPORT_FORMATS = ("csv", "ndjson", "parquet", "arrow")
+ROW_GROUP_ROWS = int(os.getenv("EXPORT_ROW_GROUP_ROWS", "65536"))
+PARQUET_COMPRESSION = os.getenv("EXPORT_PARQUET_COMPRESSION", "zstd")
+
+MEDIA_TYPES = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+    "parquet": "application/vnd.apache.parquet",
+    "arrow": "application/vnd.apache.arrow.stream",
+}
+
+# same columns as the CSV, typed
+_STRING_COLUMNS = (
+    "id", "currency", "status", "order_id", "invoice_id", "method", "refund_status",
+    "description", "card_id", "bank", "wallet", "vpa", "email", "contact",
+    "error_code", "error_description",
+)
+_AMOUNT_COLUMNS = ("amount", "amount_refunded", "fee", "tax")
+
+
+def _int(v: Any) -> Optional[int]:
+    if v is None or v == "":
+        return None
+    try:
+        return int(v)
+    except (TypeError, ValueError):
+        return None
+
+
+def payment_record(p: Dict[str, Any]) -> Dict[str, Any]:
+    """One payment as a flat, typed record (notes left as a dict)."""
+    upi = p.get("upi") or {}
+    acq = p.get("acquirer_data") or {}
+    rec: Dict[str, Any] = {k: p.get(k) for k in _STRING_COLUMNS}
+    for k in _AMOUNT_COLUMNS:
+        rec[k] = _int(p.get(k))
+    rec["international"] = p.get("international")
+    rec["captured"] = p.get("captured")
+    rec["vpa"] = p.get("vpa") or upi.get("vpa")
+    rec["notes"] = p.get("notes") or None
+    rec["created_at"] = _int(p.get("created_at"))
+    rec["Payments_RRN"] = acq.get("rrn")
+    rec["Payments_ARN"] = acq.get("authentication_reference_number")
+    rec["Auth_code"] = acq.get("auth_code")
+    rec["flow"] = upi.get("flow")
+    return rec
+
+
+class NdjsonEncoder:
+    def write(self, page: List[Dict[str, Any]]) -> bytes:
+        return "".join(
+            json.dumps(payment_record(p), separators=(",", ":"), default=str) + "\n" for p in page
+        ).encode("utf-8")
+
+    def close(self) -> bytes:
+        return b""
+
+
+def _arrow_schema():
+    fields = [pa.field(k, pa.string()) for k in _STRING_COLUMNS]
+    fields += [pa.field(k, pa.int64()) for k in _AMOUNT_COLUMNS]
+    fields += [
+        pa.field("international", pa.bool_()),
+        pa.field("captured", pa.bool_()),
+        pa.field("notes", pa.string()),  # JSON
+        pa.field("created_at", pa.timestamp("s", tz="UTC")),
+        pa.field("Payments_RRN", pa.string()),
+        pa.field("Payments_ARN", pa.string()),
+        pa.field("Auth_code", pa.string()),
+        pa.field("flow", pa.string()),
+    ]
+    return pa.schema(fields)
+
+
+class _Sink(io.RawIOBase):
+    """Write-only file object that hands back what pyarrow wrote since the last drain."""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+        self._pos = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b) -> int:
+        data = bytes(b)
+        self._chunks.append(data)
+        self._pos += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._pos
+
+    def drain(self) -> bytes:
+        out = b"".join(self._chunks)
+        self._chunks.clear()
+        return out
+
+
+class _ArrowEncoderBase(ABC):
+    def __init__(self):
+        self.schema = _arrow_schema()
+        self._sink = _Sink()
+        self._rows: List[Dict[str, Any]] = []
+        self._writer = self._open()
+
+    @abstractmethod
+    def _open(self):
+        """The pyarrow writer, writing into self._sink."""
+
+    @abstractmethod
+    def _write_table(self, table) -> None:
+        """Write one buffered pyarrow.Table with self._writer."""
+
+    def _flush(self) -> None:
+        if not self._rows:
+            return
+        self._write_table(pa.Table.from_pylist(self._rows, schema=self.schema))
+        self._rows = []
+
+    def write(self, page: List[Dict[str, Any]]) -> bytes:
+        for p in page:
+            rec = payment_record(p)
+            if rec["notes"] is not None:
+                rec["notes"] = json.dumps(rec["notes"], separators=(",", ":"), default=str)
+            self._rows.append(rec)
+        if len(self._rows) >= ROW_GROUP_ROWS:
+            self._flush()
+        return self._sink.drain()
+
+    def close(self) -> bytes:
+        self._flush()
+        self._writer.close()
+        return self._sink.drain()
+
+
+class ParquetEncoder(_ArrowEncoderBase):
+    def _open(self):
+        return pq.ParquetWriter(self._sink, self.schema, compression=PARQUET_COMPRESSION)
+
+    def _write_table(self, table) -> None:
+        self._writer.write_table(table, row_group_size=ROW_GROUP_ROWS)
+
+
+class ArrowStreamEncoder(_ArrowEncoderBase):
+    """Arrow IPC stream format (readable with pyarrow.ipc.open_stream)."""
+
+    def _open(self):
+        return pa.ipc.new_stream(self._sink, self.schema)
+
+    def _write_table(self, table) -> None:
+        self._writer.write_table(table, max_chunksize=ROW_GROUP_ROWS)
+
+
+def make_encoder(fmt: str):
+    """Encoder for a non-CSV format; raises RuntimeError if pyarrow is needed but missing."""
+    if fmt == "ndjson":
+        return NdjsonEncoder()
+    if pa is None:
+        raise RuntimeError(f"format={fmt} needs the optional 'pyarrow' package")
+    return ParquetEncoder() if fmt == "parquet" else ArrowStreamEncoder()
@@ -0,0 +1,312 @@
+# app/services/payments_mirror.py
+"""
+Local SQLite mirror of Razorpay payments.
+
+The mirror keeps every payment it has seen plus a `created_at` watermark. An
+incremental sync lists only payments created after the watermark (less a short
+overlap), then re-fetches by id the rows that can still change: recent ones
+still created/authorized, and any payment refunded since the last sync (listed
+via /refunds). A full resync pulls the whole history into a side table and
+swaps it in at the end. Either way pages are written as they arrive, so a sync
+never holds the window in memory.
+
+The mirror is opt-in (mirror=incremental / full); the first sync of an account
+pulls its whole history. Each Razorpay account gets its own mirror file under
+APP_DATA_DIR (default backend/data), or at RZP_MIRROR_PATH.
+"""
+import os, json, time, asyncio
+from typing import Any, Callable, Dict, List, Optional
+
+import httpx
+
+from app.services.sqlite_store import connect, create, data_path, get_meta, set_meta
+
+MIRROR_PATH = data_path("RZP_MIRROR_PATH", "razorpay_mirror.sqlite3")
+# payments are listed again from this long before the watermark, for ones that
+# show up in the list a little after their created_at
+OVERLAP_SECONDS = int(os.getenv("RZP_MIRROR_OVERLAP_SECONDS", "300"))
+# created/authorized payments can still move on (authorized ones are captured or
+# expire within 5 days); mirror rows in those states younger than this are
+# re-fetched by id on every incremental sync
+NON_TERMINAL_STATUSES = ("created", "authorized")
+MUTABLE_SECONDS = int(os.getenv("RZP_MIRROR_MUTABLE_SECONDS", str(7 * 86400)))
+# /refunds is re-read from a little before the last sync, for clock skew
+REFUNDS_OVERLAP_SECONDS = 600
+# skip the incremental pull entirely if we synced this recently
+MIN_SYNC_INTERVAL = float(os.getenv("RZP_MIRROR_MIN_SYNC_INTERVAL", "30"))
+SYNC_MAX = int(os.getenv("RZP_MIRROR_SYNC_MAX", "5000000"))
+
+MIRROR_MODES = ("incremental", "full", "off")
+
+_TABLE = """
+CREATE TABLE IF NOT EXISTS {name} (
+    id TEXT PRIMARY KEY,
+    created_at INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+"""
+_INDEX = "CREATE INDEX IF NOT EXISTS payments_created_at ON payments (created_at);"
+_SCHEMA = _TABLE.format(name="payments") + _INDEX
+# a full resync fills this table page by page and swaps it in at the end
+_STAGING = "payments_resync"
+
+
+class PaymentsMirror:
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = asyncio.Lock()
+        self._last_sync_mono: Optional[float] = None
+        create(path, _SCHEMA)
+
+    # ---- meta -----------------------------------------------------------------
+    def _get_meta(self, key: str) -> Optional[str]:
+        with connect(self.path) as conn:
+            return get_meta(conn).get(key)
+
+    def watermark(self) -> Optional[int]:
+        v = self._get_meta("watermark")
+        return int(v) if v is not None else None
+
+    # ---- writes ---------------------------------------------------------------
+    def _store(self, payments: List[Dict[str, Any]], *, table: str = "payments") -> None:
+        rows = [
+            (p["id"], int(p.get("created_at") or 0), (p.get("status") or "").strip().lower(),
+             json.dumps(p, separators=(",", ":")))
+            for p in payments if p.get("id")
+        ]
+        with connect(self.path) as conn:
+            conn.executemany(
+                f"INSERT INTO {table} (id, created_at, status, data) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET created_at = excluded.created_at, "
+                "status = excluded.status, data = excluded.data",
+                rows,
+            )
+
+    def _start_resync(self) -> None:
+        with connect(self.path) as conn:
+            conn.execute(f"DROP TABLE IF EXISTS {_STAGING}")
+            conn.execute(_TABLE.format(name=_STAGING))
+
+    def _finish(self, *, synced_at: int, resync: bool) -> Optional[int]:
+        """Swap in the resync table (if any), then advance watermark / synced_at."""
+        with connect(self.path) as conn:
+            conn.execute("BEGIN IMMEDIATE")  # DDL included: readers see old or new, never neither
+            if resync:
+                conn.execute("DROP TABLE payments")
+                conn.execute(f"ALTER TABLE {_STAGING} RENAME TO payments")
+                conn.execute(_INDEX)
+            hi = conn.execute("SELECT MAX(created_at) FROM payments").fetchone()[0]
+            values = {"synced_at": str(synced_at)}
+            if hi is not None:
+                values["watermark"] = str(hi)
+            set_meta(conn, **values)
+        return hi
+
+    def _recheck_ids(self, *, since: int) -> List[str]:
+        marks = ",".join("?" * len(NON_TERMINAL_STATUSES))
+        with connect(self.path) as conn:
+            return [pid for (pid,) in conn.execute(
+                f"SELECT id FROM payments WHERE status IN ({marks}) AND created_at >= ?",
+                (*NON_TERMINAL_STATUSES, since),
+            )]
+
+    async def sync(
+        self,
+        client: httpx.AsyncClient,
+        *,
+        full: bool = False,
+        on_page: Optional[Callable[[int], None]] = None,
+    ) -> Dict[str, Any]:
+        """Bring the mirror up to date. Concurrent callers share one sync."""
+        # imported here to avoid a cycle (the router imports this module)
+        from app.routers.razorpay_export import (
+            FETCH_CONCURRENCY, for_each_payment_page, fetch_refunded_payment_ids, fetch_payments_by_id,
+        )
+
+        async with self._lock:
+            watermark = await asyncio.to_thread(self.watermark)
+            if watermark is None:
+                full = True
+
+            if (not full and self._last_sync_mono is not None
+                    and time.monotonic() - self._last_sync_mono < MIN_SYNC_INTERVAL):
+                return {"mode": "cached", "fetched": 0, "watermark": watermark}
+
+            started = int(time.time())
+            table = _STAGING if full else "payments"
+            if full:
+                await asyncio.to_thread(self._start_resync)
+            # pages are written as they arrive; one writer at a time
+            write_lock = asyncio.Lock()
+            pulled: set = set()
+
+            async def _write(page: List[Dict[str, Any]]) -> None:
+                if not full:
+                    pulled.update(p.get("id") for p in page)
+                async with write_lock:
+                    await asyncio.to_thread(self._store, page, table=table)
+
+            fetched = await for_each_payment_page(
+                client, _write,
+                status_filter=None,
+                from_unix=None if full else max(0, watermark - OVERLAP_SECONDS),
+                to_unix=None,
+                max_fetch=SYNC_MAX,
+                # an incremental gap is usually one page: time shards would each cost a call
+                concurrency=FETCH_CONCURRENCY if full else 1,
+                on_page=on_page,
+            )
+
+            rechecked = refunds = 0
+            if not full:
+                # older rows that may have changed: still pending, or refunded since last sync
+                last_sync = int(await asyncio.to_thread(self._get_meta, "synced_at") or started)
+                pending = [pid for pid in await asyncio.to_thread(
+                    self._recheck_ids, since=started - MUTABLE_SECONDS) if pid not in pulled]
+                skip = pulled.union(pending)
+                refunded = [pid for pid in await fetch_refunded_payment_ids(
+                    client, from_unix=last_sync - REFUNDS_OVERLAP_SECONDS,
+                ) if pid not in skip]
+                if pending or refunded:
+                    await _write(await fetch_payments_by_id(client, pending + refunded))
+                rechecked, refunds = len(pending), len(refunded)
+                fetched += rechecked + refunds
+
+            watermark = await asyncio.to_thread(self._finish, synced_at=started, resync=full)
+            self._last_sync_mono = time.monotonic()
+            return {"mode": "full" if full else "incremental", "fetched": fetched,
+                    "pending_rechecked": rechecked, "refunds_refreshed": refunds,
+                    "watermark": watermark}
+
+    # ---- reads ----------------------------------------------------------------
+    def _query(
+        self,
+        *,
+        status_filter: Optional[str],
+        from_unix: Optional[int],
+        to_unix: Optional[int],
+        max_fetch: int,
+        light: bool,
+    ) -> List[Dict[str, Any]]:
+        where, args = [], []
+        if status_filter:
+            where.append("status = ?"); args.append(status_filter.strip().lower())
+        if from_unix is not None:
+            where.append("created_at >= ?"); args.append(from_unix)
+        if to_unix is not None:
+            where.append("created_at <= ?"); args.append(to_unix)
+
+        cols = ("id, status, created_at, json_extract(data, '$.amount'), "
+                "json_extract(data, '$.amount_refunded'), json_extract(data, '$.currency')"
+                if light else "data")
+        sql = f"SELECT {cols} FROM payments"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY created_at DESC LIMIT ?"
+        args.append(max_fetch)
+
+        with connect(self.path) as conn:
+            cur = conn.execute(sql, args)
+            if light:
+                return [{"id": i, "status": s, "created_at": c, "amount": a,
+                         "amount_refunded": r, "currency": cur_}
+                        for i, s, c, a, r, cur_ in cur]
+            return [json.loads(d) for (d,) in cur]
+
+    async def query(
+        self,
+        *,
+        status_filter: Optional[str],
+        from_unix: Optional[int],
+        to_unix: Optional[int],
+        max_fetch: int,
+        light: bool = False,
+    ) -> List[Dict[str, Any]]:
+        """
+        Payments in [from_unix, to_unix], newest first, like fetch_payments.
+        light=True returns only id/status/created_at/amount/amount_refunded/currency
+        (enough for reconciles).
+        """
+        return await asyncio.to_thread(
+            self._query,
+            status_filter=status_filter,
+            from_unix=from_unix,
+            to_unix=to_unix,
+            max_fetch=max_fetch,
+            light=light,
+        )
+
+    def _query_page(
+        self,
+        *,
+        status_filter: Optional[str],
+        from_unix: Optional[int],
+        to_unix: Optional[int],
+        after: Optional[tuple],
+        limit: int,
+    ) -> List[tuple]:
+        where, args = [], []
+        if status_filter:
+            where.append("status = ?"); args.append(status_filter.strip().lower())
+        if from_unix is not None:
+            where.append("created_at >= ?"); args.append(from_unix)
+        if to_unix is not None:
+            where.append("created_at <= ?"); args.append(to_unix)
+        if after is not None:
+            # keyset: strictly "older" than the last row of the previous page
+            where.append("(created_at < ? OR (created_at = ? AND id < ?))")
+            args.extend([after[0], after[0], after[1]])
+
+        sql = "SELECT created_at, id, data FROM payments"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY created_at DESC, id DESC LIMIT ?"
+        args.append(limit)
+
+        with connect(self.path) as conn:
+            return conn.execute(sql, args).fetchall()
+
+    async def iter_query(
+        self,
+        *,
+        status_filter: Optional[str],
+        from_unix: Optional[int],
+        to_unix: Optional[int],
+        max_fetch: int,
+        page_size: int = 1000,
+    ):
+        """Same rows as query(), yielded page by page so callers can stream them."""
+        after = None
+        left = max_fetch
+        while left > 0:
+            rows = await asyncio.to_thread(
+                self._query_page,
+                status_filter=status_filter,
+                from_unix=from_unix,
+                to_unix=to_unix,
+                after=after,
+                limit=min(page_size, left),
+            )
+            if not rows:
+                break
+            left -= len(rows)
+            after = (rows[-1][0], rows[-1][1])
+            yield [json.loads(d) for _, _, d in rows]
+
+
+def mirror_path(account: Optional[str] = None) -> str:
+    """MIRROR_PATH for the default account, `<stem>.<account><ext>` beside it for others."""
+    if not account:
+        return MIRROR_PATH
+    stem, ext = os.path.splitext(MIRROR_PATH)
+    return f"{stem}.{account}{ext}"
+
+_mirrors: Dict[Optional[str], PaymentsMirror] = {}
+
+def get_mirror(account: Optional[str] = None) -> PaymentsMirror:
+    """The mirror for one Razorpay account (None = the default account)."""
+    m = _mirrors.get(account)
+    if m is None:
+        m = _mirrors[account] = PaymentsMirror(mirror_path(account))
+    return m
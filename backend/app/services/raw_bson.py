@@ -0,0 +1,115 @@
+# app/services/raw_bson.py
+"""
+Minimal BSON reader for the orders scan.
+
+find_raw_batches() hands back each server batch as one bytes object holding the
+documents back to back. scan_batch() walks those bytes and pulls out one field
+plus the last _id (for paging) without building a dict per document.
+
+The common batch, where every document is exactly `{_id: ObjectId, field: str}`
+(or has no field), is matched by one regex in C; that is several times cheaper
+than decoding. Anything else is walked element by element, and documents with
+types we don't read by hand (non-ObjectId _id, non-string field, ...) are
+handed to bson.decode().
+"""
+import re, struct
+from functools import lru_cache
+from typing import Any, List, Optional, Tuple
+
+import bson
+from bson import ObjectId
+
+_int32 = struct.Struct("<i").unpack_from
+
+# value sizes of fixed-width element types (double, ObjectId, bool, datetime,
+# null, int32, timestamp, int64, decimal128, min/max key)
+_FIXED_SIZES = {0x01: 8, 0x07: 12, 0x08: 1, 0x09: 8, 0x0A: 0, 0x10: 4,
+                0x11: 8, 0x12: 8, 0x13: 16, 0xFF: 0, 0x7F: 0}
+_STRING, _OBJECT_ID = 0x02, 0x07
+
+
+@lru_cache(maxsize=8)
+def _batch_patterns(field: str) -> Tuple["re.Pattern", "re.Pattern"]:
+    """(whole batch of plain documents, one plain document -> (_id bytes, field bytes))"""
+    name = re.escape(field.encode("utf-8"))
+
+    def doc(group: bytes) -> bytes:
+        # int32 size, ObjectId _id, optional string field, end of document
+        return (rb"....\x07_id\x00" + group + rb".{12})(?:\x02" + name
+                + rb"\x00...." + group + rb"[^\x00]*)\x00)?\x00")
+
+    return re.compile(rb"(?:" + doc(b"(?:") + rb")*", re.S), re.compile(doc(b"("), re.S)
+
+
+def _decode_one(data: bytes, start: int, end: int, field: str) -> Tuple[Any, Any]:
+    doc = bson.decode(data[start:end])
+    return doc.get("_id"), doc.get(field)
+
+
+def scan_batch(data: bytes, field: str) -> Tuple[int, List[str], Optional[Any]]:
+    """
+    (documents in the batch, str values of `field` for documents where it is
+    truthy, last document's _id). Non-string values are str()-ed.
+    """
+    whole, one = _batch_patterns(field)
+    if whole.fullmatch(data) is not None:
+        found = one.findall(data)
+        if not found:
+            return 0, [], None
+        return (
+            len(found),
+            [v.decode("utf-8") for _, v in found if v],
+            ObjectId(found[-1][0]),
+        )
+    return _walk_batch(data, field)
+
+
+def _walk_batch(data: bytes, field: str) -> Tuple[int, List[str], Optional[Any]]:
+    name = field.encode("utf-8")
+    find = data.find
+    end = len(data)
+    pos = 0
+    docs = 0
+    values: List[str] = []
+    append = values.append
+    last_id: Any = None
+    last_oid: Optional[int] = None  # offset of the last ObjectId _id, decoded once at the end
+
+    while pos < end:
+        size = _int32(data, pos)[0]
+        doc_end = pos + size - 1  # trailing 0x00
+        docs += 1
+        value: Any = None
+        p = pos + 4
+        while p < doc_end:
+            etype = data[p]
+            name_end = find(b"\x00", p + 1)
+            ename = data[p + 1:name_end]
+            p = name_end + 1
+            if etype == _STRING:
+                n = _int32(data, p)[0]
+                if ename == name:
+                    value = data[p + 4:p + 3 + n].decode("utf-8")
+                elif ename == b"_id":
+                    break
+                p += 4 + n
+            elif etype == _OBJECT_ID and ename == b"_id":
+                last_oid = p
+                p += 12
+            elif etype in _FIXED_SIZES and ename != name and ename != b"_id":
+                p += _FIXED_SIZES[etype]
+            else:
+                break
+        if p < doc_end:
+            # something we don't walk by hand (non-ObjectId _id, non-string field, ...)
+            last_id, value = _decode_one(data, pos, doc_end + 1, field)
+            last_oid = None
+            if value and not isinstance(value, str):
+                value = str(value)
+        if value:
+            append(value)
+        pos = doc_end + 1
+
+    if last_oid is not None:
+        last_id = ObjectId(data[last_oid:last_oid + 12])
+    return docs, values, last_id
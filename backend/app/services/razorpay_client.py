@@ -0,0 +1,146 @@
+# app/services/razorpay_client.py
+"""
+One shared Razorpay HTTP client per credential pair.
+
+Keeps a pooled (HTTP/2 when `h2` is installed) httpx.AsyncClient alive for the
+whole process and puts every request through a token bucket. A 429 halves the
+bucket's rate and pauses it for Retry-After (or a jittered exponential backoff);
+successful calls creep the rate back up. The bucket's lock is FIFO, so
+concurrent exports and reconciles take turns instead of racing each other.
+"""
+import os, time, random, asyncio
+from typing import Any, Dict, Optional
+
+import httpx
+
+from app.services.metrics import current_stage
+
+try:
+    import h2  # noqa: F401  (httpx needs it for http2=True)
+    HTTP2 = True
+except ImportError:
+    HTTP2 = False
+
+RATE_PER_SEC = float(os.getenv("RZP_RATE_PER_SEC", "20"))
+MIN_RATE_PER_SEC = float(os.getenv("RZP_MIN_RATE_PER_SEC", "1"))
+BURST = int(os.getenv("RZP_BURST", "20"))
+MAX_RETRIES = int(os.getenv("RZP_MAX_RETRIES", "5"))
+BACKOFF_BASE = float(os.getenv("RZP_BACKOFF_BASE", "0.5"))
+BACKOFF_MAX = float(os.getenv("RZP_BACKOFF_MAX", "30"))
+MAX_CONNECTIONS = int(os.getenv("RZP_MAX_CONNECTIONS", "32"))
+TIMEOUT = float(os.getenv("RZP_TIMEOUT", "60"))
+
+RETRY_STATUSES = {429, 502, 503, 504}
+
+
+class AdaptiveTokenBucket:
+    def __init__(self, rate: float, burst: int, *, min_rate: float):
+        self.max_rate = rate
+        self.min_rate = min_rate
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.blocked_until:
+                    await asyncio.sleep(self.blocked_until - now)
+                    continue
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def on_throttled(self, pause: float) -> None:
+        # multiplicative decrease, and nobody sends until the pause is over
+        self.rate = max(self.min_rate, self.rate / 2)
+        self.tokens = 0.0
+        self.blocked_until = max(self.blocked_until, time.monotonic() + pause)
+
+    def on_success(self) -> None:
+        # additive increase back towards the configured rate
+        if self.rate < self.max_rate:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 50)
+
+
+def _retry_after(resp: httpx.Response) -> Optional[float]:
+    v = resp.headers.get("Retry-After")
+    if not v:
+        return None
+    try:
+        return max(0.0, float(v))
+    except ValueError:
+        return None
+
+
+class RazorpayClient:
+    """Drop-in for the httpx.AsyncClient.get() calls in the Razorpay routers."""
+
+    def __init__(self, key_id: str, key_secret: str):
+        self.bucket = AdaptiveTokenBucket(RATE_PER_SEC, BURST, min_rate=MIN_RATE_PER_SEC)
+        self._client = httpx.AsyncClient(
+            auth=(key_id, key_secret),
+            http2=HTTP2,
+            timeout=TIMEOUT,
+            limits=httpx.Limits(max_connections=MAX_CONNECTIONS,
+                                max_keepalive_connections=MAX_CONNECTIONS),
+        )
+
+    async def get(self, url: str, params: Optional[Dict[str, Any]] = None) -> httpx.Response:
+        attempt = 0
+        stage = current_stage()  # per-run accounting, see app/services/metrics.py
+        while True:
+            await self.bucket.acquire()
+            if stage is not None:
+                stage.requests += 1
+            try:
+                resp = await self._client.get(url, params=params)
+            except httpx.TransportError:
+                if attempt >= MAX_RETRIES:
+                    raise
+                resp = None
+            if resp is not None and stage is not None:
+                stage.bytes += len(resp.content)
+
+            if resp is not None and resp.status_code not in RETRY_STATUSES:
+                self.bucket.on_success()
+                return resp
+            if attempt >= MAX_RETRIES:
+                return resp  # caller's raise_for_status() reports it
+
+            # full jitter; Retry-After (when given) is a floor
+            delay = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+            if resp is not None:
+                delay = max(delay, _retry_after(resp) or 0.0)
+                if resp.status_code == 429:
+                    self.bucket.on_throttled(delay)
+            if stage is not None:
+                stage.retries += 1
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    async def aclose(self) -> None:
+        await self._client.aclose()
+
+
+_clients: Dict[tuple, RazorpayClient] = {}
+
+def get_razorpay_client(key_id: str, key_secret: str) -> RazorpayClient:
+    key = (key_id, key_secret)
+    client = _clients.get(key)
+    if client is None:
+        client = _clients[key] = RazorpayClient(key_id, key_secret)
+    return client
+
+async def close_razorpay_clients() -> None:
+    clients = list(_clients.values())
+    _clients.clear()
+    for c in clients:
+        await c.aclose()
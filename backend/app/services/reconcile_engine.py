@@ -0,0 +1,689 @@
+# app/services/reconcile_engine.py
+"""
+The reconcile engine: Razorpay payments vs. Mongo orders.
+
+reconcile_payments_orders() pulls the payments (live or from the mirror), builds
+a PaymentIndex, matches orders against it with one of the strategies below and
+returns the NA ids plus summary counts. The routes, the job manager
+(app/services/reconcile_service.py) and the agent tools all run it from here.
+The background workers that keep match data warm (orders snapshot, live NA)
+live here too, since they share the matchers.
+"""
+import os
+import re
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+import httpx
+from bson import ObjectId
+from fastapi import HTTPException
+from pymongo.collection import Collection
+from pymongo.errors import PyMongoError
+
+from app.routers.razorpay_export import (
+    LIGHT_FIELDS, fetch_payments_by_id, fetch_refunded_payment_ids, load_accounts_payments,
+    razorpay_client, resolve_accounts,
+)
+from app.services.orders_db import get_orders_collection, run_mongo, run_mongo_on
+from app.services.payment_index import PaymentIndex
+from app.services.discrepancies import DiscrepancyCollector, ORDER_DIFF_FIELDS
+from app.services.orders_state import get_orders_state
+from app.services.orders_snapshot import (
+    get_orders_snapshot, SNAPSHOT_AUTO, REFRESH_SECONDS as SNAPSHOT_REFRESH_SECONDS,
+)
+from app.services.metrics import RunTimings
+from app.services.raw_bson import scan_batch
+from app.services.live_na import LiveNa, PaymentFeed, run_live_na
+from app.services.payments_mirror import MUTABLE_SECONDS as MIRROR_MUTABLE_SECONDS
+
+log = logging.getLogger("app.reconcile")
+
+def norm(s: str | None, *, case_insensitive: bool) -> str:
+    t = (s or "").replace("\u00A0", " ").strip()
+    return t.lower() if case_insensitive else t
+
+
+# ---- Matching strategies -----------------------------------------------------
+# "index":       look payment ids up with chunked $in queries on transaction_id.
+# "incremental": refresh the local order -> transaction_id table (new/modified
+#                orders only, see app/services/orders_state.py) and look up there.
+#                Needs ORDERS_STATE_UPDATED_FIELD (an indexed update timestamp);
+#                auto only falls back to it with RECONCILE_INCREMENTAL=1.
+# "snapshot":    look up in the in-memory transaction_id map that a background
+#                task keeps refreshed (app/services/orders_snapshot.py); no Mongo
+#                reads on the request path, results as old as its last refresh.
+#                Opt-in: asked for explicitly, or picked by auto only with
+#                ORDERS_SNAPSHOT=1 and ORDERS_SNAPSHOT_AUTO=1.
+# "scan":        walk every order by _id (Atlas-safe), split into ObjectId-time
+#                ranges that are scanned concurrently on a dedicated scan pool.
+# auto uses the snapshot (if enabled for it) while it is fresh
+# (ORDERS_SNAPSHOT_MAX_AGE_SECONDS), else index below the cost threshold, then
+# incremental (if enabled), then scan.
+# Case-insensitive runs can't use $in (it only hits exact values), and the
+# discrepancy checks need full order fields, which only index/scan read.
+MATCH_STRATEGIES = ("auto", "index", "scan", "incremental", "snapshot")
+INCREMENTAL_ENABLED = os.getenv("RECONCILE_INCREMENTAL", "0") == "1"
+IN_CHUNK = int(os.getenv("RECONCILE_IN_CHUNK", "1000"))
+INDEX_MATCH_THRESHOLD = int(os.getenv("RECONCILE_INDEX_MATCH_THRESHOLD", "50000"))
+SCAN_CURSOR_BATCH = int(os.getenv("RECONCILE_SCAN_CURSOR_BATCH", "5000"))
+# more shards than workers, so ranges that hold more orders don't leave workers idle
+SCAN_SHARDS = int(os.getenv("RECONCILE_SCAN_SHARDS", "32"))
+SCAN_CONCURRENCY = int(os.getenv("RECONCILE_SCAN_CONCURRENCY", "4"))
+# scan shards run on their own threads: a full scan (or several reconciles at
+# once) holds at most SCAN_CONCURRENCY of them, and never the shared Mongo pool
+# that /orders, the snapshot and live NA use
+_scan_pool = ThreadPoolExecutor(max_workers=max(1, SCAN_CONCURRENCY), thread_name_prefix="mongo-scan")
+SCAN_SHARD_MIN_DOCS = int(os.getenv("RECONCILE_SCAN_SHARD_MIN_DOCS", "200000"))
+# read scan pages as raw BSON and pull transaction_id out by hand (no dict per order);
+# discrepancy checks need the full documents and keep the decoded path
+RAW_SCAN = os.getenv("RECONCILE_RAW_SCAN", "1") != "0"
+
+_tx_index_ready = False
+
+def _has_tx_index() -> bool:
+    """Whether user_details has a transaction_id index (created by ops.ensure_indexes, never here)."""
+    global _tx_index_ready
+    if not _tx_index_ready:
+        try:
+            specs = get_orders_collection().index_information().values()
+        except PyMongoError:
+            return False
+        _tx_index_ready = any(next(iter(spec["key"]))[0] == "transaction_id" for spec in specs)
+    return _tx_index_ready
+
+# $in with the payment ids only hits exact values, but the scan compares norm()-ed
+# transaction_ids (NBSP -> space, surrounding whitespace stripped). To give the
+# same answers, each chunk is looked up with prefix regexes (index-bounded, so
+# "pay_X " and "pay_X\n" are found too), and one range query picks up the few
+# values that start with whitespace or a non-ASCII character. Callers norm() what
+# comes back and keep only keys that are payments.
+_ODD_TX_QUERY = {"$or": [
+    {"transaction_id": {"$gt": "", "$lt": "!"}},
+    {"transaction_id": {"$gte": "\x7f"}},
+]}
+
+def _tx_lookups(keys: List[str], projection: Dict[str, Any]) -> Iterator[Any]:
+    """One cursor per IN_CHUNK keys, then one for oddly padded transaction_ids."""
+    coll = get_orders_collection()
+    for i in range(0, len(keys), IN_CHUNK):
+        prefixes = [re.compile("^" + re.escape(k)) for k in keys[i:i + IN_CHUNK]]
+        yield coll.find({"transaction_id": {"$in": prefixes}}, projection=projection)
+    if keys:
+        yield coll.find(_ODD_TX_QUERY, projection=projection)
+
+def _choose_strategy(requested: str, n_payments: int, case_insensitive: bool, discrepancies: bool) -> tuple:
+    """(strategy to run, why an explicitly requested one was overridden, else None)."""
+    if requested not in MATCH_STRATEGIES:
+        raise HTTPException(400, detail=f"match_strategy must be one of {', '.join(MATCH_STRATEGIES)}")
+    fallback = "incremental" if INCREMENTAL_ENABLED and not discrepancies else "scan"
+    if requested == "scan":
+        return "scan", None
+    if requested in ("incremental", "snapshot"):
+        if discrepancies:
+            return "scan", "discrepancy checks need the full order documents"
+        return requested, None
+    if requested == "auto" and not discrepancies and SNAPSHOT_AUTO and get_orders_snapshot().fresh():
+        return "snapshot", None
+    if case_insensitive:
+        if requested == "auto":
+            return fallback, None
+        return "scan", "case-insensitive ids can't be looked up with $in"
+    if requested == "auto" and n_payments > INDEX_MATCH_THRESHOLD:
+        return fallback, None
+    if _has_tx_index():
+        return "index", None
+    if requested == "auto":
+        return fallback, None
+    return "scan", "user_details has no transaction_id index"
+
+def _orders_with_tx_count() -> int:
+    """
+    Orders with a non-blank transaction_id, as the scan counts them, off the
+    transaction_id index: a count of the string values, less the few that norm()
+    blanks out (whitespace / NBSP only, all inside _ODD_TX_QUERY's ranges).
+    """
+    coll = get_orders_collection()
+    total = coll.count_documents({"transaction_id": {"$gt": ""}})
+    blank = sum(
+        1 for doc in coll.find(_ODD_TX_QUERY, projection={"transaction_id": 1, "_id": 0})
+        if not norm(str(doc.get("transaction_id") or ""), case_insensitive=False)
+    )
+    return total - blank
+
+def _match_by_index(
+    index: PaymentIndex,
+    *,
+    on_batch: Optional[Callable[[int, int, int], None]] = None,
+    diff: Optional[DiscrepancyCollector] = None,
+) -> tuple:
+    case_insensitive = index.case_insensitive
+    projection: Dict[str, Any] = {"transaction_id": 1, "_id": 0}
+    if diff is not None:
+        projection.update(ORDER_DIFF_FIELDS)
+    total_docs = 0
+    # every order with a transaction_id, like the other strategies report (not
+    # just the ones the lookups below return)
+    with_tx = _orders_with_tx_count()
+    for cursor in _tx_lookups(list(index.keys()), projection):
+        for doc in cursor:
+            total_docs += 1
+            tx_key = norm(str(doc.get("transaction_id") or ""), case_insensitive=case_insensitive)
+            row = index.mark(tx_key) if tx_key else None
+            if row is None:
+                continue  # a longer id sharing the prefix, or padding around a non-payment
+            if diff is not None:
+                diff.check(row, tx_key, doc)
+        if on_batch is not None:
+            on_batch(total_docs, with_tx, index.matched_count())
+    return total_docs, with_tx
+
+def _match_by_state(
+    index: PaymentIndex,
+    *,
+    batch_size: int,
+    on_batch: Optional[Callable[[int, int, int], None]] = None,
+) -> tuple:
+    state = get_orders_state()
+
+    def _progress(docs_read: int) -> None:
+        if on_batch is not None:
+            on_batch(docs_read, None, index.matched_count())
+
+    info = state.sync(get_orders_collection(), norm=norm, batch_size=batch_size, on_batch=_progress)
+    for key, orders in state.counts(index.keys(), case_insensitive=index.case_insensitive):
+        index.mark(key, orders)
+    return info["docs_read"], info["orders_with_transaction_id"], info
+
+def _match_by_snapshot(index: PaymentIndex, *, batch_size: int) -> tuple:
+    snapshot = get_orders_snapshot()
+    if not snapshot.loaded:
+        # asked for explicitly before the background refresh got there
+        snapshot.refresh(get_orders_collection(), norm=norm, batch_size=batch_size)
+    for key, orders in snapshot.counts(index.keys(), case_insensitive=index.case_insensitive):
+        index.mark(key, orders)
+    # no orders are read on the request path
+    return None, snapshot.orders_with_tx(), snapshot.info()
+
+async def keep_orders_snapshot_fresh() -> None:
+    """
+    Background loop (started from the app lifespan when ORDERS_SNAPSHOT=1): refresh
+    the snapshot forever. On cancel, a refresh still running on the Mongo pool is
+    stopped at its next batch (and rolled back) before this returns.
+    Without a usable ORDERS_STATE_UPDATED_FIELD every refresh would fail, so the
+    loop isn't started: it logs once and auto keeps matching without the snapshot.
+    """
+    snapshot = get_orders_snapshot()
+    try:
+        await run_mongo(lambda: snapshot.state.check_updated_field(get_orders_collection()))
+    except HTTPException as e:
+        log.warning("orders snapshot disabled: %s", e.detail)
+        return
+    except PyMongoError:
+        pass  # Mongo not reachable yet: the refresh loop below retries
+    stopping = threading.Event()
+
+    def _stop_check(docs_read: int) -> None:
+        if stopping.is_set():
+            raise RuntimeError("orders snapshot refresh stopped: shutting down")
+
+    async def _refresh() -> None:
+        await run_mongo(snapshot.refresh, get_orders_collection(), norm=norm, on_batch=_stop_check)
+
+    while True:
+        refresh = asyncio.ensure_future(_refresh())
+        try:
+            await asyncio.shield(refresh)
+        except asyncio.CancelledError:
+            stopping.set()
+            await asyncio.gather(refresh, return_exceptions=True)
+            raise
+        except Exception as e:
+            log.warning("orders snapshot refresh failed: %s", getattr(e, "detail", e))
+        await asyncio.sleep(SNAPSHOT_REFRESH_SECONDS)
+
+def _id_split_points(shards: int) -> List[ObjectId]:
+    """ObjectIds cutting the _id range into `shards` equal time slices; [] = don't split."""
+    coll = get_orders_collection()
+    if shards <= 1 or coll.estimated_document_count() < SCAN_SHARD_MIN_DOCS:
+        return []
+    first = coll.find_one({}, projection={"_id": 1}, sort=[("_id", 1)])
+    last = coll.find_one({}, projection={"_id": 1}, sort=[("_id", -1)])
+    # ObjectId at both ends of the BSON sort order means every _id is an ObjectId,
+    # so the ranges below cover the whole collection
+    if not first or not isinstance(first["_id"], ObjectId) or not isinstance(last["_id"], ObjectId):
+        return []
+    lo = first["_id"].generation_time.timestamp()
+    hi = last["_id"].generation_time.timestamp() + 1
+    step = (hi - lo) / shards
+    if step < 1:
+        return []
+    return [
+        ObjectId.from_datetime(datetime.fromtimestamp(lo + step * i, tz=timezone.utc))
+        for i in range(1, shards)
+    ]
+
+def _scan_page(
+    coll,
+    q: Dict[str, Any],
+    batch_size: int,
+    index: PaymentIndex,
+    diff: Optional[DiscrepancyCollector],
+) -> tuple:
+    """One _id page of decoded orders: (docs, with_tx, matched rows, last _id)."""
+    case_insensitive = index.case_insensitive
+    projection: Dict[str, Any] = {"transaction_id": 1, "order_id": 1}
+    if diff is not None:
+        projection.update(ORDER_DIFF_FIELDS)
+    # stream the cursor instead of materializing the whole batch
+    cursor = (
+        coll.find(q, projection=projection)
+            .sort([("_id", 1)])
+            .limit(batch_size)
+            .batch_size(SCAN_CURSOR_BATCH)
+    )
+    seen = 0
+    with_tx = 0
+    rows: List[int] = []
+    last_id = None
+    for doc in cursor:
+        seen += 1
+        last_id = doc["_id"]
+        raw_tx = doc.get("transaction_id")
+        if not raw_tx:
+            continue
+        tx_key = norm(str(raw_tx), case_insensitive=case_insensitive)
+        if not tx_key:
+            continue
+        with_tx += 1
+        row = index.row(tx_key)
+        if row is not None:
+            rows.append(row)
+        if diff is not None:
+            if row is not None:
+                diff.check(row, tx_key, doc)
+            else:
+                diff.orphan(tx_key, doc)
+    return seen, with_tx, rows, last_id
+
+def _scan_page_raw(coll, q: Dict[str, Any], batch_size: int, index: PaymentIndex) -> tuple:
+    """Same page via find_raw_batches, reading only transaction_id and _id from the BSON."""
+    case_insensitive = index.case_insensitive
+    row_of = index.row
+    cursor = (
+        coll.find_raw_batches(q, projection={"transaction_id": 1})
+            .sort([("_id", 1)])
+            .limit(batch_size)
+            .batch_size(SCAN_CURSOR_BATCH)
+    )
+    seen = 0
+    with_tx = 0
+    rows: List[int] = []
+    last_id = None
+    for data in cursor:
+        docs, values, batch_last = scan_batch(data, "transaction_id")
+        seen += docs
+        if batch_last is not None:
+            last_id = batch_last
+        for raw_tx in values:
+            tx_key = norm(raw_tx, case_insensitive=case_insensitive)
+            if not tx_key:
+                continue
+            with_tx += 1
+            row = row_of(tx_key)
+            if row is not None:
+                rows.append(row)
+    return seen, with_tx, rows, last_id
+
+def _scan_range(
+    index: PaymentIndex,
+    lo: Optional[ObjectId],
+    hi: Optional[ObjectId],
+    *,
+    batch_size: int,
+    on_page: Callable[[int, int, List[int]], None],
+    diff: Optional[DiscrepancyCollector] = None,
+) -> None:
+    """Walk orders with lo <= _id < hi in _id pages. on_page(docs, with_tx, matched rows)."""
+    coll = get_orders_collection()
+    # real pymongo only: mongomock (the benchmark) can't do find_raw_batches
+    raw = RAW_SCAN and diff is None and isinstance(coll, Collection)
+    last_id = None
+
+    while True:
+        cond: Dict[str, Any] = {}
+        if last_id is not None:
+            cond["$gt"] = last_id
+        elif lo is not None:
+            cond["$gte"] = lo
+        if hi is not None:
+            cond["$lt"] = hi
+        q: Dict[str, Any] = {"_id": cond} if cond else {}
+
+        if raw:
+            seen, with_tx, rows, page_last = _scan_page_raw(coll, q, batch_size, index)
+        else:
+            seen, with_tx, rows, page_last = _scan_page(coll, q, batch_size, index, diff)
+        if page_last is not None:
+            last_id = page_last
+        on_page(seen, with_tx, rows)
+        if seen < batch_size:
+            break
+
+async def _match_by_scan(
+    index: PaymentIndex,
+    *,
+    batch_size: int,
+    on_batch: Optional[Callable[[int, int, int], None]] = None,
+    diff: Optional[DiscrepancyCollector] = None,
+) -> tuple:
+    points = await run_mongo(_id_split_points, SCAN_SHARDS)
+    edges: List[Optional[ObjectId]] = [None, *points, None]
+    ranges = list(zip(edges, edges[1:]))
+    # shards get their own collectors (merged in range order) and only touch the
+    # shared index under the lock, once per page
+    shard_diffs = [diff.fork() if diff is not None else None for _ in ranges]
+    lock = threading.Lock()
+    failed = threading.Event()
+    totals = {"docs": 0, "with_tx": 0}
+
+    def on_page(seen: int, with_tx: int, rows: List[int]) -> None:
+        if failed.is_set():
+            raise ReconcileCancelled()
+        with lock:
+            index.mark_rows(rows)
+            totals["docs"] += seen
+            totals["with_tx"] += with_tx
+            if on_batch is not None:
+                on_batch(totals["docs"], totals["with_tx"], index.matched_count())
+
+    sem = asyncio.Semaphore(max(1, SCAN_CONCURRENCY))
+
+    async def run_shard(i: int) -> None:
+        async with sem:
+            if failed.is_set():
+                return
+            lo, hi = ranges[i]
+            try:
+                await run_mongo_on(_scan_pool, _scan_range, index, lo, hi, batch_size=batch_size,
+                                   on_page=on_page, diff=shard_diffs[i])
+            except BaseException:
+                failed.set()  # the other shards stop at their next page
+                raise
+
+    await asyncio.gather(*(run_shard(i) for i in range(len(ranges))))
+    if diff is not None:
+        for d in shard_diffs:
+            diff.merge(d)
+    return totals["docs"], totals["with_tx"]
+
+
+def _to_unix(s: Optional[str]) -> Optional[int]:
+    if not s:
+        return None
+    from dateutil import parser as dtparser
+    return int(dtparser.parse(s).timestamp())
+
+
+def _payments_source(mirror_info: Optional[Dict[str, Any]]) -> str:
+    return "live" if mirror_info is None else f"mirror:{mirror_info['mode']}"
+
+
+class ReconcileCancelled(Exception):
+    """Raised inside the Mongo worker when a streaming client went away."""
+
+
+async def reconcile_payments_orders(
+    *,
+    status: Optional[str] = None,
+    max_fetch: int = 200_000,
+    from_date: Optional[str] = None,
+    to_date: Optional[str] = None,
+    case_insensitive_ids: bool = False,
+    mirror: str = "off",
+    orders_batch_size: int = 50_000,
+    match_strategy: str = "auto",
+    na_status: Optional[str] = "captured",
+    discrepancies: bool = False,
+    sample_limit: int = 20,
+    timings: bool = False,
+    group_by_status: bool = True,
+    accounts: Optional[str] = None,
+    on_event: Optional[Callable[[Dict[str, Any]], None]] = None,
+    stop: Optional[threading.Event] = None,
+) -> Dict[str, Any]:
+    """
+    Razorpay payments vs Mongo orders. Returns {summary, na_payment_ids, na_by_status}
+    (na_by_status repeats the ids grouped by status; group_by_status=False drops it),
+    plus a `discrepancies` block (amount/currency/status/duplicate checks) and a
+    per-stage `timings` block if requested (stages always feed /metrics).
+    `accounts` ("a,b" or None for all configured) are fetched concurrently and
+    matched in one pass; with more than one, the summary gets per-account counts
+    and the result an `na_by_account` block.
+    on_event (called on the event loop) receives progress events; setting `stop`
+    aborts the orders scan between batches.
+    """
+    account_names = resolve_accounts(accounts)
+    multi_account = len(account_names) > 1
+    loop = asyncio.get_running_loop()
+    run_timings = RunTimings("reconcile")
+
+    def emit(event: str, **data: Any) -> None:
+        # safe from the Mongo worker threads too
+        if on_event is not None:
+            loop.call_soon_threadsafe(on_event, {"event": event, **data})
+
+    # 1) Razorpay: fetch ALL (status=None => all statuses)
+    fetched = 0
+    fetched_by_account: Dict[str, int] = {}
+    def on_page(account: str, n: int) -> None:
+        nonlocal fetched
+        fetched += n
+        fetched_by_account[account] = fetched_by_account.get(account, 0) + n
+        if multi_account:
+            emit("payments_page", rows_fetched=fetched, account=account,
+                 account_rows_fetched=fetched_by_account[account])
+        else:
+            emit("payments_page", rows_fetched=fetched)
+
+    try:
+        with run_timings.stage("fetch_payments", unit="payments") as st:
+            payments, mirror_infos = await load_accounts_payments(
+                account_names,
+                status_filter=status,   # None => all
+                from_unix=_to_unix(from_date),
+                to_unix=_to_unix(to_date),
+                max_fetch=max_fetch,
+                mirror=mirror,
+                light=True,             # id/status (+ amounts) are all we need
+                on_page=on_page,
+            )
+            st.add(len(payments))
+    except httpx.HTTPStatusError as e:
+        raise HTTPException(status_code=e.response.status_code, detail=e.response.text)
+    except httpx.RequestError as e:
+        raise HTTPException(status_code=502, detail=f"Network error calling Razorpay: {e}")
+
+    emit("payments_done", total_payments_rows=len(payments))
+
+    # Columnar index of the payments (normalized id -> row, status codes, match mask)
+    total_payments_rows = len(payments)
+    with run_timings.stage("build_index", unit="payments") as st:
+        index = PaymentIndex.build(payments, case_insensitive=case_insensitive_ids, norm=norm,
+                                   amounts=discrepancies, accounts=multi_account)
+        st.add(total_payments_rows)
+    # max_fetch caps each account's pull separately
+    if multi_account:
+        rows_per_account = {name: c["total_payments_rows"] for name, c in index.account_counts("").items()}
+    else:
+        rows_per_account = {account_names[0]: total_payments_rows}
+    del payments  # the index is all we need from here on
+
+    def on_batch(docs: int, with_tx: int, matched: int) -> None:
+        if stop is not None and stop.is_set():
+            raise ReconcileCancelled()
+        emit("orders_batch", orders_docs_scanned=docs, orders_with_transaction_id=with_tx,
+             matched=matched, unmatched=len(index) - matched)
+
+    # 2) Match orders: index lookups for small payment sets, full scan otherwise
+    strategy, overridden = await run_mongo(
+        _choose_strategy, match_strategy, len(index), case_insensitive_ids, discrepancies,
+    )
+    if overridden:
+        log.info("match_strategy=%s ran as %s: %s", match_strategy, strategy, overridden)
+    emit("orders_start", match_strategy=strategy, match_strategy_requested=match_strategy)
+
+    diff = None
+    if discrepancies:
+        # orders pointing at unknown payments only mean something if we pulled them all
+        complete_pull = (not status and not from_date and not to_date
+                         and all(n < max_fetch for n in rows_per_account.values()))
+        diff = DiscrepancyCollector(index, sample_limit=sample_limit,
+                                    track_orphans=strategy == "scan" and complete_pull)
+    orders_state = None
+    orders_snapshot = None
+    try:
+        with run_timings.stage("orders_scan", unit="docs") as st:
+            if strategy == "index":
+                total_orders_docs, orders_with_tx = await run_mongo(
+                    _match_by_index, index, on_batch=on_batch, diff=diff,
+                )
+            elif strategy == "snapshot":
+                total_orders_docs, orders_with_tx, orders_snapshot = await run_mongo(
+                    _match_by_snapshot, index, batch_size=orders_batch_size,
+                )
+            elif strategy == "incremental":
+                total_orders_docs, orders_with_tx, orders_state = await run_mongo(
+                    _match_by_state, index, batch_size=orders_batch_size, on_batch=on_batch,
+                )
+            else:
+                total_orders_docs, orders_with_tx = await _match_by_scan(
+                    index, batch_size=orders_batch_size, on_batch=on_batch, diff=diff,
+                )
+            st.add(total_orders_docs or 0)
+    except PyMongoError as e:
+        raise HTTPException(status_code=502, detail=f"Mongo query failed: {e}")
+
+    # 3) NA = payments with the chosen status (default captured) that no order matched,
+    #    sorted by id
+    target_status = (na_status or "captured").strip().lower()
+    with run_timings.stage("na_diff", unit="payments") as st:
+        na_ids = index.na_ids(target_status)
+        st.add(len(index))
+
+    # Group (will only contain the target status)
+    na_by_status: Dict[str, List[str]] = {target_status: na_ids} if na_ids else {}
+
+    matched_distinct = index.matched_count()
+
+    result = {
+        "summary": {
+            "total_orders_docs_scanned": total_orders_docs,
+            "orders_with_transaction_id": orders_with_tx,
+            "total_payments_rows": total_payments_rows,
+            "payment_status_filter": status or "(ALL)",
+            "case_insensitive_ids": case_insensitive_ids,
+            "matched_distinct_payment_ids": matched_distinct,
+            # IMPORTANT: now counts ONLY the chosen status (default captured)
+            "na_count": len(na_ids),
+            "max_fetch": max_fetch,
+            "date_window": {
+                "from_date": from_date or "(all-time)",
+                "to_date": to_date or "(all-time)",
+            },
+            "orders_batch_size": orders_batch_size,
+            "match_strategy": strategy,  # the one that ran
+            "match_strategy_requested": match_strategy,
+            "na_status_filter": target_status,
+            "payments_source": ",".join(sorted({_payments_source(i) for i in mirror_infos.values()})),
+        },
+        # Only the chosen status (default captured)
+        "na_payment_ids": na_ids,
+    }
+    if group_by_status:
+        result["na_by_status"] = na_by_status  # contains only the chosen status
+    if multi_account:
+        per_account = index.account_counts(target_status)
+        for name in account_names:
+            counts = per_account.setdefault(name, {
+                "total_payments_rows": 0, "matched_distinct_payment_ids": 0, "na_count": 0,
+            })
+            counts["payments_source"] = _payments_source(mirror_infos[name])
+        result["summary"]["accounts"] = {name: per_account[name] for name in account_names}
+        result["na_by_account"] = {
+            name: index.na_ids(target_status, account=name) for name in account_names
+            if per_account[name]["na_count"]
+        }
+    if overridden:
+        result["summary"]["match_strategy_note"] = overridden
+    if orders_state is not None:
+        # total_orders_docs_scanned counts only the new/modified orders read this run
+        result["summary"]["orders_state"] = orders_state
+    if orders_snapshot is not None:
+        # no orders read on this request; age_seconds is how stale the match is
+        result["summary"]["orders_snapshot"] = orders_snapshot
+    if diff is not None:
+        result["discrepancies"] = diff.result(na_ids)
+    if timings:
+        result["timings"] = run_timings.to_dict()
+    return result
+
+
+# ---- Live NA -----------------------------------------------------------------
+# Optional (LIVE_NA=1): a background worker keeps the NA set for recent captured
+# payments current from a user_details change stream plus a payments poll
+# (app/services/live_na.py); GET /reconcile/live-na reads it. The poll talks to
+# Razorpay directly (never the mirror): a short list of new payments plus a few
+# by-id fetches.
+LIVE_NA_MAX_FETCH = int(os.getenv("LIVE_NA_MAX_FETCH", "1000000"))
+live_na = LiveNa(norm=norm, mutable_seconds=MIRROR_MUTABLE_SECONDS)
+
+async def _live_na_list(from_unix: int) -> List[Dict[str, Any]]:
+    payments, _ = await load_accounts_payments(
+        resolve_accounts(None),
+        status_filter=None,  # all statuses: created/authorized ones are tracked too
+        from_unix=from_unix,
+        to_unix=None,
+        max_fetch=LIVE_NA_MAX_FETCH,
+        light=True,
+    )
+    return payments
+
+async def _live_na_by_id(ids: Dict[str, List[str]]) -> List[Dict[str, Any]]:
+    async def _one(account: str, payment_ids: List[str]) -> List[Dict[str, Any]]:
+        rows = await fetch_payments_by_id(razorpay_client(account), payment_ids)
+        return [{**{k: p.get(k) for k in LIGHT_FIELDS}, "account": account} for p in rows]
+    pages = await asyncio.gather(*(_one(a, pids) for a, pids in ids.items()))
+    return [p for page in pages for p in page]
+
+async def _live_na_refunded(from_unix: int) -> Dict[str, List[str]]:
+    names = resolve_accounts(None)
+    ids = await asyncio.gather(*(
+        fetch_refunded_payment_ids(razorpay_client(name), from_unix=from_unix) for name in names
+    ))
+    return dict(zip(names, ids))
+
+def _orders_with_tx(keys: List[str]) -> set:
+    wanted = set(keys)
+    found = set()
+    for cursor in _tx_lookups(keys, {"transaction_id": 1, "_id": 0}):
+        for doc in cursor:
+            key = norm(str(doc.get("transaction_id") or ""), case_insensitive=False)
+            if key in wanted:
+                found.add(key)
+    return found
+
+async def _live_na_matched(keys: List[str]) -> set:
+    return await run_mongo(_orders_with_tx, keys)
+
+async def keep_live_na() -> None:
+    """Background worker (started from the app lifespan when LIVE_NA=1)."""
+    await run_live_na(
+        live_na,
+        collection_factory=get_orders_collection,
+        feed=PaymentFeed(list_since=_live_na_list, by_id=_live_na_by_id, refunded_since=_live_na_refunded),
+        matched=_live_na_matched,
+    )
@@ -0,0 +1,150 @@
+# app/services/reconcile_jobs.py
+"""
+In-process reconcile jobs with single-flight and a result cache.
+
+Jobs are keyed by their normalized parameters. A request whose key matches an
+in-flight job joins it; one that matches a finished job (younger than the TTL)
+gets the cached result. Finished jobs are evicted LRU beyond `max_entries`.
+Failed and cancelled jobs stay readable by id but are never served from the cache.
+"""
+import json, time, uuid, asyncio
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from fastapi import HTTPException
+
+
+class ReconcileJob:
+    def __init__(self, key: str, params: Dict[str, Any]):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.params = params
+        self.status = "running"          # running | done | error | cancelled
+        self.result: Optional[Dict[str, Any]] = None
+        self.error: Optional[Dict[str, Any]] = None
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.task: Optional[asyncio.Task] = None
+
+    def to_dict(self, *, include_result: bool = True) -> Dict[str, Any]:
+        out: Dict[str, Any] = {
+            "job_id": self.id,
+            "status": self.status,
+            "params": self.params,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+        }
+        if self.error is not None:
+            out["error"] = self.error
+        if include_result and self.result is not None:
+            out["result"] = self.result
+        return out
+
+
+class ReconcileJobManager:
+    def __init__(
+        self,
+        runner: Callable[..., Awaitable[Dict[str, Any]]],
+        *,
+        ttl_seconds: float,
+        max_entries: int,
+    ):
+        self.runner = runner
+        self.ttl = ttl_seconds
+        self.max_entries = max_entries
+        self._jobs: "OrderedDict[str, ReconcileJob]" = OrderedDict()  # id -> job (LRU order)
+        self._by_key: Dict[str, str] = {}                                # key -> id
+
+    @staticmethod
+    def key_for(params: Dict[str, Any]) -> str:
+        return json.dumps(params, sort_keys=True, separators=(",", ":"), default=str)
+
+    def _expired(self, job: ReconcileJob) -> bool:
+        return job.finished_at is not None and time.time() - job.finished_at > self.ttl
+
+    def _evict(self) -> None:
+        for job_id in list(self._jobs):
+            job = self._jobs[job_id]
+            if self._expired(job):
+                self._drop(job)
+        # LRU: oldest finished jobs go first; running jobs are never evicted
+        for job_id in list(self._jobs):
+            if len(self._jobs) <= self.max_entries:
+                break
+            job = self._jobs[job_id]
+            if job.status != "running":
+                self._drop(job)
+
+    def _drop(self, job: ReconcileJob) -> None:
+        self._jobs.pop(job.id, None)
+        if self._by_key.get(job.key) == job.id:
+            del self._by_key[job.key]
+
+    def get(self, job_id: str) -> Optional[ReconcileJob]:
+        job = self._jobs.get(job_id)
+        if job is None or self._expired(job):
+            if job is not None:
+                self._drop(job)
+            return None
+        self._jobs.move_to_end(job_id)
+        return job
+
+    def submit(self, params: Dict[str, Any], *, use_cache: bool = True) -> tuple:
+        """Return (job, joined). joined is True when an existing job was reused."""
+        key = self.key_for(params)
+        existing_id = self._by_key.get(key)
+        if existing_id is not None:
+            job = self.get(existing_id)
+            if job is not None and (job.status == "running" or (use_cache and job.status == "done")):
+                return job, True
+
+        job = ReconcileJob(key, params)
+        job.task = asyncio.create_task(self._run(job))
+        job.task.add_done_callback(lambda task: self._cancelled_before_start(job, task))
+        self._jobs[job.id] = job
+        self._by_key[key] = job.id
+        self._evict()
+        return job, False
+
+    async def _run(self, job: ReconcileJob) -> None:
+        try:
+            job.result = await self.runner(**job.params)
+            job.status = "done"
+        except HTTPException as e:
+            job.status = "error"
+            job.error = {"status_code": e.status_code, "detail": e.detail}
+        except Exception as e:
+            job.status = "error"
+            job.error = {"status_code": 500, "detail": str(e)}
+        except asyncio.CancelledError:
+            # e.g. shutdown; never leave a finished job looking like it still runs
+            job.status = "cancelled"
+            job.error = {"status_code": 503, "detail": "Reconcile job was cancelled"}
+            raise
+        finally:
+            job.finished_at = time.time()
+            if job.status != "done" and self._by_key.get(job.key) == job.id:
+                # don't serve failures from the cache; the next caller retries
+                del self._by_key[job.key]
+
+    def _cancelled_before_start(self, job: ReconcileJob, task: asyncio.Task) -> None:
+        # a task cancelled before its first step never enters _run
+        if task.cancelled() and job.status == "running":
+            job.status = "cancelled"
+            job.error = {"status_code": 503, "detail": "Reconcile job was cancelled"}
+            job.finished_at = time.time()
+            if self._by_key.get(job.key) == job.id:
+                del self._by_key[job.key]
+
+    async def run(self, params: Dict[str, Any], *, use_cache: bool = True) -> Dict[str, Any]:
+        """Submit (or join) and wait. Errors are re-raised as HTTPException."""
+        job, _ = self.submit(params, use_cache=use_cache)
+        # shield: one caller going away must not cancel a job others are waiting on
+        try:
+            await asyncio.shield(job.task)
+        except asyncio.CancelledError:
+            if not job.task.cancelled():
+                raise  # this caller was cancelled, not the job
+        if job.status in ("error", "cancelled"):
+            raise HTTPException(status_code=job.error["status_code"], detail=job.error["detail"])
+        return job.result
@@ -0,0 +1,117 @@
+# app/services/reconcile_service.py
+"""
+In-process entry point for running a reconcile.
+
+The /reconcile routes, the agent fast path and the LangChain tools all call
+`reconcile()` here instead of going through HTTP (the matching itself is in
+app/services/reconcile_engine.py): parameters are validated and
+normalized by ReconcileParams, then run through the shared job manager, so an
+agent call and an identical API call still share one in-flight job and one
+cached result. Failures surface as HTTPException, like the routes.
+
+Output-only flags (timings, group_by_status) are not part of the job key: every
+run collects both, and each caller's result is trimmed to what it asked for.
+"""
+import os
+from typing import Any, Dict, Optional
+
+from fastapi import HTTPException
+from pydantic import BaseModel, Field, ValidationError
+
+from app.services.reconcile_engine import reconcile_payments_orders
+from app.services.reconcile_jobs import ReconcileJobManager, ReconcileJob
+
+
+# change what a result shows, not what is computed
+OUTPUT_FLAGS = ("timings", "group_by_status")
+
+
+class ReconcileParams(BaseModel):
+    status: Optional[str] = None
+    max_fetch: int = Field(200_000, ge=1, le=1_000_000)
+    from_date: Optional[str] = None
+    to_date: Optional[str] = None
+    case_insensitive_ids: bool = False
+    mirror: str = "off"
+    orders_batch_size: int = Field(50_000, ge=1_000, le=200_000)
+    match_strategy: str = "auto"
+    na_status: Optional[str] = "captured"
+    discrepancies: bool = False
+    sample_limit: int = Field(20, ge=0, le=1000)
+    timings: bool = False
+    group_by_status: bool = True
+    accounts: Optional[str] = None  # "a,b"; None / "all" = every configured Razorpay account
+
+    def normalized(self) -> Dict[str, Any]:
+        """
+        Job kwargs for reconcile_payments_orders; requests that differ only in
+        output flags give equal dicts.
+        """
+        def _s(v: Optional[str]) -> Optional[str]:
+            v = (v or "").strip()
+            return v or None
+        d = self.model_dump(exclude=set(OUTPUT_FLAGS))
+        d["status"] = (_s(self.status) or "").lower() or None
+        d["na_status"] = (_s(self.na_status) or "captured").lower()
+        d["from_date"] = _s(self.from_date)
+        d["to_date"] = _s(self.to_date)
+        d["mirror"] = self.mirror.strip().lower()
+        d["match_strategy"] = self.match_strategy.strip().lower()
+        # account names match case-insensitively ("Main" == "main")
+        names = sorted({n.strip().lower() for n in (self.accounts or "").split(",") if n.strip()})
+        d["accounts"] = None if not names or names == ["all"] else ",".join(names)
+        return d
+
+    def shape(self, result: Dict[str, Any]) -> Dict[str, Any]:
+        """The shared job result, trimmed to this request's output flags."""
+        drop = [k for k, wanted in (("timings", self.timings), ("na_by_status", self.group_by_status))
+                if not wanted and k in result]
+        if not drop:
+            return result
+        return {k: v for k, v in result.items() if k not in drop}
+
+
+async def _run_reconcile(**params: Any) -> Dict[str, Any]:
+    # collect every optional output once; callers trim (ReconcileParams.shape)
+    return await reconcile_payments_orders(**params, timings=True, group_by_status=True)
+
+reconcile_jobs = ReconcileJobManager(
+    _run_reconcile,
+    ttl_seconds=float(os.getenv("RECONCILE_JOB_TTL", "300")),
+    max_entries=int(os.getenv("RECONCILE_JOB_MAX_ENTRIES", "64")),
+)
+
+
+def _model(params: Any) -> ReconcileParams:
+    if isinstance(params, ReconcileParams):
+        return params
+    try:
+        return ReconcileParams(**params)
+    except ValidationError as e:
+        raise HTTPException(422, detail=e.errors(include_url=False, include_context=False))
+
+
+def submit(params: Any, *, use_cache: bool = True) -> tuple:
+    """
+    Start (or join) a reconcile job without waiting. Returns (job, joined).
+    The job's result carries every optional output (timings, na_by_status).
+    """
+    kwargs = _model(params).normalized()
+    # a full mirror resync is an explicit request for fresh data
+    return reconcile_jobs.submit(kwargs, use_cache=use_cache and kwargs["mirror"] != "full")
+
+
+async def reconcile(params: Any = None, *, use_cache: bool = True, **kwargs: Any) -> Dict[str, Any]:
+    """
+    Run (or join) a reconcile and return its result dict
+    ({summary, na_payment_ids, na_by_status, ...}).
+    `params` is a ReconcileParams or a dict; keyword arguments work too.
+    """
+    model = _model(params if params is not None else kwargs)
+    job_kwargs = model.normalized()
+    result = await reconcile_jobs.run(job_kwargs, use_cache=use_cache and job_kwargs["mirror"] != "full")
+    return model.shape(result)
+
+
+def get_job(job_id: str) -> Optional[ReconcileJob]:
+    return reconcile_jobs.get(job_id)
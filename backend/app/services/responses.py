@@ -0,0 +1,175 @@
+# app/services/responses.py
+"""
+Cheaper large responses: orjson bodies and negotiated gzip/zstd compression.
+
+FastJSONResponse serializes with orjson when it is installed (ObjectId and
+other odd Mongo values fall back to str(), like json.dumps(default=str)), and
+with the stdlib otherwise.
+
+CompressionMiddleware compresses responses under the given path prefixes with
+the best encoding the client accepts (zstd when the optional `zstandard`
+package is installed, else gzip). Streamed bodies are compressed chunk by chunk
+with a flush after each one, so CSV/NDJSON exports still arrive incrementally.
+Already-compressed content types and SSE are passed through untouched.
+"""
+import os, json, zlib
+from typing import Any, Dict, List, Optional, Tuple
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+COMPRESSION_MIN_BYTES = int(os.getenv("COMPRESSION_MIN_BYTES", "1024"))
+GZIP_LEVEL = int(os.getenv("COMPRESSION_GZIP_LEVEL", "6"))
+ZSTD_LEVEL = int(os.getenv("COMPRESSION_ZSTD_LEVEL", "3"))
+
+# compressed already, or must reach the client unbuffered
+_SKIP_CONTENT_TYPES = (
+    "text/event-stream",
+    "application/vnd.apache.parquet",
+    "application/gzip",
+    "application/zip",
+    "image/",
+)
+
+
+def dumps(content: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content, default=str, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(content, separators=(",", ":"), default=str, ensure_ascii=False).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+# ---- Compression ---------------------------------------------------------------
+
+def _accepted(accept_encoding: str) -> Dict[str, float]:
+    out: Dict[str, float] = {}
+    for part in accept_encoding.split(","):
+        token, _, params = part.strip().partition(";")
+        token = token.strip().lower()
+        if not token:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        out[token] = q
+    return out
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    accepted = _accepted(accept_encoding)
+    wildcard = accepted.get("*", 0.0)
+    candidates: List[Tuple[float, int, str]] = []
+    # ties go to zstd (smaller and faster than gzip at similar levels)
+    if zstandard is not None:
+        candidates.append((accepted.get("zstd", wildcard), 1, "zstd"))
+    candidates.append((accepted.get("gzip", wildcard), 0, "gzip"))
+    q, _, name = max(candidates)
+    return name if q > 0 else None
+
+
+class _Compressor:
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == "zstd":
+            self._obj = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+            self._flush_mode = zstandard.COMPRESSOBJ_FLUSH_BLOCK
+        else:
+            self._obj = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)  # 31: gzip container
+            self._flush_mode = zlib.Z_SYNC_FLUSH
+
+    def chunk(self, data: bytes) -> bytes:
+        return self._obj.compress(data) + self._obj.flush(self._flush_mode)
+
+    def finish(self, data: bytes = b"") -> bytes:
+        return self._obj.compress(data) + self._obj.flush()
+
+
+class CompressionMiddleware:
+    def __init__(self, app, *, path_prefixes: Tuple[str, ...], minimum_size: int = COMPRESSION_MIN_BYTES):
+        self.app = app
+        self.path_prefixes = path_prefixes
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith(self.path_prefixes):
+            await self.app(scope, receive, send)
+            return
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+        await self.app(scope, receive, _CompressingSend(send, encoding, self.minimum_size))
+
+
+class _CompressingSend:
+    def __init__(self, send, encoding: str, minimum_size: int):
+        self._send = send
+        self.encoding = encoding
+        self.minimum_size = minimum_size
+        self._start: Optional[Dict[str, Any]] = None
+        self._compressor: Optional[_Compressor] = None
+        self._passthrough = False
+
+    async def __call__(self, message: Dict[str, Any]) -> None:
+        kind = message["type"]
+        if kind == "http.response.start":
+            self._start = message  # held until we see the first body chunk
+            return
+        if kind != "http.response.body" or self._passthrough:
+            await self._send(message)
+            return
+
+        body = message.get("body", b"")
+        more = message.get("more_body", False)
+
+        if self._start is not None:
+            start, self._start = self._start, None
+            headers = MutableHeaders(raw=start["headers"])
+            ctype = headers.get("content-type", "")
+            if (
+                "content-encoding" in headers
+                or ctype.startswith(_SKIP_CONTENT_TYPES)
+                or (not more and len(body) < self.minimum_size)
+            ):
+                self._passthrough = True
+                await self._send(start)
+                await self._send(message)
+                return
+
+            self._compressor = _Compressor(self.encoding)
+            headers["Content-Encoding"] = self.encoding
+            headers.add_vary_header("Accept-Encoding")
+            if not more:
+                body = self._compressor.finish(body)
+                headers["Content-Length"] = str(len(body))
+                await self._send(start)
+                await self._send({"type": "http.response.body", "body": body})
+                return
+            # streamed: length unknown up front
+            if "content-length" in headers:
+                del headers["content-length"]
+            await self._send(start)
+
+        if more:
+            out = self._compressor.chunk(body) if body else b""
+            if out:
+                await self._send({"type": "http.response.body", "body": out, "more_body": True})
+        else:
+            await self._send({"type": "http.response.body", "body": self._compressor.finish(body)})
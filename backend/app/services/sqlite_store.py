@@ -0,0 +1,60 @@
+# app/services/sqlite_store.py
+"""
+Pieces shared by the local SQLite stores (payments mirror, orders state): where
+their files live, how a connection is opened, and the key/value meta table.
+
+Files go under APP_DATA_DIR (default backend/data) unless a store's own path
+variable says otherwise; relative paths are resolved once, at import, so the
+working directory the server happens to start in doesn't matter.
+"""
+import os, sqlite3
+from contextlib import contextmanager
+from typing import Dict, Iterator
+
+DATA_DIR = os.path.abspath(os.getenv("APP_DATA_DIR") or os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "data"))
+
+META_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+def data_path(env_var: str, filename: str) -> str:
+    """Absolute path from `env_var`, or DATA_DIR/filename when it is unset."""
+    return os.path.abspath(os.getenv(env_var) or os.path.join(DATA_DIR, filename))
+
+
+@contextmanager
+def connect(path: str) -> Iterator[sqlite3.Connection]:
+    # one short-lived connection per call (calls run in worker threads):
+    # committed on success, rolled back on error, always closed
+    conn = sqlite3.connect(path, timeout=30.0)
+    try:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+
+def create(path: str, schema: str) -> None:
+    """Create the file (and its directory) and apply `schema` plus the meta table."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with connect(path) as conn:
+        conn.executescript(schema + META_SCHEMA)
+
+
+def get_meta(conn: sqlite3.Connection) -> Dict[str, str]:
+    return dict(conn.execute("SELECT key, value FROM meta").fetchall())
+
+
+def set_meta(conn: sqlite3.Connection, **values: str) -> None:
+    conn.executemany(
+        "INSERT INTO meta (key, value) VALUES (?, ?) "
+        "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+        list(values.items()),
+    )
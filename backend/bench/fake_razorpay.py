@@ -0,0 +1,161 @@
+# bench/fake_razorpay.py
+"""
+Local stand-in for Razorpay's GET /v1/payments, for the benchmarks.
+
+Payments are generated from their row number instead of being stored, so a
+1M-payment account costs no memory: row i was created at T0 + i * spacing and
+its id, status and amounts are fixed functions of i. The server pages newest
+first with from/to/count/skip like Razorpay, and can add latency, cap the page
+size and answer a fraction of calls with 429.
+"""
+import math, time, random, socket, asyncio, threading
+from typing import Any, Dict, List, Optional
+
+import uvicorn
+from fastapi import FastAPI, Query
+from fastapi.responses import JSONResponse
+
+T0 = 1_700_000_000
+
+# status by row: ~80% captured, 12% failed, 5% refunded, 3% authorized
+_STATUS_CUTS = ((80, "captured"), (92, "failed"), (97, "refunded"), (100, "authorized"))
+
+def payment_id(i: int) -> str:
+    return f"pay_B{i:013d}"
+
+def payment_status(i: int) -> str:
+    bucket = (i * 2654435761) % 100
+    for cut, status in _STATUS_CUTS:
+        if bucket < cut:
+            return status
+    return "captured"
+
+def payment_amount(i: int) -> int:
+    return 100 * (1 + (i * 7919) % 5000)
+
+def make_payment(i: int, spacing: int) -> Dict[str, Any]:
+    status = payment_status(i)
+    amount = payment_amount(i)
+    upi = i % 2 == 0
+    return {
+        "id": payment_id(i),
+        "entity": "payment",
+        "amount": amount,
+        "currency": "INR",
+        "status": status,
+        "order_id": f"order_B{i:013d}",
+        "invoice_id": None,
+        "international": False,
+        "method": "upi" if upi else "card",
+        "amount_refunded": amount if status == "refunded" else 0,
+        "refund_status": "full" if status == "refunded" else None,
+        "captured": status in ("captured", "refunded"),
+        "description": "Personalised storybook",
+        "card_id": None if upi else f"card_B{i:013d}",
+        "bank": None,
+        "wallet": None,
+        "vpa": f"user{i}@okbank" if upi else None,
+        "email": f"user{i}@example.com",
+        "contact": f"+9190000{i % 100000:05d}",
+        "notes": {"job_id": f"job-{i}"},
+        "fee": amount // 50,
+        "tax": amount // 300,
+        "error_code": "BAD_REQUEST_ERROR" if status == "failed" else None,
+        "error_description": "Payment failed" if status == "failed" else None,
+        "acquirer_data": {"rrn": f"{i:012d}"} if upi else {"auth_code": f"{i % 1000000:06d}"},
+        "upi": {"vpa": f"user{i}@okbank", "flow": "collect"} if upi else None,
+        "created_at": T0 + i * spacing,
+    }
+
+
+class FakeRazorpay:
+    def __init__(
+        self,
+        *,
+        payments: int,
+        spacing: int = 60,
+        latency_ms: float = 0.0,
+        page_size: int = 100,
+        throttle_rate: float = 0.0,
+        retry_after: Optional[float] = None,
+        seed: int = 0,
+    ):
+        self.payments = payments
+        self.spacing = spacing
+        self.latency_ms = latency_ms
+        self.page_size = page_size
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self._rng = random.Random(seed)
+        self.requests = 0
+        self.throttled = 0
+        self.app = self._build_app()
+        self._server: Optional[uvicorn.Server] = None
+        self._thread: Optional[threading.Thread] = None
+        self.base_url = ""
+
+    @property
+    def from_unix(self) -> int:
+        return T0
+
+    @property
+    def to_unix(self) -> int:
+        return T0 + max(0, self.payments - 1) * self.spacing
+
+    def reset_counters(self) -> None:
+        self.requests = 0
+        self.throttled = 0
+
+    def page(self, *, from_unix: Optional[int], to_unix: Optional[int], count: int, skip: int) -> List[Dict[str, Any]]:
+        lo, hi = 0, self.payments - 1
+        if from_unix is not None:
+            lo = max(lo, math.ceil((from_unix - T0) / self.spacing))
+        if to_unix is not None:
+            hi = min(hi, math.floor((to_unix - T0) / self.spacing))
+        top = hi - skip
+        bottom = max(lo, top - min(count, self.page_size) + 1)
+        return [make_payment(i, self.spacing) for i in range(top, bottom - 1, -1)]
+
+    def _build_app(self) -> FastAPI:
+        app = FastAPI()
+
+        @app.get("/v1/payments")
+        async def payments(
+            count: int = Query(10),
+            skip: int = Query(0),
+            from_: Optional[int] = Query(None, alias="from"),
+            to: Optional[int] = Query(None),
+        ):
+            self.requests += 1
+            if self.latency_ms:
+                await asyncio.sleep(self.latency_ms / 1000)
+            if self.throttle_rate and self._rng.random() < self.throttle_rate:
+                self.throttled += 1
+                headers = {"Retry-After": str(self.retry_after)} if self.retry_after is not None else {}
+                return JSONResponse({"error": {"code": "BAD_REQUEST_ERROR",
+                                               "description": "Too many requests"}},
+                                    status_code=429, headers=headers)
+            items = self.page(from_unix=from_, to_unix=to, count=count, skip=skip)
+            return {"entity": "collection", "count": len(items), "items": items}
+
+        return app
+
+    def start(self) -> str:
+        """Serve on a free localhost port in a background thread; returns the /v1 base URL."""
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            port = s.getsockname()[1]
+        config = uvicorn.Config(self.app, host="127.0.0.1", port=port, log_level="warning")
+        self._server = uvicorn.Server(config)
+        self._thread = threading.Thread(target=self._server.run, name="fake-razorpay", daemon=True)
+        self._thread.start()
+        while not self._server.started:
+            time.sleep(0.01)
+        self.base_url = f"http://127.0.0.1:{port}/v1"
+        return self.base_url
+
+    def stop(self) -> None:
+        if self._server is not None:
+            self._server.should_exit = True
+            self._thread.join(timeout=5)
+            self._server = None
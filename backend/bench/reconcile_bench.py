@@ -0,0 +1,250 @@
+# bench/reconcile_bench.py
+"""
+Reconcile / export benchmark.
+
+    cd backend
+    python -m bench.reconcile_bench --sizes 10000,100000,1000000 --latency-ms 40 --throttle-rate 0.02
+
+For each size it starts the fake Razorpay server (bench/fake_razorpay.py), seeds
+`user_details` with synthetic orders (mongomock by default, or a real mongod
+via --mongo-uri), and times each stage separately:
+
+    fetch_payments   sharded pull from the fake server
+    build_index      PaymentIndex over the pulled payments
+    orders_scan      the "scan" matcher over every order
+    na_diff          na_ids() for each payment status
+    csv_render       CSV rows for every payment (what /razorpay/payments-csv writes)
+    end_to_end       reconcile_payments_orders(mirror="off"), unless --skip-e2e
+
+Results are written to a JSON file (bench/results/ by default) so runs can be
+compared over time. mongomock scans are much slower than a real server; only
+compare mongomock numbers with other mongomock runs.
+"""
+import os, io, csv, sys, json, time, asyncio, argparse, platform, tempfile, subprocess
+from datetime import datetime, timezone
+from typing import Any, Dict, List
+
+from bench.fake_razorpay import FakeRazorpay, T0, payment_id, payment_amount
+
+ORDERS_DB_DEFAULT = "reconcile_bench"
+NA_STATUSES = ("captured", "failed", "refunded", "authorized")
+
+
+def _parse_args(argv: List[str]) -> argparse.Namespace:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--sizes", default="10000,100000", help="comma-separated payment counts")
+    ap.add_argument("--latency-ms", type=float, default=0.0, help="added to every fake Razorpay call")
+    ap.add_argument("--page-size", type=int, default=100,
+                    help="fake server's cap per page (Razorpay: 100; smaller ends the walk early)")
+    ap.add_argument("--throttle-rate", type=float, default=0.0, help="fraction of calls answered with 429")
+    ap.add_argument("--retry-after", type=float, default=None, help="Retry-After seconds sent with 429s")
+    ap.add_argument("--spacing", type=int, default=60, help="seconds between synthetic payments")
+    ap.add_argument("--rate", type=float, default=1000.0, help="client rate limit (RZP_RATE_PER_SEC)")
+    ap.add_argument("--match-ratio", type=float, default=0.9, help="share of payments with an order")
+    ap.add_argument("--orders-without-tx", type=float, default=0.1,
+                    help="extra orders with no transaction_id, as a share of payments")
+    ap.add_argument("--orders-batch-size", type=int, default=50_000)
+    ap.add_argument("--mongo-uri", default=None, help="use this mongod instead of mongomock")
+    ap.add_argument("--mongo-db", default=ORDERS_DB_DEFAULT,
+                    help="database whose user_details is dropped and reseeded")
+    ap.add_argument("--skip-e2e", action="store_true")
+    ap.add_argument("--out", default=None, help="result file (default bench/results/reconcile-<time>.json)")
+    return ap.parse_args(argv)
+
+
+def _configure_env(args: argparse.Namespace, base_url: str, workdir: str) -> None:
+    # the app reads these at import time, so set them before importing it
+    os.environ["RAZORPAY_API_BASE"] = base_url
+    os.environ.setdefault("RAZORPAY_KEY_ID", "bench")
+    os.environ.setdefault("RAZORPAY_KEY_SECRET", "bench")
+    os.environ["RZP_RATE_PER_SEC"] = str(args.rate)
+    os.environ["RZP_BURST"] = str(max(20, int(args.rate)))
+    os.environ["RZP_MIRROR_PATH"] = os.path.join(workdir, "payments_mirror.sqlite3")
+    os.environ["ORDERS_STATE_PATH"] = os.path.join(workdir, "orders_state.sqlite3")
+    os.environ["MONGO_DB"] = args.mongo_db
+    if args.mongo_uri:
+        os.environ["MONGO_URI"] = args.mongo_uri
+
+
+def _orders_collection(args: argparse.Namespace):
+    import app.services.orders_db as odb
+    if not args.mongo_uri:
+        import mongomock
+        odb._mongo_client = mongomock.MongoClient()
+    return odb.get_orders_collection()
+
+
+def _oid_at(ts: datetime):
+    from bson import ObjectId
+    # from_datetime() zeroes the tail; keep the timestamp, randomize the rest
+    return ObjectId(ObjectId.from_datetime(ts).binary[:4] + os.urandom(8))
+
+
+def _seed_orders(coll, n_payments: int, args: argparse.Namespace) -> int:
+    coll.drop()
+    cut = int(args.match_ratio * 1000)
+    extra = int(n_payments * args.orders_without_tx)
+    batch: List[Dict[str, Any]] = []
+    total = 0
+
+    def _flush() -> None:
+        nonlocal batch, total
+        if batch:
+            coll.insert_many(batch, ordered=False)
+            total += len(batch)
+            batch = []
+
+    for i in range(n_payments):
+        if (i * 40503) % 1000 >= cut:
+            continue  # payment left without an order
+        ts = datetime.fromtimestamp(T0 + i * args.spacing, tz=timezone.utc)
+        batch.append({
+            "_id": _oid_at(ts),
+            "transaction_id": payment_id(i),
+            "order_id": f"#{100000 + i}",
+            "paid": True,
+            "price": payment_amount(i) / 100,
+            "currency": "INR",
+            "updated_at": ts,
+        })
+        if len(batch) >= 10_000:
+            _flush()
+    for j in range(extra):
+        ts = datetime.fromtimestamp(T0 + (j * n_payments // max(1, extra)) * args.spacing, tz=timezone.utc)
+        batch.append({"_id": _oid_at(ts), "order_id": f"#D{j}", "paid": False, "updated_at": ts})
+        if len(batch) >= 10_000:
+            _flush()
+    _flush()
+    return total
+
+
+class _Stages:
+    def __init__(self):
+        self.timings: Dict[str, Dict[str, Any]] = {}
+
+    def record(self, name: str, started: float, **extra: Any) -> None:
+        self.timings[name] = {"seconds": round(time.perf_counter() - started, 4), **extra}
+
+
+async def _run_size(n: int, args: argparse.Namespace, fake: FakeRazorpay, coll) -> Dict[str, Any]:
+    import app.services.reconcile_engine as rec
+    from app.routers.razorpay_export import fetch_payments, razorpay_client, CSV_HEADER, COUNT, payment_rows
+    from app.services.payment_index import PaymentIndex
+
+    fake.payments = n
+    fake.reset_counters()
+    t = time.perf_counter()
+    n_orders = await asyncio.to_thread(_seed_orders, coll, n, args)
+    seed_seconds = round(time.perf_counter() - t, 4)
+
+    stages = _Stages()
+    client = razorpay_client()
+
+    t = time.perf_counter()
+    payments = await fetch_payments(client, status_filter=None, from_unix=fake.from_unix,
+                                    to_unix=fake.to_unix, max_fetch=n)
+    stages.record("fetch_payments", t, payments=len(payments), requests=fake.requests,
+                  throttled=fake.throttled)
+
+    t = time.perf_counter()
+    index = PaymentIndex.build(payments, case_insensitive=False, norm=rec.norm)
+    stages.record("build_index", t, rows=len(index))
+
+    t = time.perf_counter()
+    docs, with_tx = await rec._match_by_scan(index, batch_size=args.orders_batch_size)
+    stages.record("orders_scan", t, orders=docs, orders_with_transaction_id=with_tx,
+                  matched=index.matched_count())
+
+    t = time.perf_counter()
+    na = {s: len(index.na_ids(s)) for s in NA_STATUSES}
+    stages.record("na_diff", t, na_counts=na)
+
+    t = time.perf_counter()
+    buf = io.StringIO()
+    w = csv.writer(buf)
+    w.writerow(CSV_HEADER)
+    for i in range(0, len(payments), COUNT):  # page by page, like the export
+        w.writerows(payment_rows(payments[i:i + COUNT]))
+    stages.record("csv_render", t, bytes=len(buf.getvalue().encode("utf-8")))
+    del buf, payments, index
+
+    if not args.skip_e2e:
+        fake.reset_counters()
+        t = time.perf_counter()
+        result = await rec.reconcile_payments_orders(
+            max_fetch=n,
+            from_date=datetime.fromtimestamp(fake.from_unix, tz=timezone.utc).isoformat(),
+            to_date=datetime.fromtimestamp(fake.to_unix, tz=timezone.utc).isoformat(),
+            mirror="off",
+            orders_batch_size=args.orders_batch_size,
+            match_strategy="scan",
+            na_status="captured",
+        )
+        stages.record("end_to_end", t, na_count=result["summary"]["na_count"],
+                      requests=fake.requests, throttled=fake.throttled)
+
+    return {"payments": n, "orders": n_orders, "seed_seconds": seed_seconds, "stages": stages.timings}
+
+
+def _git_rev() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+async def _main(args: argparse.Namespace) -> Dict[str, Any]:
+    sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+    fake = FakeRazorpay(payments=max(sizes), spacing=args.spacing, latency_ms=args.latency_ms,
+                        page_size=args.page_size, throttle_rate=args.throttle_rate,
+                        retry_after=args.retry_after)
+    base_url = fake.start()
+    try:
+        with tempfile.TemporaryDirectory(prefix="reconcile-bench-") as workdir:
+            _configure_env(args, base_url, workdir)
+            from app.services.razorpay_client import close_razorpay_clients
+
+            coll = _orders_collection(args)
+            runs = []
+            try:
+                for n in sizes:
+                    run = await _run_size(n, args, fake, coll)
+                    runs.append(run)
+                    print(json.dumps(run), flush=True)
+            finally:
+                await close_razorpay_clients()
+                if args.mongo_uri:
+                    coll.drop()
+    finally:
+        fake.stop()
+
+    return {
+        "benchmark": "reconcile",
+        "started_at": datetime.now(timezone.utc).isoformat(),
+        "git_rev": _git_rev(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "mongo": "mongod" if args.mongo_uri else "mongomock",
+        "config": {k: v for k, v in vars(args).items() if k not in ("out", "mongo_uri")},
+        "runs": runs,
+    }
+
+
+def main(argv: List[str] = None) -> None:
+    args = _parse_args(sys.argv[1:] if argv is None else argv)
+    if args.mongo_db == "candyman":
+        sys.exit("refusing to reseed the production database; pick another --mongo-db")
+    report = asyncio.run(_main(args))
+    out = args.out or os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), "results",
+        f"reconcile-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json",
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"wrote {out}")
+
+
+if __name__ == "__main__":
+    main()
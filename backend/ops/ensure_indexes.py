@@ -0,0 +1,50 @@
+# ops/ensure_indexes.py
+"""
+Create the user_details indexes the reconcile relies on. Run once per
+environment (and again after adding ORDERS_STATE_UPDATED_FIELD), with a user
+that may create indexes; the app itself only checks that they exist.
+
+    cd backend
+    MONGO_URI=... python -m ops.ensure_indexes [--dry-run]
+
+    transaction_id                 match_strategy=index and the live NA worker
+    $ORDERS_STATE_UPDATED_FIELD    match_strategy=incremental / the orders snapshot
+"""
+import os, sys, argparse
+from typing import List
+
+from pymongo import MongoClient
+
+
+def _wanted() -> List[str]:
+    fields = ["transaction_id"]
+    updated = os.getenv("ORDERS_STATE_UPDATED_FIELD", "").strip()
+    if updated:
+        fields.append(updated)
+    return fields
+
+
+def main(argv: List[str] = None) -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--mongo-uri", default=os.getenv("MONGO_URI"))
+    ap.add_argument("--mongo-db", default=os.getenv("MONGO_DB", "candyman"))
+    ap.add_argument("--dry-run", action="store_true", help="only report missing indexes")
+    args = ap.parse_args(argv)
+    if not args.mongo_uri:
+        sys.exit("MONGO_URI not set (or pass --mongo-uri)")
+
+    coll = MongoClient(args.mongo_uri)[args.mongo_db]["user_details"]
+    existing = {next(iter(spec["key"]))[0] for spec in coll.index_information().values()}
+    for field in _wanted():
+        if field in existing:
+            print(f"ok       {field}")
+        elif args.dry_run:
+            print(f"missing  {field}")
+        else:
+            # build in the background on servers that still distinguish it
+            name = coll.create_index(field, background=True)
+            print(f"created  {field} ({name})")
+
+
+if __name__ == "__main__":
+    main()
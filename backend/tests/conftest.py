@@ -0,0 +1,10 @@
+# tests/conftest.py
+import os, sys
+
+# run from backend/ or the repo root: `app` is a namespace package under backend/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# nothing here talks to real services; keep workers and warm-up off
+os.environ.setdefault("STARTUP_WARMUP", "0")
+os.environ.setdefault("RAZORPAY_KEY_ID", "rzp_test_key")
+os.environ.setdefault("RAZORPAY_KEY_SECRET", "rzp_test_secret")
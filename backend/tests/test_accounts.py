@@ -0,0 +1,34 @@
+# tests/test_accounts.py
+import pytest
+from fastapi import HTTPException
+
+import app.routers.razorpay_export as rx
+from app.services.reconcile_service import ReconcileParams
+
+
+@pytest.fixture
+def accounts(monkeypatch):
+    configured = {"Main": ("k1", "s1"), "Alt": ("k2", "s2")}
+    monkeypatch.setattr(rx, "ACCOUNTS", configured)
+    monkeypatch.setattr(rx, "PRIMARY_ACCOUNT", "Main")
+    monkeypatch.setattr(rx, "_ACCOUNTS_BY_LOWER", {n.lower(): n for n in configured})
+    return configured
+
+
+def test_names_resolve_case_insensitively(accounts):
+    assert rx.resolve_accounts("main, ALT,Main") == ["Main", "Alt"]
+    assert rx.resolve_accounts("all") == ["Main", "Alt"]
+    assert rx.resolve_accounts(None) == ["Main", "Alt"]
+
+
+def test_unknown_account_is_400(accounts):
+    with pytest.raises(HTTPException) as e:
+        rx.resolve_accounts("main,nope")
+    assert e.value.status_code == 400
+
+
+def test_job_key_ignores_account_case_and_order():
+    a = ReconcileParams(accounts="Main,alt").normalized()
+    b = ReconcileParams(accounts=" ALT , main").normalized()
+    assert a == b and a["accounts"] == "alt,main"
+    assert ReconcileParams(accounts="All").normalized()["accounts"] is None
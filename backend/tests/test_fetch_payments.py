@@ -0,0 +1,104 @@
+# tests/test_fetch_payments.py
+import asyncio, random
+
+import pytest
+
+import app.routers.razorpay_export as rx
+from app.routers.razorpay_export import _time_shards, fetch_payments, iter_payment_pages
+
+T0 = 1_700_000_000
+DAY = 86400
+STATUSES = ("captured", "failed", "refunded", "authorized")
+
+
+class _Response:
+    def __init__(self, body):
+        self._body = body
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self._body
+
+
+class FakeClient:
+    """GET /payments over a fixed list: newest first, inclusive from/to, count/skip paging."""
+
+    def __init__(self, payments):
+        self.payments = sorted(payments, key=lambda p: (p["created_at"], p["id"]), reverse=True)
+        self.calls = 0
+
+    async def get(self, url, params):
+        self.calls += 1
+        await asyncio.sleep(0)  # let shards interleave
+        lo, hi = params.get("from"), params.get("to")
+        rows = [p for p in self.payments
+                if (lo is None or p["created_at"] >= lo) and (hi is None or p["created_at"] <= hi)]
+        skip, count = params["skip"], params["count"]
+        return _Response({"items": rows[skip:skip + count]})
+
+
+def _payments(from_unix, to_unix, n, seed):
+    rng = random.Random(seed)
+    stamps = [rng.randint(from_unix, to_unix) for _ in range(n)]
+    # several payments on every shard edge, so boundary rows come back from two shards
+    for lo, _ in _time_shards(from_unix, to_unix, rx.FETCH_SHARDS)[1:]:
+        stamps += [lo] * 3
+    return [{"id": f"pay_{i:06d}", "created_at": ts, "status": rng.choice(STATUSES)}
+            for i, ts in enumerate(stamps)]
+
+
+async def _serial(client, **kw):
+    rows = []
+    async for batch in iter_payment_pages(client, **kw):
+        rows += batch
+    return rows
+
+
+@pytest.mark.parametrize("days, n", [(1, 400), (3, 1500), (10, 2500)])
+@pytest.mark.parametrize("max_fetch", [1, 50, 99, 100, 101, 777, 10_000])
+@pytest.mark.parametrize("status_filter", [None, "captured"])
+def test_sharded_fetch_equals_serial_walk(days, n, max_fetch, status_filter):
+    lo, hi = T0, T0 + days * DAY
+    client = FakeClient(_payments(lo, hi, n, seed=days * 1000 + n))
+    kw = dict(status_filter=status_filter, from_unix=lo, to_unix=hi, max_fetch=max_fetch)
+    serial = asyncio.run(_serial(client, **kw))
+    sharded = asyncio.run(fetch_payments(client, concurrency=4, **kw))
+    assert len(_time_shards(lo, hi, rx.FETCH_SHARDS)) > 1
+    assert [p["id"] for p in sharded] == [p["id"] for p in serial]
+    assert len(sharded) == min(max_fetch, len(serial))
+
+
+def test_no_lower_bound_keeps_the_open_oldest_shard():
+    hi = T0 + 2 * DAY
+    old = [{"id": "pay_ancient", "created_at": 1_000_000, "status": "captured"}]
+    client = FakeClient(_payments(T0, hi, 300, seed=7) + old)
+    kw = dict(status_filter=None, from_unix=None, to_unix=hi, max_fetch=10_000)
+    sharded = asyncio.run(fetch_payments(client, **kw))
+    assert sharded[-1]["id"] == "pay_ancient"
+    assert [p["id"] for p in sharded] == [p["id"] for p in asyncio.run(_serial(client, **kw))]
+
+
+def test_small_max_fetch_skips_older_shards():
+    lo, hi = T0, T0 + 10 * DAY
+    client = FakeClient(_payments(lo, hi, 5000, seed=3))
+    asyncio.run(_serial(client, status_filter=None, from_unix=lo, to_unix=hi, max_fetch=200))
+    serial_calls, client.calls = client.calls, 0
+    asyncio.run(fetch_payments(client, status_filter=None, from_unix=lo, to_unix=hi, max_fetch=200, concurrency=1))
+    asyncio.run(fetch_payments(client, status_filter=None, from_unix=lo, to_unix=hi, max_fetch=200, concurrency=4))
+    # the concurrent run may start a few shards early, but never walks the whole window
+    assert client.calls < serial_calls + len(_time_shards(lo, hi, rx.FETCH_SHARDS))
+
+
+def test_light_fetch_keeps_only_the_reconcile_fields():
+    lo, hi = T0, T0 + 3 * DAY
+    payments = _payments(lo, hi, 800, seed=11)
+    for p in payments:
+        p.update(amount=100, currency="INR", card={"last4": "1111"}, notes={"k": "v"})
+    client = FakeClient(payments)
+    kw = dict(status_filter=None, from_unix=lo, to_unix=hi, max_fetch=10_000)
+    full = asyncio.run(fetch_payments(client, concurrency=4, **kw))
+    light = asyncio.run(fetch_payments(client, concurrency=4, light=True, **kw))
+    assert all(set(p) == set(rx.LIGHT_FIELDS) for p in light)
+    assert light == [{k: p.get(k) for k in rx.LIGHT_FIELDS} for p in full]
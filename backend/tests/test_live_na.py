@@ -0,0 +1,109 @@
+# tests/test_live_na.py
+import asyncio, time
+
+import app.services.live_na as ln
+from app.services.live_na import LiveNa, PaymentFeed
+from app.services.reconcile_engine import norm
+
+DAY = 86400
+MUTABLE = 7 * DAY
+
+
+class FakeRazorpay:
+    """Payments by id (light, account-tagged), refunds by time, and a log of what was asked."""
+
+    def __init__(self):
+        self.payments = {}
+        self.refunds = []          # (created_at, account, payment_id)
+        self.list_calls = []
+        self.by_id_calls = []
+
+    def add(self, pid, status, age, account="main"):
+        self.payments[pid] = {"id": pid, "status": status, "created_at": int(time.time()) - age,
+                              "amount": 100, "currency": "INR", "account": account}
+
+    def refund(self, pid, status="refunded"):
+        self.payments[pid]["status"] = status
+        p = self.payments[pid]
+        self.refunds.append((int(time.time()), p["account"], pid))
+
+    async def list_since(self, from_unix):
+        self.list_calls.append(from_unix)
+        return [dict(p) for p in self.payments.values() if p["created_at"] >= from_unix]
+
+    async def by_id(self, ids):
+        self.by_id_calls.append({a: sorted(v) for a, v in ids.items()})
+        return [dict(self.payments[pid]) for pids in ids.values() for pid in pids]
+
+    async def refunded_since(self, from_unix):
+        out = {}
+        for at, account, pid in self.refunds:
+            if at >= from_unix:
+                out.setdefault(account, []).append(pid)
+        return out
+
+    def feed(self):
+        return PaymentFeed(list_since=self.list_since, by_id=self.by_id, refunded_since=self.refunded_since)
+
+
+def _matched(orders):
+    async def matched(keys):
+        return {k for k in keys if k in orders}
+    return matched
+
+
+def _na(tracker):
+    return set(tracker.read()["na_payment_ids"])
+
+
+def test_poll_lists_only_new_payments_and_rechecks_the_rest_by_id():
+    rzp = FakeRazorpay()
+    rzp.add("pay_cap_na", "captured", 3 * DAY)
+    rzp.add("pay_cap_ok", "captured", 2 * DAY)
+    rzp.add("pay_auth", "authorized", DAY)
+    rzp.add("pay_created", "created", 2 * DAY)
+    rzp.add("pay_auth_old", "authorized", 10 * DAY)   # past the mutable window
+    rzp.add("pay_refund_me", "captured", 4 * DAY)
+    rzp.add("pay_partial", "captured", 5 * DAY)
+    rzp.add("pay_newest", "failed", 60)
+    orders = {"pay_cap_ok"}
+
+    tracker = LiveNa(norm=norm, mutable_seconds=MUTABLE)
+    asyncio.run(tracker.resync(rzp.feed(), _matched(orders)))
+    assert _na(tracker) == {"pay_cap_na", "pay_refund_me", "pay_partial"}
+
+    # meanwhile: a new capture, an authorized payment captured, refunds (full and partial)
+    rzp.add("pay_new", "captured", 10)
+    rzp.payments["pay_auth"]["status"] = "captured"
+    rzp.refund("pay_refund_me")
+    rzp.refund("pay_partial", status="captured")
+    watermark = rzp.payments["pay_newest"]["created_at"]
+
+    asyncio.run(tracker.poll(rzp.feed(), _matched(orders)))
+    # one short list from just before the newest payment seen, never the whole window again
+    assert rzp.list_calls[-1] == watermark - ln.OVERLAP_SECONDS
+    assert rzp.by_id_calls[-1] == {"main": ["pay_auth", "pay_created", "pay_partial", "pay_refund_me"]}
+    assert _na(tracker) == {"pay_cap_na", "pay_new", "pay_auth", "pay_partial"}
+
+    # settled payments aren't fetched again (refunds inside the overlap are), and
+    # the list starts from the new watermark
+    asyncio.run(tracker.poll(rzp.feed(), _matched(orders)))
+    assert rzp.list_calls[-1] == rzp.payments["pay_new"]["created_at"] - ln.OVERLAP_SECONDS
+    assert rzp.by_id_calls[-1] == {"main": ["pay_created", "pay_partial"]}
+    assert _na(tracker) == {"pay_cap_na", "pay_new", "pay_auth", "pay_partial"}
+
+
+def test_pending_payments_are_rechecked_per_account():
+    rzp = FakeRazorpay()
+    rzp.add("pay_a", "authorized", DAY, account="main")
+    rzp.add("pay_b", "created", DAY, account="other")
+    tracker = LiveNa(norm=norm, mutable_seconds=MUTABLE)
+    asyncio.run(tracker.resync(rzp.feed(), _matched(set())))
+    assert _na(tracker) == set()
+
+    rzp.payments["pay_b"]["status"] = "captured"
+    asyncio.run(tracker.poll(rzp.feed(), _matched(set())))
+    # both were listed again inside the overlap, so no by-id fetch was needed
+    assert rzp.by_id_calls == []
+    assert _na(tracker) == {"pay_b"}
+    assert tracker.read(account="other")["na_payment_ids"] == ["pay_b"]
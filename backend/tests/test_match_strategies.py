@@ -0,0 +1,56 @@
+# tests/test_match_strategies.py
+import asyncio, random
+
+import mongomock
+import pytest
+
+import app.services.reconcile_engine as eng
+
+N_PAYMENTS = 600
+
+
+@pytest.fixture
+def orders(monkeypatch):
+    rng = random.Random(5)
+    payments = [{"id": f"pay_{i:06d}", "status": rng.choice(["captured", "failed", "refunded"]),
+                 "created_at": 1_700_000_000 - i, "amount": 100, "currency": "INR"}
+                for i in range(N_PAYMENTS)]
+    coll = mongomock.MongoClient().db.user_details
+    coll.insert_many(
+        [{"order_id": f"o{i}", "transaction_id": p["id"]} for i, p in enumerate(payments) if i % 3]
+        # orders for payments outside the pull, padded / blank ids, no id at all
+        + [{"order_id": f"x{i}", "transaction_id": f"pay_other{i}"} for i in range(9)]
+        + [{"transaction_id": " pay_000001 "}, {"transaction_id": "  "}, {"transaction_id": ""}]
+        + [{"order_id": f"y{i}"} for i in range(40)]
+    )
+
+    async def _load(accounts, *, status_filter, max_fetch, **kw):
+        return payments[:max_fetch], {accounts[0]: None}
+
+    monkeypatch.setattr(eng, "load_accounts_payments", _load)
+    monkeypatch.setattr(eng, "get_orders_collection", lambda: coll)
+    monkeypatch.setattr(eng, "_tx_index_ready", False)
+    return coll
+
+
+def _summary(match_strategy):
+    result = asyncio.run(eng.reconcile_payments_orders(match_strategy=match_strategy, max_fetch=N_PAYMENTS))
+    return result["summary"]
+
+
+def test_index_and_scan_report_the_same_counts(orders):
+    orders.create_index("transaction_id")
+    scan, index = _summary("scan"), _summary("index")
+    assert (scan["match_strategy"], index["match_strategy"]) == ("scan", "index")
+    for key in ("orders_with_transaction_id", "matched_distinct_payment_ids", "na_count"):
+        assert index[key] == scan[key], key
+    # 400 linked orders, 9 for other payments, one padded id; blank ones don't count
+    assert scan["orders_with_transaction_id"] == 410
+
+
+def test_explicit_index_without_a_tx_index_says_what_ran(orders):
+    summary = _summary("index")
+    assert summary["match_strategy_requested"] == "index"
+    assert summary["match_strategy"] == "scan"
+    assert "no transaction_id index" in summary["match_strategy_note"]
+    assert "match_strategy_note" not in _summary("scan")
@@ -0,0 +1,99 @@
+# tests/test_orders_cursor.py
+import datetime as dt
+
+import mongomock
+import pytest
+from bson import ObjectId
+from fastapi import FastAPI, HTTPException
+from fastapi.testclient import TestClient
+
+import app.routers.reconcile as rec
+from app.routers.reconcile import _after_cursor, _decode_cursor, _encode_cursor
+
+
+def test_cursor_round_trip_keeps_bson_types():
+    oid = ObjectId()
+    when = dt.datetime(2025, 8, 15, 10, 30)  # naive UTC, as pymongo returns it
+    for value in (when, "Pune", 14.5, None):
+        got_value, got_id = _decode_cursor(_encode_cursor(value, oid))
+        assert (got_value, got_id) == (value, oid)
+
+
+def test_cursor_is_url_safe():
+    cursor = _encode_cursor("a/b+c?", ObjectId())
+    assert "=" not in cursor and "/" not in cursor and "+" not in cursor
+
+
+@pytest.mark.parametrize("cursor", ["not-a-cursor", "", "e30"])
+def test_bad_cursor_is_400(cursor):
+    with pytest.raises(HTTPException) as e:
+        _decode_cursor(cursor)
+    assert e.value.status_code == 400
+
+
+def test_after_cursor_with_null_value():
+    oid = ObjectId()
+    assert _after_cursor("name", 1, None, oid) == {
+        "$or": [{"name": None, "_id": {"$gt": oid}}, {"name": {"$ne": None}}]}
+    assert _after_cursor("name", -1, None, oid) == {"name": None, "_id": {"$lt": oid}}
+
+
+# ---- pages of /reconcile/orders ----
+
+@pytest.fixture
+def client(monkeypatch):
+    coll = mongomock.MongoClient().db.user_details
+    base = dt.datetime(2025, 8, 1)
+    docs = []
+    for i in range(23):
+        docs.append({
+            "_id": ObjectId(),
+            "order_id": f"o{i}",
+            "paid": i != 5,
+            # ties and missing values, so _id has to break them
+            "created_at": base + dt.timedelta(days=i // 4),
+            "name": None if i % 7 == 0 else f"n{i % 3}",
+            "book_style": "hard" if i % 2 else "soft",
+        })
+    coll.insert_many(docs)
+    monkeypatch.setattr(rec, "get_orders_collection", lambda: coll)
+    app = FastAPI()
+    app.include_router(rec.router)
+    with TestClient(app) as tc:
+        yield tc
+
+
+def _all_pages(client, **params):
+    ids, cursor, pages = [], None, 0
+    while True:
+        q = dict(params, limit=4, fields="order_id")
+        if cursor:
+            q["cursor"] = cursor
+        r = client.get("/reconcile/orders", params=q)
+        assert r.status_code == 200, r.text
+        body = r.json()
+        assert len(body["items"]) <= 4
+        ids += [row["order_id"] for row in body["items"]]
+        pages += 1
+        cursor = body["next_cursor"]
+        if cursor is None:
+            return ids, pages
+
+
+@pytest.mark.parametrize("params", [
+    {},
+    {"sort_dir": "desc"},
+    {"sort_by": "name"},
+    {"sort_by": "name", "sort_dir": "desc"},
+    {"sort_by": "order_id", "filter_book_style": "hard"},
+])
+def test_pages_cover_the_full_list_once(client, params):
+    full = [row["order_id"] for row in client.get("/reconcile/orders", params=dict(params, fields="order_id")).json()]
+    paged, pages = _all_pages(client, **params)
+    assert sorted(paged) == sorted(full)
+    assert len(paged) == len(set(paged))
+    assert pages == -(-len(full) // 4)
+
+
+def test_unknown_field_is_400(client):
+    assert client.get("/reconcile/orders", params={"fields": "order_id,nope"}).status_code == 400
@@ -0,0 +1,168 @@
+# tests/test_orders_snapshot.py
+import asyncio, logging
+from collections import Counter
+from datetime import datetime, timedelta
+
+import mongomock
+import pytest
+from fastapi import HTTPException
+
+import app.services.orders_state as os_
+import app.services.reconcile_engine as eng
+from app.services.orders_snapshot import OrdersSnapshot
+from app.services.orders_state import OrdersState
+from app.services.reconcile_engine import norm
+
+T0 = datetime(2024, 1, 1)
+
+
+class Clock:
+    def __init__(self):
+        self.now = T0
+
+    def tick(self):
+        self.now += timedelta(seconds=1)
+        return self.now
+
+
+class Replay:
+    """A listener that rebuilds tx -> orders from the change feed alone."""
+
+    def __init__(self):
+        self.counts = Counter()
+        self.valid = True
+        self.events = []
+
+    def __call__(self, kind, removed, added):
+        self.events.append(kind)
+        if kind == "reset":
+            self.counts, self.valid = Counter(), True
+        elif kind == "change":
+            self.counts.subtract(removed)
+            self.counts.update(added)
+        elif kind == "abort":
+            self.valid = False
+
+    def result(self):
+        return {tx: n for tx, n in self.counts.items() if n}
+
+
+def _truth(coll):
+    counts = Counter()
+    for doc in coll.find({}, {"transaction_id": 1}):
+        tx = norm(str(doc.get("transaction_id") or ""), case_insensitive=False)
+        if tx:
+            counts[tx] += 1
+    return dict(counts)
+
+
+def _assert_in_step(snapshot, state, coll):
+    truth = _truth(coll)
+    probe = list(truth) + ["pay_missing"]
+    assert dict(snapshot.counts(probe, case_insensitive=False)) == truth
+    assert snapshot.orders_with_tx() == sum(truth.values())
+    assert state.tx_counts() == truth
+    lower = Counter()
+    for tx, n in truth.items():
+        lower[tx.lower()] += n
+    assert dict(snapshot.counts(list(lower), case_insensitive=True)) == dict(lower)
+
+
+@pytest.fixture
+def setup(tmp_path, monkeypatch):
+    monkeypatch.setattr(os_, "UPDATED_FIELD", "updated_at")
+    coll = mongomock.MongoClient().db.user_details
+    coll.create_index("updated_at")
+    clock = Clock()
+    orders = []
+    for i in range(300):
+        doc = {"order_id": f"o{i}", "updated_at": clock.tick()}
+        if i % 7:
+            # some payments have two orders, some ids carry stray whitespace
+            doc["transaction_id"] = f"pay_{i // 2:05d}" + (" " if i % 11 == 0 else "")
+        orders.append(doc)
+    coll.insert_many(orders)
+    state = OrdersState(str(tmp_path / "orders_state.sqlite3"))
+    replay = Replay()
+    state.subscribe(replay)
+    snapshot = OrdersSnapshot(state)
+    return coll, clock, state, snapshot, replay
+
+
+def _refresh(snapshot, coll, **kw):
+    return snapshot.refresh(coll, norm=norm, batch_size=40, **kw)
+
+
+def test_incremental_refresh_tracks_new_and_modified_orders(setup):
+    coll, clock, state, snapshot, replay = setup
+    info = _refresh(snapshot, coll)
+    assert info["full_rescan"] and snapshot.loaded
+    _assert_in_step(snapshot, state, coll)
+    assert replay.result() == _truth(coll)
+
+    # new orders, an order that gets its id later, one that changes it, one that loses it
+    coll.insert_many([{"order_id": f"n{i}", "transaction_id": f"pay_new{i}", "updated_at": clock.tick()}
+                      for i in range(25)])
+    coll.update_one({"order_id": "o0"}, {"$set": {"transaction_id": "pay_late", "updated_at": clock.tick()}})
+    coll.update_one({"order_id": "o5"}, {"$set": {"transaction_id": "pay_00100", "updated_at": clock.tick()}})
+    coll.update_one({"order_id": "o8"}, {"$unset": {"transaction_id": ""}, "$set": {"updated_at": clock.tick()}})
+
+    info = _refresh(snapshot, coll)
+    assert not info["full_rescan"]
+    assert info["docs_read"] == 28
+    _assert_in_step(snapshot, state, coll)
+    assert replay.result() == _truth(coll)
+    assert replay.events[-1] == "done"
+
+
+def test_full_rebuild_by_another_syncer_is_swapped_in(setup):
+    coll, clock, state, snapshot, replay = setup
+    _refresh(snapshot, coll)
+    # a delete never bumps updated_at; only a full rebuild drops it
+    coll.delete_one({"order_id": "o3"})
+    coll.insert_one({"order_id": "n0", "transaction_id": "pay_new", "updated_at": clock.tick()})
+
+    # e.g. an "incremental" reconcile sharing the state
+    state.sync(coll, norm=norm, batch_size=40, full=True)
+    assert "reset" in replay.events
+    _assert_in_step(snapshot, state, coll)
+    assert replay.result() == _truth(coll)
+
+
+def test_aborted_refresh_is_rolled_back_and_reloaded(setup):
+    coll, clock, state, snapshot, replay = setup
+    _refresh(snapshot, coll)
+    coll.insert_many([{"order_id": f"n{i}", "transaction_id": f"pay_new{i}", "updated_at": clock.tick()}
+                      for i in range(100)])
+
+    def _stop(docs_read):
+        raise RuntimeError("stop")
+
+    with pytest.raises(RuntimeError):
+        _refresh(snapshot, coll, on_batch=_stop)
+    assert replay.events[-1] == "abort" and not replay.valid
+    assert not snapshot.loaded  # reported changes were rolled back: reload, don't trust them
+    assert snapshot.errors == 1
+
+    _refresh(snapshot, coll)
+    assert snapshot.loaded
+    _assert_in_step(snapshot, state, coll)
+
+
+# unset, or set but not indexed
+@pytest.mark.parametrize("field", ["", "updated_at"])
+def test_refresher_refuses_to_start_without_an_indexed_updated_field(tmp_path, monkeypatch, caplog, field):
+    monkeypatch.setattr(os_, "UPDATED_FIELD", field)
+    coll = mongomock.MongoClient().db.user_details
+    coll.insert_one({"order_id": "o1", "transaction_id": "pay_1"})
+    snapshot = OrdersSnapshot(OrdersState(str(tmp_path / "orders_state.sqlite3")))
+    monkeypatch.setattr(eng, "get_orders_snapshot", lambda: snapshot)
+    monkeypatch.setattr(eng, "get_orders_collection", lambda: coll)
+
+    with pytest.raises(HTTPException):
+        snapshot.state.check_updated_field(coll)
+    with caplog.at_level(logging.WARNING, logger="app.reconcile"):
+        asyncio.run(asyncio.wait_for(eng.keep_orders_snapshot_fresh(), timeout=5))
+    assert len(caplog.records) == 1
+    assert "orders snapshot disabled" in caplog.records[0].getMessage()
+    assert not snapshot.loaded
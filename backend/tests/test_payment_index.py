@@ -0,0 +1,115 @@
+# tests/test_payment_index.py
+import pytest
+
+from app.services.reconcile_engine import norm
+from app.services.payment_index import PaymentIndex
+
+PAYMENTS = [
+    {"id": "pay_1", "status": "captured", "account": "main", "amount": 1000, "currency": "inr"},
+    {"id": "pay_2", "status": "captured", "account": "main", "amount": 2000, "currency": "INR"},
+    {"id": "pay_3", "status": "failed", "account": "main"},
+    {"id": "pay_4", "status": "captured", "account": "alt", "amount": "oops"},
+    {"id": "pay_5", "status": " Captured ", "account": "alt"},
+    {"id": "", "status": "captured", "account": "alt"},
+]
+
+
+def _index(**kw) -> PaymentIndex:
+    kw.setdefault("case_insensitive", False)
+    return PaymentIndex.build(PAYMENTS, norm=norm, **kw)
+
+
+def test_na_ids_are_unmatched_rows_with_the_status():
+    idx = _index()
+    assert len(idx) == 5
+    idx.mark("pay_1")
+    idx.mark("pay_3")
+    assert idx.na_ids("captured") == ["pay_2", "pay_4", "pay_5"]
+    assert idx.na_ids("failed") == []
+    assert idx.na_ids("refunded") == []
+    assert idx.matched_count() == 2
+
+
+def test_mark_unknown_key_is_a_miss():
+    idx = _index()
+    assert idx.mark("pay_404") is None
+    assert idx.matched_count() == 0
+
+
+def test_duplicate_orders_are_reported():
+    idx = _index()
+    idx.mark("pay_2")
+    idx.mark_rows([idx.row("pay_2"), idx.row("pay_4")])
+    assert idx.duplicate_ids() == ["pay_2"]
+    assert idx.matched_count() == 2
+
+
+def test_match_counter_saturates():
+    idx = _index()
+    idx.mark("pay_1", orders=300)
+    idx.mark_rows([idx.row("pay_1")])
+    assert idx.matched[idx.row("pay_1")] == 255
+
+
+def test_duplicate_payment_id_last_one_wins():
+    idx = PaymentIndex.build(
+        [{"id": "pay_1", "status": "captured"}, {"id": "pay_1", "status": "refunded"}],
+        case_insensitive=False, norm=norm,
+    )
+    assert len(idx) == 1
+    assert idx.na_ids("captured") == []
+    assert idx.na_ids("refunded") == ["pay_1"]
+
+
+def test_case_insensitive_keys_keep_raw_ids():
+    idx = PaymentIndex.build(
+        [{"id": "Pay_AbC", "status": "captured"}, {"id": "pay_xyz", "status": "captured"}],
+        case_insensitive=True, norm=norm,
+    )
+    assert "pay_abc" in idx
+    idx.mark("pay_xyz")
+    assert idx.na_ids("captured") == ["Pay_AbC"]
+
+
+
+
+
+
+def test_too_many_codes():
+    idx = PaymentIndex(case_insensitive=False)
+    for i in range(256):
+        idx.add(f"pay_{i}", f"pay_{i}", f"s{i}")
+    with pytest.raises(ValueError):
+        idx.add("pay_x", "pay_x", "one_too_many")
+
+
+def test_amount_columns():
+    idx = _index(amounts=True)
+    row = idx.row("pay_1")
+    assert (idx.amount[row], idx.currency_name(row)) == (1000, "INR")
+    assert idx.currency_name(idx.row("pay_2")) == "INR"
+    assert idx.amount[idx.row("pay_4")] == 0
+
+def test_account_masks():
+    idx = _index(accounts=True)
+    idx.mark("pay_1")
+    idx.mark("pay_4")
+    assert idx.account_names() == ["main", "alt"]
+    assert idx.na_ids("captured", account="main") == ["pay_2"]
+    assert idx.na_ids("captured", account="alt") == ["pay_5"]
+    assert idx.na_ids("captured", account="nope") == []
+    assert idx.account_counts("captured") == {
+        "main": {"total_payments_rows": 3, "matched_distinct_payment_ids": 1, "na_count": 1},
+        "alt": {"total_payments_rows": 2, "matched_distinct_payment_ids": 1, "na_count": 1},
+    }
+
+def test_account_counts_add_up_to_the_totals():
+    idx = _index(accounts=True)
+    idx.mark("pay_2")
+    counts = idx.account_counts("captured")
+    assert sum(c["total_payments_rows"] for c in counts.values()) == len(idx)
+    assert sum(c["matched_distinct_payment_ids"] for c in counts.values()) == idx.matched_count()
+    assert sum(c["na_count"] for c in counts.values()) == len(idx.na_ids("captured"))
+
+def test_without_accounts_there_are_no_account_names():
+    assert _index().account_names() == []
\ No newline at end of file
@@ -0,0 +1,102 @@
+# tests/test_payment_rows.py
+import csv, io, time
+
+import pytest
+
+import app.routers.razorpay_export as rx
+from app.routers.razorpay_export import amount_to_display, payment_rows, ts_to_ddmmyyyy_hhmmss
+from bench.fake_razorpay import make_payment
+
+
+def _reference_row(p):
+    """The per-row formatter payment_rows replaced, kept verbatim as the oracle."""
+    upi = p.get("upi") or {}
+    acq = p.get("acquirer_data") or {}
+    vpa = p.get("vpa") or upi.get("vpa") or ""
+    flow = upi.get("flow", "")
+    notes = p.get("notes") or ""
+    notes_str = "" if notes == "" else str(notes)
+    return [
+        p.get("id",""),
+        amount_to_display(p.get("amount")),
+        p.get("currency",""),
+        p.get("status",""),
+        p.get("order_id",""),
+        p.get("invoice_id",""),
+        str(p.get("international","") if p.get("international") is not None else ""),
+        p.get("method",""),
+        amount_to_display(p.get("amount_refunded")),
+        p.get("refund_status","") if p.get("refund_status") is not None else "",
+        str(p.get("captured","") if p.get("captured") is not None else ""),
+        p.get("description",""),
+        p.get("card_id","") if p.get("card_id") is not None else "",
+        p.get("bank","") if p.get("bank") is not None else "",
+        p.get("wallet","") if p.get("wallet") is not None else "",
+        vpa,
+        p.get("email",""),
+        p.get("contact",""),
+        notes_str,
+        amount_to_display(p.get("fee")),
+        amount_to_display(p.get("tax")),
+        p.get("error_code","") if p.get("error_code") is not None else "",
+        p.get("error_description","") if p.get("error_description") is not None else "",
+        ts_to_ddmmyyyy_hhmmss(p.get("created_at")),
+        acq.get("rrn",""),
+        acq.get("authentication_reference_number",""),
+        acq.get("auth_code",""),
+        flow,
+    ]
+
+
+def _csv(rows) -> bytes:
+    buf = io.StringIO()
+    csv.writer(buf, quoting=csv.QUOTE_MINIMAL).writerows(rows)
+    return buf.getvalue().encode("utf-8")
+
+
+# DST switches in New York and Lord Howe (half-hour shift), around midnight and leap days
+_EDGE_TIMES = [0, 1_710_054_000, 1_710_053_999, 1_730_613_600, 1_712_419_200, 1_712_417_400,
+               1_709_164_800, 1_709_251_199, 1_735_689_599, 1_735_689_600, 4_102_444_800]
+
+def _payments():
+    out = [make_payment(i, spacing=3917) for i in range(2000)]
+    for i, ts in enumerate(_EDGE_TIMES):
+        p = make_payment(i, spacing=60)
+        p["created_at"] = ts
+        out.append(p)
+    out += [
+        {"id": "pay_bare"},                                               # every other key missing
+        {"id": "pay_nulls", "amount": None, "created_at": None, "upi": None, "notes": None,
+         "international": None, "captured": None, "refund_status": None, "acquirer_data": None},
+        {"id": "pay_odd", "amount": "1485", "fee": 12.5, "tax": "oops", "created_at": "2025-08-15T10:30:00",
+         "international": False, "captured": True, "notes": {}, "vpa": "", "upi": {"vpa": "x@upi"}},
+        {"id": "pay_float_ts", "amount": 100, "created_at": 1_700_000_000.7},
+        {"id": "pay_str_ts", "amount": 0, "created_at": "1700000000"},
+        {"id": "pay_quote", "description": 'a "quoted", comma\nline', "notes": {"k": "v,w"}},
+    ]
+    return out
+
+
+@pytest.mark.parametrize("tz", ["UTC", "Asia/Kolkata", "America/New_York", "Australia/Lord_Howe"])
+def test_payment_rows_match_the_per_row_formatter(tz, monkeypatch):
+    if not hasattr(time, "tzset"):
+        pytest.skip("needs time.tzset")
+    monkeypatch.setenv("TZ", tz)
+    time.tzset()
+    # the offset caches assume one process-wide timezone; start clean for each
+    monkeypatch.setattr(rx, "_utc_day_offsets", {})
+    monkeypatch.setattr(rx, "_local_day_strings", {})
+    try:
+        payments = _payments()
+        expected = [_reference_row(p) for p in payments]
+        for size in (1, 7, 100, len(payments)):
+            got = [row for i in range(0, len(payments), size) for row in payment_rows(payments[i:i + size])]
+            assert [list(r) for r in got] == expected
+            assert _csv(got) == _csv(expected)
+    finally:
+        monkeypatch.undo()
+        time.tzset()
+
+
+def test_empty_page():
+    assert payment_rows([]) == []
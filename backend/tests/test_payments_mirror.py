@@ -0,0 +1,160 @@
+# tests/test_payments_mirror.py
+import asyncio
+
+import pytest
+
+import app.services.payments_mirror as pm
+from app.routers.razorpay_export import RZP_BASE
+from app.services.payments_mirror import PaymentsMirror
+
+NOW = 1_760_000_000
+DAY = 86400
+
+
+class _Response:
+    def __init__(self, body, status=200):
+        self._body, self.status_code = body, status
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise RuntimeError(f"HTTP {self.status_code}")
+
+    def json(self):
+        return self._body
+
+
+class FakeRazorpay:
+    """/payments (list and by id) and /refunds over in-memory dicts; records every call."""
+
+    def __init__(self):
+        self.payments = {}
+        self.refunds = []        # (created_at, payment_id)
+        self.calls = []
+        self.fail_after = None   # raise on the n-th list call (for interrupted syncs)
+
+    def add(self, pid, created_at, status):
+        self.payments[pid] = {"id": pid, "created_at": created_at, "status": status, "amount": 100}
+
+    async def get(self, url, params=None):
+        params = params or {}
+        await asyncio.sleep(0)
+        path = url[len(RZP_BASE):]
+        self.calls.append((path, params))
+        if path.startswith("/payments/"):
+            return _Response(dict(self.payments[path.rsplit("/", 1)[1]]))
+        lo, hi = params.get("from"), params.get("to")
+        if path == "/refunds":
+            rows = [{"payment_id": pid} for ts, pid in self.refunds if lo is None or ts >= lo]
+        else:
+            if self.fail_after is not None and len(self.calls) > self.fail_after:
+                return _Response({}, status=500)
+            rows = sorted((dict(p) for p in self.payments.values()
+                           if (lo is None or p["created_at"] >= lo) and (hi is None or p["created_at"] <= hi)),
+                          key=lambda p: (p["created_at"], p["id"]), reverse=True)
+        return _Response({"items": rows[params["skip"]:params["skip"] + params["count"]]})
+
+    def list_calls(self):
+        return [params for path, params in self.calls if path == "/payments"]
+
+
+@pytest.fixture
+def env(tmp_path, monkeypatch):
+    monkeypatch.setattr(pm, "MIN_SYNC_INTERVAL", 0)
+    monkeypatch.setattr(pm.time, "time", lambda: NOW)
+    rzp = FakeRazorpay()
+    for i in range(500):
+        rzp.add(f"pay_{i:04d}", NOW - 60 * DAY + i * 2 * 3600, "captured" if i % 5 else "failed")
+    return rzp, PaymentsMirror(str(tmp_path / "mirror.sqlite3"))
+
+
+def _mirror_rows(mirror):
+    rows = asyncio.run(mirror.query(status_filter=None, from_unix=None, to_unix=None, max_fetch=10**6))
+    return {p["id"]: p["status"] for p in rows}
+
+
+def _truth(rzp):
+    return {pid: p["status"] for pid, p in rzp.payments.items()}
+
+
+def test_first_sync_pulls_everything(env):
+    rzp, mirror = env
+    info = asyncio.run(mirror.sync(rzp))
+    assert info["mode"] == "full" and info["fetched"] >= 500
+    assert _mirror_rows(mirror) == _truth(rzp)
+    assert info["watermark"] == max(p["created_at"] for p in rzp.payments.values())
+
+
+def test_incremental_sync_lists_only_new_payments(env):
+    rzp, mirror = env
+    asyncio.run(mirror.sync(rzp))
+    watermark = mirror.watermark()
+
+    rzp.add("pay_new1", NOW - 600, "captured")
+    rzp.add("pay_new2", NOW - 60, "authorized")
+    rzp.payments["pay_0499"]["status"] = "refunded"           # old captured payment, refunded since
+    rzp.refunds.append((NOW - 300, "pay_0499"))
+    rzp.payments["pay_0001"]["status"] = "refunded"           # refunded, but the refund predates the last sync
+    rzp.calls.clear()
+
+    info = asyncio.run(mirror.sync(rzp))
+    assert info["mode"] == "incremental"
+    assert all(params["from"] >= watermark - pm.OVERLAP_SECONDS for params in rzp.list_calls())
+    assert len(rzp.list_calls()) == 1
+    rows = _mirror_rows(mirror)
+    assert rows["pay_new1"] == "captured" and rows["pay_new2"] == "authorized"
+    assert rows["pay_0499"] == "refunded"
+    assert rows["pay_0001"] == "captured"                      # only refunds since the last sync are followed
+
+
+def test_pending_payments_are_rechecked_by_id(env):
+    rzp, mirror = env
+    rzp.add("pay_auth_recent", NOW - DAY, "authorized")
+    rzp.add("pay_auth_old", NOW - 30 * DAY, "authorized")
+    rzp.add("pay_latest", NOW - 60, "captured")               # the watermark: the overlap won't reach back a day
+    asyncio.run(mirror.sync(rzp))
+    rzp.payments["pay_auth_recent"]["status"] = "captured"
+    rzp.payments["pay_auth_old"]["status"] = "captured"
+    rzp.calls.clear()
+
+    info = asyncio.run(mirror.sync(rzp))
+    by_id = [path for path, _ in rzp.calls if path.startswith("/payments/")]
+    rows = _mirror_rows(mirror)
+    assert rows["pay_auth_recent"] == "captured"
+    assert rows["pay_auth_old"] == "authorized"              # past the mutable window: left alone
+    assert by_id == ["/payments/pay_auth_recent"]
+    assert info["pending_rechecked"] == 1
+
+
+def test_second_sync_without_changes_is_cheap(env):
+    rzp, mirror = env
+    asyncio.run(mirror.sync(rzp))
+    rzp.calls.clear()
+    info = asyncio.run(mirror.sync(rzp))
+    assert info["fetched"] <= 1                                # the overlap may re-list the newest row
+    assert [path for path, _ in rzp.calls] == ["/payments", "/refunds"]
+    assert _mirror_rows(mirror) == _truth(rzp)
+
+
+def test_interrupted_full_resync_keeps_the_old_rows(env):
+    rzp, mirror = env
+    asyncio.run(mirror.sync(rzp))
+    before = _mirror_rows(mirror)
+    rzp.add("pay_late", NOW - 10, "captured")
+    rzp.calls.clear()
+    rzp.fail_after = 2
+    with pytest.raises(RuntimeError):
+        asyncio.run(mirror.sync(rzp, full=True))
+    assert _mirror_rows(mirror) == before
+
+    rzp.fail_after = None
+    assert asyncio.run(mirror.sync(rzp, full=True))["mode"] == "full"
+    assert _mirror_rows(mirror) == _truth(rzp)
+
+
+def test_cached_when_synced_recently(env, monkeypatch):
+    rzp, mirror = env
+    asyncio.run(mirror.sync(rzp))
+    monkeypatch.setattr(pm, "MIN_SYNC_INTERVAL", 3600)
+    rzp.calls.clear()
+    assert asyncio.run(mirror.sync(rzp))["mode"] == "cached"
+    assert rzp.calls == []
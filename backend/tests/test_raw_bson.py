@@ -0,0 +1,75 @@
+# tests/test_raw_bson.py
+import bson
+import pytest
+from bson import ObjectId
+from bson.int64 import Int64
+
+from app.services.raw_bson import _walk_batch, scan_batch
+
+
+def _batch(*docs) -> bytes:
+    return b"".join(bson.encode(d) for d in docs)
+
+def _expected(data: bytes, field: str):
+    """What scan_batch promises, computed with the real decoder."""
+    docs = bson.decode_all(data)
+    values = [v if isinstance(v, str) else str(v) for v in (d.get(field) for d in docs) if v]
+    return len(docs), values, (docs[-1].get("_id") if docs else None)
+
+
+CASES = {
+    "plain": [{"_id": ObjectId(), "transaction_id": "pay_A"},
+              {"_id": ObjectId()},
+              {"_id": ObjectId(), "transaction_id": "pay_B"}],
+    "empty_value": [{"_id": ObjectId(), "transaction_id": ""}, {"_id": ObjectId(), "transaction_id": "pay_C"}],
+    "non_string_tx": [{"_id": ObjectId(), "transaction_id": 12345},
+                      {"_id": ObjectId(), "transaction_id": Int64(7)},
+                      {"_id": ObjectId(), "transaction_id": None},
+                      {"_id": ObjectId(), "transaction_id": 0},
+                      {"_id": ObjectId(), "transaction_id": "pay_D"}],
+    "string_id": [{"_id": ObjectId(), "transaction_id": "pay_E"}, {"_id": "order-17", "transaction_id": "pay_F"}],
+    "string_id_then_oid": [{"_id": "order-17", "transaction_id": "pay_F"}, {"_id": ObjectId(), "transaction_id": "pay_G"}],
+    "embedded_nul": [{"_id": ObjectId(), "transaction_id": "pay_\x00H"}, {"_id": ObjectId(), "transaction_id": "pay_I"}],
+    "nested_docs": [{"_id": ObjectId(), "shipping_address": {"city": "Pune", "transaction_id": "nope"},
+                     "transaction_id": "pay_J"},
+                    {"_id": ObjectId(), "items": [{"transaction_id": "nope"}], "paid": True},
+                    {"_id": ObjectId(), "transaction_id": {"id": "pay_K"}}],
+    "trailing_spaces": [{"_id": ObjectId(), "transaction_id": "  pay_L \t"}, {"_id": ObjectId(), "transaction_id": "pay_M "}],
+    "other_fields": [{"_id": ObjectId(), "order_id": "o1", "price": 14.5, "paid": True, "created_at": 3,
+                      "transaction_id": "pay_N", "name": "x"}],
+    "unicode": [{"_id": ObjectId(), "transaction_id": "pay_ünï"}],
+}
+
+
+@pytest.mark.parametrize("name", sorted(CASES))
+def test_scan_batch_matches_decoder(name):
+    data = _batch(*CASES[name])
+    assert scan_batch(data, "transaction_id") == _expected(data, "transaction_id")
+
+
+@pytest.mark.parametrize("name", sorted(CASES))
+def test_walk_batch_matches_decoder(name):
+    # the slow path must agree on its own, not only behind the regex fast path
+    data = _batch(*CASES[name])
+    assert _walk_batch(data, "transaction_id") == _expected(data, "transaction_id")
+
+
+def test_values_are_not_stripped():
+    data = _batch(*CASES["trailing_spaces"])
+    _, values, _ = scan_batch(data, "transaction_id")
+    assert values == ["  pay_L \t", "pay_M "]
+
+
+def test_embedded_nul_keeps_whole_value():
+    data = _batch(*CASES["embedded_nul"])
+    _, values, _ = scan_batch(data, "transaction_id")
+    assert values == ["pay_\x00H", "pay_I"]
+
+
+def test_last_id_is_string_id_when_last_doc_has_one():
+    data = _batch(*CASES["string_id"])
+    assert scan_batch(data, "transaction_id")[2] == "order-17"
+
+
+def test_empty_batch():
+    assert scan_batch(b"", "transaction_id") == (0, [], None)
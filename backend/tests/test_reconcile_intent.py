@@ -0,0 +1,40 @@
+# tests/test_reconcile_intent.py
+import pytest
+
+from app.main import _parse_reconcile_intent
+
+
+def _intent(from_date=None, to_date=None, na_status="captured", case_insensitive_ids=False):
+    return {"from_date": from_date, "to_date": to_date, "na_status": na_status,
+            "case_insensitive_ids": case_insensitive_ids}
+
+
+@pytest.mark.parametrize("message, expected", [
+    ("reconcile 2025-08-15 to 2025-08-25 captured only", _intent("2025-08-15", "2025-08-25")),
+    ("Reconcile payments from 2025-08-25 to 2025-08-15", _intent("2025-08-15", "2025-08-25")),
+    ("reconcile failed payments", _intent(na_status="failed")),
+    ("reconcile status refunded", _intent(na_status="refunded")),
+    ("reconcile from 2025-08-15", _intent("2025-08-15")),
+    ("reconcile till 2025-08-15", _intent(None, "2025-08-15")),
+    ("reconcile on 2025-08-15", _intent("2025-08-15", "2025-08-15T23:59:59")),
+    ("reconcile for 2025-08-15", _intent("2025-08-15", "2025-08-15T23:59:59")),
+    ("reconcile all time", _intent()),
+    ("reconcile case-insensitive", _intent(case_insensitive_ids=True)),
+    ("please run reconciliation ignoring case for 2025-01-01", _intent("2025-01-01", "2025-01-01T23:59:59", case_insensitive_ids=True)),
+])
+def test_simple_messages_are_parsed(message, expected):
+    assert _parse_reconcile_intent(message) == expected
+
+
+@pytest.mark.parametrize("message", [
+    "show me 2025-08-15 payments",                       # not a reconcile
+    "reconcile 2025-08-01 2025-08-02 2025-08-03",       # too many dates
+    "reconcile captured and failed",                     # two statuses
+    "reconcile all statuses",                            # scope word, no status
+    "reconcile all payments",
+    "reconcile any status",
+    "reconcile last week",
+    "reconcile status",
+])
+def test_other_messages_go_to_the_agent(message):
+    assert _parse_reconcile_intent(message) is None
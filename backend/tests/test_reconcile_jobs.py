@@ -0,0 +1,158 @@
+# tests/test_reconcile_jobs.py
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+import app.services.reconcile_jobs as reconcile_jobs
+from app.services.reconcile_jobs import ReconcileJobManager
+
+
+class Runner:
+    """Fake reconcile: counts calls, can be held open, fail, or hang."""
+
+    def __init__(self):
+        self.calls = 0
+        self.release = asyncio.Event()
+        self.fail_with = None
+
+    async def __call__(self, **params):
+        self.calls += 1
+        await self.release.wait()
+        if self.fail_with is not None:
+            raise self.fail_with
+        return {"params": params, "call": self.calls}
+
+
+def _manager(runner, **kw):
+    kw.setdefault("ttl_seconds", 60)
+    kw.setdefault("max_entries", 10)
+    return ReconcileJobManager(runner, **kw)
+
+
+def test_concurrent_callers_share_one_run():
+    async def main():
+        runner = Runner()
+        jobs = _manager(runner)
+        waiters = [asyncio.create_task(jobs.run({"a": 1})) for _ in range(5)]
+        await asyncio.sleep(0)
+        runner.release.set()
+        results = await asyncio.gather(*waiters)
+        assert runner.calls == 1
+        assert all(r == results[0] for r in results)
+    asyncio.run(main())
+
+
+def test_key_ignores_param_order():
+    assert ReconcileJobManager.key_for({"a": 1, "b": 2}) == ReconcileJobManager.key_for({"b": 2, "a": 1})
+
+
+def test_done_job_is_cached_until_ttl(monkeypatch):
+    async def main():
+        runner = Runner()
+        runner.release.set()
+        jobs = _manager(runner, ttl_seconds=10)
+        await jobs.run({"a": 1})
+        job, joined = jobs.submit({"a": 1})
+        assert joined and job.status == "done" and runner.calls == 1
+        # use_cache=False forces a fresh run
+        job, joined = jobs.submit({"a": 1}, use_cache=False)
+        assert not joined
+        await job.task
+        assert runner.calls == 2
+
+        now = reconcile_jobs.time.time()
+        monkeypatch.setattr(reconcile_jobs.time, "time", lambda: now + 11)
+        assert jobs.get(job.id) is None
+        _, joined = jobs.submit({"a": 1})
+        assert not joined
+    asyncio.run(main())
+
+
+def test_lru_evicts_finished_jobs_only():
+    async def main():
+        runner = Runner()
+        runner.release.set()
+        jobs = _manager(runner, max_entries=2)
+        first = (await asyncio.gather(jobs.run({"n": 1})))[0]
+        ids = []
+        for n in (1, 2):
+            job, _ = jobs.submit({"n": n})
+            await job.task
+            ids.append(job.id)
+        jobs.get(ids[0])  # touch n=1: n=2 is now least recently used
+        job3, _ = jobs.submit({"n": 3})
+        await job3.task
+        assert jobs.get(ids[0]) is not None
+        assert jobs.get(ids[1]) is None
+        assert first["call"] == 1
+
+        # a running job is never evicted, even past max_entries
+        runner.release.clear()
+        running = [jobs.submit({"slow": n})[0] for n in range(3)]
+        await asyncio.sleep(0)
+        assert all(jobs.get(j.id) is not None for j in running)
+        runner.release.set()
+        await asyncio.gather(*(j.task for j in running))
+    asyncio.run(main())
+
+
+def test_errors_are_raised_and_not_cached():
+    async def main():
+        runner = Runner()
+        runner.release.set()
+        runner.fail_with = HTTPException(502, detail="Razorpay said no")
+        jobs = _manager(runner)
+        with pytest.raises(HTTPException) as e:
+            await jobs.run({"a": 1})
+        assert (e.value.status_code, e.value.detail) == (502, "Razorpay said no")
+
+        runner.fail_with = RuntimeError("boom")
+        with pytest.raises(HTTPException) as e:
+            await jobs.run({"a": 1})
+        assert e.value.status_code == 500
+        assert runner.calls == 2
+
+        failed, _ = jobs.submit({"b": 1})
+        await failed.task
+        assert failed.status == "error" and jobs.get(failed.id) is failed
+    asyncio.run(main())
+
+
+@pytest.mark.parametrize("started", [True, False])
+def test_cancelled_job_reports_cancelled(started):
+    async def main():
+        runner = Runner()
+        jobs = _manager(runner)
+        waiter = asyncio.create_task(jobs.run({"a": 1}))
+        await asyncio.sleep(0)
+        job, _ = jobs.submit({"a": 1})
+        if started:
+            await asyncio.sleep(0)
+            assert runner.calls == 1
+        job.task.cancel()
+        with pytest.raises(HTTPException) as e:
+            await waiter
+        assert e.value.status_code == 503
+        assert job.status == "cancelled" and job.finished_at is not None
+        assert job.to_dict()["error"]["detail"] == "Reconcile job was cancelled"
+        # not served from the cache: the next caller starts over
+        _, joined = jobs.submit({"a": 1})
+        assert not joined
+        runner.release.set()
+    asyncio.run(main())
+
+
+def test_cancelled_caller_leaves_the_job_running():
+    async def main():
+        runner = Runner()
+        jobs = _manager(runner)
+        impatient = asyncio.create_task(jobs.run({"a": 1}))
+        patient = asyncio.create_task(jobs.run({"a": 1}))
+        await asyncio.sleep(0)
+        impatient.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await impatient
+        runner.release.set()
+        assert (await patient)["call"] == 1
+    asyncio.run(main())
@@ -0,0 +1,122 @@
+# tests/test_responses.py
+import gzip
+
+import pytest
+from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from fastapi.testclient import TestClient
+
+import app.services.responses as responses
+from app.services.responses import CompressionMiddleware, FastJSONResponse, choose_encoding
+
+BIG = "x" * 5000
+
+
+@pytest.fixture(params=["zstd", "no-zstd"])
+def zstd_state(request, monkeypatch):
+    if request.param == "no-zstd":
+        monkeypatch.setattr(responses, "zstandard", None)
+    elif responses.zstandard is None:
+        pytest.skip("zstandard not installed")
+    return request.param
+
+
+@pytest.mark.parametrize("header, with_zstd, without_zstd", [
+    ("", None, None),
+    ("gzip", "gzip", "gzip"),
+    ("gzip, zstd", "zstd", "gzip"),
+    ("zstd;q=0.5, gzip", "gzip", "gzip"),
+    ("zstd", "zstd", None),
+    ("gzip;q=0", None, None),
+    ("*", "zstd", "gzip"),
+    ("*;q=0, gzip;q=0.1", "gzip", "gzip"),
+    ("br", None, None),
+    ("GZIP;q=bad", None, None),
+])
+def test_choose_encoding(zstd_state, header, with_zstd, without_zstd):
+    assert choose_encoding(header) == (with_zstd if zstd_state == "zstd" else without_zstd)
+
+
+def _decode(r) -> bytes:
+    enc = r.headers.get("content-encoding")
+    if enc == "gzip":
+        return gzip.decompress(r.raw)
+    if enc == "zstd":
+        return responses.zstandard.ZstdDecompressor().decompressobj().decompress(r.raw)
+    return r.raw
+
+
+@pytest.fixture
+def client():
+    app = FastAPI()
+    app.add_middleware(CompressionMiddleware, path_prefixes=("/api",), minimum_size=1024)
+
+    @app.get("/api/big")
+    async def big():
+        return FastJSONResponse({"data": BIG})
+
+    @app.get("/api/small")
+    async def small():
+        return FastJSONResponse({"data": "x"})
+
+    @app.get("/api/stream")
+    async def stream():
+        async def rows():
+            for i in range(50):
+                yield f"row,{i}\n".encode()
+        return StreamingResponse(rows(), media_type="text/csv")
+
+    @app.get("/api/events")
+    async def events():
+        async def rows():
+            yield b"event: done\ndata: {}\n\n"
+        return StreamingResponse(rows(), media_type="text/event-stream")
+
+    @app.get("/other/big")
+    async def other():
+        return PlainTextResponse(BIG)
+
+    with TestClient(app) as tc:
+        yield tc
+
+
+def _get(client, path, accept):
+    # httpx would decode the body itself; keep the bytes as sent in r.raw
+    with client.stream("GET", path, headers={"Accept-Encoding": accept}) as r:
+        r.raw = b"".join(r.iter_raw())
+    return r
+
+
+@pytest.mark.parametrize("accept", ["gzip", "zstd"])
+def test_big_json_is_compressed(client, accept):
+    if accept == "zstd" and responses.zstandard is None:
+        pytest.skip("zstandard not installed")
+    r = _get(client, "/api/big", accept)
+    assert r.headers["content-encoding"] == accept
+    assert "accept-encoding" in r.headers["vary"].lower()
+    assert int(r.headers["content-length"]) == len(r.raw) < len(BIG)
+    assert _decode(r) == FastJSONResponse({"data": BIG}).body
+
+
+def test_small_json_is_not_compressed(client):
+    r = _get(client, "/api/small", "gzip")
+    assert "content-encoding" not in r.headers
+    assert r.raw == b'{"data":"x"}'
+
+
+def test_stream_is_compressed_without_length(client):
+    r = _get(client, "/api/stream", "gzip")
+    assert r.headers["content-encoding"] == "gzip"
+    assert "content-length" not in r.headers
+    assert _decode(r) == b"".join(f"row,{i}\n".encode() for i in range(50))
+
+
+def test_sse_passes_through(client):
+    r = _get(client, "/api/events", "gzip")
+    assert "content-encoding" not in r.headers
+    assert r.raw == b"event: done\ndata: {}\n\n"
+
+
+def test_other_paths_and_no_accept_pass_through(client):
+    assert "content-encoding" not in _get(client, "/other/big", "gzip").headers
+    assert "content-encoding" not in _get(client, "/api/big", "identity").headers
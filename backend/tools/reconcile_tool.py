@@ -1,9 +1,8 @@
 # tools/reconcile_tool.py
 from langchain.tools import tool
-import httpx, os
 from typing import Optional, Dict, Any
 
-API_BASE = os.getenv("INTERNAL_API_BASE", "http://127.0.0.1:8000")
+from app.services.reconcile_service import reconcile
 
 @tool("reconcile_orders_payments", return_direct=False)
 async def reconcile_orders_payments(
@@ -23,16 +22,10 @@ async def reconcile_orders_payments(
     Returns:
         JSON summary with counts and NA payment IDs
     """
-    url = f"{API_BASE}/reconcile/vlookup-payment-to-orders/auto"
-    params = {
-        "na_status": na_status,
-        "case_insensitive_ids": str(case_insensitive_ids).lower(),
-        "max_fetch": max_fetch,
-    }
-    if from_date: params["from_date"] = from_date
-    if to_date:   params["to_date"] = to_date
-
-    async with httpx.AsyncClient(timeout=120.0) as client:
-        resp = await client.get(url, params=params)
-        resp.raise_for_status()
-        return resp.json()
+    return await reconcile(
+        from_date=from_date,
+        to_date=to_date,
+        na_status=na_status,
+        case_insensitive_ids=case_insensitive_ids,
+        max_fetch=max_fetch,
+    )